@@ -0,0 +1,173 @@
+"""Funnel and velocity reports over the stage history (stage_history.py).
+
+Each report is one SQL statement over ``stage_changes`` in the user's scope;
+no record's history is replayed in Python.
+
+- funnel: how many records reached each stage of ``FUNNELS``. A record
+  counts for every stage up to the furthest one it reached, so skipping a
+  stage does not leak out of the funnel.
+- conversion rates: where records went next from each stage, as a share of
+  everything that left it.
+- time in stage: how long stays in each stage lasted, from ``LEAD()`` over
+  each record's history, and how many records are in the stage now.
+- cohorts: the funnel per month in which records entered it.
+
+``from``/``to`` (YYYY-MM-DD, inclusive) limit the funnel and cohorts to
+records that entered in that period, and the other two reports to stage
+changes made in it.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, func, select
+
+from models import StageChange
+from reports import month_of
+
+FUNNELS = {
+    'leads': ('MQL', 'SAL', 'SQL', 'Converted'),
+    'opportunities': ('Prospecting', 'Qualification', 'Proposal', 'Negotiation', 'Closed Won'),
+}
+
+
+def parse_analytics_args(args):
+    """Read ``from``/``to`` dates (YYYY-MM-DD); raises ValueError for malformed input"""
+    filters = {}
+    for name in ('from', 'to'):
+        value = (args.get(name) or '').strip()
+        try:
+            filters[name] = datetime.strptime(value, '%Y-%m-%d') if value else None
+        except ValueError:
+            raise ValueError(f'{name} must be a date in YYYY-MM-DD format')
+    return filters
+
+
+def _within(column, filters):
+    criteria = []
+    if filters['from']:
+        criteria.append(column >= filters['from'])
+    if filters['to']:
+        criteria.append(column < filters['to'] + timedelta(days=1))
+    return criteria
+
+
+def _history(entity, org_filter):
+    return [StageChange.entity == entity] + [
+        getattr(StageChange, name) == value for name, value in org_filter.items()]
+
+
+def _rate(count, total):
+    return round(count / total, 4) if total else None
+
+
+def journeys(entity, org_filter, filters):
+    """Per record: when it entered the history and the furthest funnel stage
+    it reached (1-based, 0 for none)"""
+    rank = case({stage: i + 1 for i, stage in enumerate(FUNNELS[entity])},
+                value=StageChange.to_stage, else_=0)
+    entered_at = func.min(StageChange.changed_at)
+    return (select(StageChange.record_id, entered_at.label('entered_at'),
+                   func.max(rank).label('reached'))
+            .where(*_history(entity, org_filter))
+            .group_by(StageChange.record_id)
+            .having(*_within(entered_at, filters)))
+
+
+def _reached_columns(entity, journey):
+    return [func.coalesce(func.sum(case((journey.c.reached >= i + 1, 1), else_=0)), 0)
+            for i in range(len(FUNNELS[entity]))]
+
+
+def _stages(entity, counts, entered):
+    stages, previous = [], entered
+    for stage, count in zip(FUNNELS[entity], map(int, counts)):
+        stages.append({'stage': stage, 'count': count,
+                       'conversionRate': _rate(count, previous),
+                       'overallRate': _rate(count, entered)})
+        previous = count
+    return stages
+
+
+def funnel_statement(entity, org_filter, filters):
+    journey = journeys(entity, org_filter, filters).subquery()
+    return select(func.count(), *_reached_columns(entity, journey)).select_from(journey)
+
+
+def funnel(session, entity, org_filter, filters):
+    """``{entered, stages: [{stage, count, conversionRate, overallRate}]}``"""
+    entered, *counts = session.execute(funnel_statement(entity, org_filter, filters)).one()
+    return {'entered': entered, 'stages': _stages(entity, counts, entered)}
+
+
+def conversion_rates_statement(entity, org_filter, filters):
+    count = func.count()
+    return (select(StageChange.from_stage, StageChange.to_stage, count.label('changes'),
+                   func.sum(count).over(partition_by=StageChange.from_stage).label('left_stage'))
+            .where(*_history(entity, org_filter), StageChange.from_stage.is_not(None),
+                   *_within(StageChange.changed_at, filters))
+            .group_by(StageChange.from_stage, StageChange.to_stage)
+            .order_by(StageChange.from_stage, StageChange.to_stage))
+
+
+def conversion_rates(session, entity, org_filter, filters):
+    """``{transitions: [{fromStage, toStage, count, rate}]}``"""
+    rows = session.execute(conversion_rates_statement(entity, org_filter, filters)).all()
+    return {'transitions': [{'fromStage': row.from_stage, 'toStage': row.to_stage,
+                             'count': row.changes, 'rate': _rate(row.changes, int(row.left_stage))}
+                            for row in rows]}
+
+
+def _seconds_between(dialect_name, start, end):
+    if dialect_name == 'postgresql':
+        return func.extract('epoch', end - start)
+    return (func.julianday(end) - func.julianday(start)) * 86400
+
+
+def time_in_stage_statement(dialect_name, entity, org_filter, filters):
+    left_at = func.lead(StageChange.changed_at).over(
+        partition_by=StageChange.record_id, order_by=(StageChange.changed_at, StageChange.id))
+    stays = (select(StageChange.to_stage.label('stage'),
+                    StageChange.changed_at.label('entered_at'), left_at.label('left_at'))
+             .where(*_history(entity, org_filter))
+             .subquery())
+    # Filter after the window so a stay ends at the next change even when
+    # that change falls outside the period
+    seconds = _seconds_between(dialect_name, stays.c.entered_at, stays.c.left_at)
+    return (select(stays.c.stage, func.count().label('entered'),
+                   func.count(stays.c.left_at).label('left'),
+                   func.avg(seconds).label('average_seconds'),
+                   func.max(seconds).label('max_seconds'))
+            .where(*_within(stays.c.entered_at, filters))
+            .group_by(stays.c.stage))
+
+
+def _days(seconds):
+    return None if seconds is None else round(float(seconds) / 86400, 2)
+
+
+def time_in_stage(session, entity, org_filter, filters):
+    """``{stages: [{stage, entered, left, current, averageDays, maxDays}]}`` in
+    funnel order; the averages cover the stays that ended"""
+    rows = session.execute(time_in_stage_statement(
+        session.get_bind().dialect.name, entity, org_filter, filters)).all()
+    order = {stage: i for i, stage in enumerate(FUNNELS[entity])}
+    rows.sort(key=lambda row: (order.get(row.stage, len(order)), row.stage))
+    return {'stages': [{'stage': row.stage, 'entered': row.entered, 'left': row.left,
+                        'current': row.entered - row.left,
+                        'averageDays': _days(row.average_seconds),
+                        'maxDays': _days(row.max_seconds)} for row in rows]}
+
+
+def cohorts_statement(dialect_name, entity, org_filter, filters):
+    journey = journeys(entity, org_filter, filters).subquery()
+    month = month_of(dialect_name, journey.c.entered_at).label('cohort')
+    return (select(month, func.count(), *_reached_columns(entity, journey))
+            .group_by(month).order_by(month))
+
+
+def cohorts(session, entity, org_filter, filters):
+    """``{cohorts: [{cohort, size, stages}]}`` with the month (YYYY-MM) records
+    entered and the funnel of those records"""
+    rows = session.execute(cohorts_statement(
+        session.get_bind().dialect.name, entity, org_filter, filters)).all()
+    return {'cohorts': [{'cohort': cohort, 'size': size, 'stages': _stages(entity, counts, size)}
+                        for cohort, size, *counts in rows]}
@@ -1,7 +1,10 @@
-from flask import Flask
-import os
-from werkzeug.security import generate_password_hash
-from sqlalchemy import text
+import startup_profile  # first, so the profile covers the imports below
+
+with startup_profile.phase('import flask, sqlalchemy'):
+    from flask import Flask
+    import os
+    from werkzeug.security import generate_password_hash
+    from sqlalchemy import text
 
 def create_app():
     """Create and configure the Flask application"""
@@ -44,6 +47,23 @@ def create_app():
     
     app.config['SQLALCHEMY_DATABASE_URI'] = database_url
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['IMPORT_BATCH_SIZE'] = int(os.getenv('IMPORT_BATCH_SIZE', '1000'))
+    app.config['IDENTITY_CACHE_TTL'] = int(os.getenv('IDENTITY_CACHE_TTL', '30'))
+    app.config['IDENTITY_CACHE_SIZE'] = int(os.getenv('IDENTITY_CACHE_SIZE', '1024'))
+    app.config['SQL_STATS_HEADER'] = os.getenv('SQL_STATS_HEADER', '0') == '1'
+    app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')
+    app.config['SQL_DEBUG'] = os.getenv('SQL_DEBUG', '0') == '1'
+    app.config['SQL_REPEAT_THRESHOLD'] = int(os.getenv('SQL_REPEAT_THRESHOLD', '3'))
+    app.config['ETAG_SALT'] = os.getenv('ETAG_SALT')
+    app.config['COMPRESS_MIN_SIZE'] = int(os.getenv('COMPRESS_MIN_SIZE', '1024'))
+    app.config['SYNC_LAG_SECONDS'] = int(os.getenv('SYNC_LAG_SECONDS', '5'))
+    app.config['SYNC_TOMBSTONE_DAYS'] = int(os.getenv('SYNC_TOMBSTONE_DAYS', '30'))
+    app.config['JOB_WORKERS'] = int(os.getenv('JOB_WORKERS', '2'))
+    app.config['JOB_STALE_SECONDS'] = int(os.getenv('JOB_STALE_SECONDS', '300'))
+    app.config['JOB_SWEEP_SECONDS'] = int(os.getenv('JOB_SWEEP_SECONDS', '60'))
+    app.config['JOB_RETENTION_DAYS'] = int(os.getenv('JOB_RETENTION_DAYS', '7'))
+    app.config['REPARENT_BATCH_SIZE'] = int(os.getenv('REPARENT_BATCH_SIZE', '500'))
+    app.config['FAST_START'] = os.getenv('FAST_START', '1') == '1'
     app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
         'pool_pre_ping': True,
         'pool_recycle': 300,
@@ -58,30 +78,55 @@ def create_app():
         print(f"PostgreSQL URL detected - Password injection: {'Applied' if postgres_password else 'Skipped'}")
 
     # Initialize extensions
-    from database import db, login_manager
-    db.init_app(app)
-    login_manager.init_app(app)
+    with startup_profile.phase('extensions and engine'):
+        from database import db, login_manager
+        db.init_app(app)
+        login_manager.init_app(app)
+
+    with startup_profile.phase('import models and event modules'):
+        import counters  # noqa: F401  registers the dashboard counter events
+        import search  # noqa: F401  registers the full-text index DDL
+        import sync  # noqa: F401  registers the tombstone events
+        import stage_history  # noqa: F401  registers the stage history events
+        import querystats
+        import metrics
+        import serializers
+        import conditional
+        import compression
+        import jobs
 
-    from models import User
+    with startup_profile.phase('middleware'):
+        serializers.init_app(app)
+        jobs.init_app(app)
+        conditional.init_app(app)
+        querystats.init_app(app)
+        with app.app_context():
+            querystats.instrument_pool(db.engine)
+            metrics.init_app(app, db.engine)
+        # Registered last so it runs first and the metrics include its time
+        compression.init_app(app)
+        from identity import identity_cache, load_identity
+        identity_cache.configure(app.config['IDENTITY_CACHE_TTL'], app.config['IDENTITY_CACHE_SIZE'])
 
     @login_manager.user_loader
     def load_user(user_id):
         try:
-            return User.query.get(int(user_id))
+            return load_identity(int(user_id))
         except Exception as e:
             print(f"Error loading user {user_id}: {e}")
             return None
 
     # Import and register blueprints
-    from routes.auth import auth_bp
-    from routes.main import main_bp
-    from routes.api import api_bp
-    from routes.users import users_bp
+    with startup_profile.phase('blueprints'):
+        from routes.auth import auth_bp
+        from routes.main import main_bp
+        from routes.api import api_bp
+        from routes.users import users_bp
 
-    app.register_blueprint(auth_bp, url_prefix='/auth')
-    app.register_blueprint(main_bp)
-    app.register_blueprint(api_bp, url_prefix='/api')
-    app.register_blueprint(users_bp, url_prefix='/users')
+        app.register_blueprint(auth_bp, url_prefix='/auth')
+        app.register_blueprint(main_bp)
+        app.register_blueprint(api_bp, url_prefix='/api')
+        app.register_blueprint(users_bp, url_prefix='/users')
 
     # Migration route for adding amount column
     @app.route('/migrate/add-amount', methods=['POST'])
@@ -122,33 +167,53 @@ def create_app():
     return app
 
 # Initialize Flask app
-app = create_app()
+with startup_profile.phase('create_app'):
+    app = create_app()
 
 # Create tables and initialize data on startup
 def init_database():
-    """Initialize database tables and create demo user if needed with enhanced error handling"""
+    """Initialize database tables and create demo user if needed with enhanced error handling.
+
+    Skipped after one read when the database is stamped with the current
+    schema version (schema_version.py), unless FAST_START=0.
+    """
     print("🔍 Starting database initialization...")
     
     with app.app_context():
         try:
             from models import db, User
+            from schema_version import schema_fingerprint, stamped_version, stamp
+            
+            version = schema_fingerprint()
+            if app.config['FAST_START']:
+                # One row read; it also proves the connection works
+                with startup_profile.phase('schema version check'):
+                    with db.engine.connect() as conn:
+                        current = stamped_version(conn)
+                if current == version:
+                    print(f"✅ Database schema is at version {version}, skipping table checks")
+                    return
+                print(f"Schema version {current or '(none)'} differs from {version}, running full checks...")
             
             # Test database connection first
             print("Testing database connection...")
-            with db.engine.connect() as conn:
-                result = conn.execute(text("SELECT 1"))
-                if result.scalar() != 1:
-                    raise Exception("Database connection test failed")
+            with startup_profile.phase('connection test'):
+                with db.engine.connect() as conn:
+                    result = conn.execute(text("SELECT 1"))
+                    if result.scalar() != 1:
+                        raise Exception("Database connection test failed")
             print("✅ Database connection verified!")
             
             # Create all tables
             print("Creating database tables...")
-            db.create_all()
+            with startup_profile.phase('create_all'):
+                db.create_all()
             print("✅ Database tables created successfully!")
             
             # Verify tables were created
-            inspector = db.inspect(db.engine)
-            tables = inspector.get_table_names()
+            with startup_profile.phase('table inspection'):
+                inspector = db.inspect(db.engine)
+                tables = inspector.get_table_names()
             expected_tables = ['users', 'accounts', 'contacts', 'leads', 'opportunities']
             missing_tables = [t for t in expected_tables if t not in tables]
             
@@ -158,64 +223,70 @@ def init_database():
             
             # Check if any users exist
             print("Checking existing users...")
-            user_count = User.query.count()
-            print(f"Current user count: {user_count}")
+            with startup_profile.phase('users'):
+                user_count = User.query.count()
+                print(f"Current user count: {user_count}")
             
-            # Create demo user if no users exist
-            if user_count == 0:
-                print("No users found, creating demo and admin users...")
+                # Create demo user if no users exist
+                if user_count == 0:
+                    print("No users found, creating demo and admin users...")
                 
-                # Create demo user
-                demo_user = User(
-                    username='demo',
-                    email='demo@elscrm.com',
-                    first_name='Demo',
-                    last_name='User'
-                )
-                demo_user.set_password('demo123')
+                    # Create demo user
+                    demo_user = User(
+                        username='demo',
+                        email='demo@elscrm.com',
+                        first_name='Demo',
+                        last_name='User'
+                    )
+                    demo_user.set_password('demo123')
                 
-                # Create admin user
-                admin_user = User(
-                    username='admin',  
-                    email='admin@elscrm.com',
-                    first_name='Admin',
-                    last_name='User',
-                    is_admin=True
-                )
-                admin_user.set_password('admin123')
+                    # Create admin user
+                    admin_user = User(
+                        username='admin',  
+                        email='admin@elscrm.com',
+                        first_name='Admin',
+                        last_name='User',
+                        is_admin=True
+                    )
+                    admin_user.set_password('admin123')
                 
-                # Add users to session
-                db.session.add(demo_user)
-                db.session.add(admin_user)
+                    # Add users to session
+                    db.session.add(demo_user)
+                    db.session.add(admin_user)
                 
-                # Commit with error handling
-                try:
-                    db.session.commit()
-                    print("✅ Demo and admin users created successfully!")
-                    print("   Demo user: username=demo, password=demo123")
-                    print("   Admin user: username=admin, password=admin123")
+                    # Commit with error handling
+                    try:
+                        db.session.commit()
+                        print("✅ Demo and admin users created successfully!")
+                        print("   Demo user: username=demo, password=demo123")
+                        print("   Admin user: username=admin, password=admin123")
                     
-                    # Verify users were created
-                    final_count = User.query.count()
-                    if final_count != 2:
-                        raise Exception(f"Expected 2 users after creation, found {final_count}")
-                    print(f"✅ User creation verified - final count: {final_count}")
+                        # Verify users were created
+                        final_count = User.query.count()
+                        if final_count != 2:
+                            raise Exception(f"Expected 2 users after creation, found {final_count}")
+                        print(f"✅ User creation verified - final count: {final_count}")
                     
-                except Exception as commit_error:
-                    print(f"❌ Failed to commit users to database: {commit_error}")
-                    db.session.rollback()
-                    raise
-            else:
-                print(f"✅ Users already exist in database (count: {user_count})")
+                    except Exception as commit_error:
+                        print(f"❌ Failed to commit users to database: {commit_error}")
+                        db.session.rollback()
+                        raise
+                else:
+                    print(f"✅ Users already exist in database (count: {user_count})")
                 
-                # List existing users for verification
-                try:
-                    existing_users = User.query.with_entities(User.username, User.email).all()
-                    print("   Existing users:")
-                    for username, email in existing_users:
-                        print(f"     - {username} ({email})")
-                except Exception as e:
-                    print(f"   ⚠️  Could not list users: {e}")
+                    # List existing users for verification
+                    try:
+                        existing_users = User.query.with_entities(User.username, User.email).all()
+                        print("   Existing users:")
+                        for username, email in existing_users:
+                            print(f"     - {username} ({email})")
+                    except Exception as e:
+                        print(f"   ⚠️  Could not list users: {e}")
+            
+            # Later starts skip the checks above until the models change
+            with db.engine.begin() as conn:
+                stamp(conn, version)
+            print(f"✅ Database stamped with schema version {version}")
                 
         except Exception as e:
             print(f"⚠️ Database initialization warning: {e}")
@@ -235,7 +306,11 @@ def init_database():
             # The app will handle database errors gracefully in the routes
 
 # Initialize database on startup
-init_database()
+with startup_profile.phase('init_database'):
+    init_database()
+
+if startup_profile.enabled():
+    startup_profile.report()
 
 if __name__ == '__main__':
     app.run(debug=False, host='0.0.0.0', port=int(os.getenv('PORT', 8000)))
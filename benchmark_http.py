@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""
+End-to-end HTTP benchmark for the CRM routes
+
+Seeds a local database with generate_data.py, starts the app under gunicorn
+with gunicorn.conf.py and drives concurrent scripted user sessions (login,
+dashboard, list pages, API lists, search, pickers, lead conversion, CSV
+export). Reports p50/p95/p99 latency, requests per second and SQL statements
+per request for every route and writes them to a JSON file, so runs can be
+compared:
+
+    python benchmark_http.py --duration 30 --concurrency 8 --output before.json
+    python benchmark_http.py --duration 30 --concurrency 8 --output after.json --compare before.json
+
+SQL statements per request come from the X-SQL-Statements header, which the
+server adds when started with SQL_STATS_HEADER=1 (see querystats.py).
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlencode
+
+# Add the project root to the Python path
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+from datagen import COMPANY_WORDS, LAST_NAMES
+
+DEFAULT_DATABASE = os.path.join(ROOT, 'instance', 'benchmark.db')
+PASSWORD = 'loadtest'
+
+
+class Client:
+    """One keep-alive connection with the session cookie of one user"""
+
+    def __init__(self, host, port, recorder):
+        self.connection = http.client.HTTPConnection(host, port, timeout=60)
+        self.recorder = recorder
+        self.cookies = {}
+
+    def request(self, label, method, path, json_body=None, form=None):
+        headers = {'Accept': 'application/json' if path.startswith('/api/') else 'text/html'}
+        body = None
+        if json_body is not None:
+            body = json.dumps(json_body)
+            headers['Content-Type'] = 'application/json'
+        elif form is not None:
+            body = urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{k}={v}' for k, v in self.cookies.items())
+
+        started = time.perf_counter()
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            data = response.read()
+        except (http.client.HTTPException, OSError):
+            # The server closed the keep-alive connection (e.g. worker restart)
+            self.connection.close()
+            self.recorder.record(label, time.perf_counter() - started, 599, None)
+            return 599, b''
+        elapsed = time.perf_counter() - started
+
+        for header in response.headers.get_all('Set-Cookie') or ():
+            name, _, rest = header.partition('=')
+            self.cookies[name.strip()] = rest.split(';', 1)[0]
+        statements = response.getheader('X-SQL-Statements')
+        self.recorder.record(label, elapsed, response.status,
+                             int(statements) if statements is not None else None)
+        return response.status, data
+
+    def get_json(self, label, path):
+        status, data = self.request(label, 'GET', path)
+        return json.loads(data) if status == 200 else None
+
+
+class Recorder:
+    """Per-thread samples; nothing is kept until ``measuring`` is set"""
+
+    def __init__(self, measuring):
+        self.measuring = measuring
+        self.samples = []
+
+    def record(self, label, elapsed, status, statements):
+        if self.measuring.is_set():
+            self.samples.append((label, elapsed, status, statements))
+
+
+# Workflows: each issues a few requests the way a user would
+
+def dashboard(client, rng):
+    client.request('GET /', 'GET', '/')
+
+
+def browse_lists(client, rng):
+    for page in ('leads', 'accounts', 'contacts', 'opportunities'):
+        client.request(f'GET /{page}', 'GET', f'/{page}')
+
+
+def api_lists(client, rng):
+    for entity in ('leads', 'accounts', 'contacts', 'opportunities'):
+        data = client.get_json(f'GET /api/{entity}', f'/api/{entity}?limit=50')
+        if data and data.get('next_cursor'):
+            client.get_json(f'GET /api/{entity} (next page)',
+                            f"/api/{entity}?limit=50&cursor={data['next_cursor']}")
+
+
+def edit_lead(client, rng):
+    data = client.get_json('GET /api/leads', '/api/leads?limit=20')
+    if data and data['items']:
+        lead_id = rng.choice(data['items'])['id']
+        client.request('GET /leads/edit/<id>', 'GET', f'/leads/edit/{lead_id}')
+
+
+def search(client, rng):
+    term = rng.choice(COMPANY_WORDS + LAST_NAMES)[:rng.randint(3, 6)]
+    client.get_json('GET /api/search', '/api/search?' + urlencode({'q': term}))
+
+
+def lookup(client, rng):
+    term = rng.choice(COMPANY_WORDS)[:rng.randint(1, 3)]
+    accounts = client.get_json('GET /api/accounts/lookup', '/api/accounts/lookup?' + urlencode({'q': term}))
+    if accounts and accounts['items']:
+        account_id = accounts['items'][0]['id']
+        client.get_json('GET /api/contacts/lookup',
+                        '/api/contacts/lookup?' + urlencode({'account_id': account_id}))
+
+
+def create_and_convert_lead(client, rng):
+    serial = rng.getrandbits(40)
+    status, data = client.request('POST /api/leads', 'POST', '/api/leads', json_body={
+        'companyName': f'{rng.choice(COMPANY_WORDS)} Benchmark {serial}',
+        'contactPerson': f'Bench {rng.choice(LAST_NAMES)}',
+        'email': f'bench{serial}@example.com',
+        'source': 'Website',
+        'stage': 'SQL',
+    })
+    if status == 201:
+        lead_id = json.loads(data)['id']
+        client.request('POST /api/leads/<id>/convert', 'POST', f'/api/leads/{lead_id}/convert',
+                       json_body={'salesStage': 'Qualification'})
+
+
+def export(client, rng):
+    client.request('GET /export/leads.csv', 'GET', '/export/leads.csv')
+
+
+# (workflow, relative weight)
+WORKFLOWS = (
+    (dashboard, 20),
+    (browse_lists, 20),
+    (api_lists, 20),
+    (edit_lead, 10),
+    (search, 10),
+    (lookup, 10),
+    (create_and_convert_lead, 7),
+    (export, 3),
+)
+
+
+def run_user(number, args, measuring, stop, samples, errors):
+    """One scripted session: log in, then run weighted workflows until stopped"""
+    rng = random.Random(f'{args.seed}-vu{number}')
+    recorder = Recorder(measuring)
+    client = Client(args.host, args.port, recorder)
+    username = f's{args.seed}o{number % args.orgs}_user{(number // args.orgs) % args.users}'
+    status, _ = client.request('POST /auth/login', 'POST', '/auth/login',
+                               form={'username': username, 'password': PASSWORD})
+    if status != 302:
+        errors.append(f'{username}: login returned {status}')
+        return
+    workflows, weights = zip(*WORKFLOWS)
+    while not stop.is_set():
+        rng.choices(workflows, weights)[0](client, rng)
+    client.connection.close()
+    samples.extend(recorder.samples)
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def summarize(samples, seconds):
+    """Latency (ms), throughput and SQL statistics for a list of samples"""
+    latencies = sorted(elapsed * 1000 for _, elapsed, _, _ in samples)
+    statements = [n for _, _, _, n in samples if n is not None]
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for _, _, status, _ in samples if status >= 400),
+        'rps': round(len(samples) / seconds, 1) if seconds else None,
+        'p50_ms': round(percentile(latencies, 0.50), 2) if latencies else None,
+        'p95_ms': round(percentile(latencies, 0.95), 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99), 2) if latencies else None,
+        'mean_ms': round(sum(latencies) / len(latencies), 2) if latencies else None,
+        'sql_per_request': round(sum(statements) / len(statements), 2) if statements else None,
+        'sql_max': max(statements) if statements else None,
+    }
+
+
+def build_report(samples, seconds, args):
+    by_label = {}
+    for sample in samples:
+        by_label.setdefault(sample[0], []).append(sample)
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'commit': commit,
+            'database': args.database_url.split('@')[-1],
+            'workers': args.workers,
+            'concurrency': args.concurrency,
+            'duration': round(seconds, 1),
+            'seed': args.seed,
+            'volumes': {'orgs': args.orgs, 'users': args.users,
+                        'accounts': args.accounts, 'leads': args.leads},
+        },
+        'overall': summarize(samples, seconds),
+        'routes': {label: summarize(items, seconds) for label, items in sorted(by_label.items())},
+    }
+
+
+def print_report(report, baseline=None):
+    def change(new, old):
+        if new is None or not old:
+            return ''
+        return f' ({(new - old) / old * 100:+.0f}%)'
+
+    old_routes = baseline['routes'] if baseline else {}
+    print(f"{'route':<34} {'reqs':>6} {'rps':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'sql':>6}  errors")
+    rows = list(report['routes'].items()) + [('overall', report['overall'])]
+    for label, stats in rows:
+        old = baseline['overall'] if baseline and label == 'overall' else old_routes.get(label, {})
+        sql = '-' if stats['sql_per_request'] is None else stats['sql_per_request']
+        print(f"{label:<34} {stats['requests']:>6} {stats['rps']:>7} {stats['p50_ms']:>8} "
+              f"{stats['p95_ms']:>8} {stats['p99_ms']:>8} {sql:>6}  "
+              f"{stats['errors']}")
+        if old:
+            print(f"{'':<34} {'':>6} {change(stats['rps'], old.get('rps')):>7} "
+                  f"{change(stats['p50_ms'], old.get('p50_ms')):>8} "
+                  f"{change(stats['p95_ms'], old.get('p95_ms')):>8} "
+                  f"{change(stats['p99_ms'], old.get('p99_ms')):>8} "
+                  f"{change(stats['sql_per_request'], old.get('sql_per_request')):>6}")
+
+
+def seed_database(args, env):
+    print(f"🌱 Seeding {args.orgs} organizations (seed {args.seed})...")
+    command = [sys.executable, os.path.join(ROOT, 'generate_data.py'), '--reset',
+               '--orgs', str(args.orgs), '--users', str(args.users),
+               '--accounts', str(args.accounts), '--leads', str(args.leads),
+               '--seed', str(args.seed), '--password', PASSWORD]
+    subprocess.run(command, env=env, check=True, stdout=subprocess.DEVNULL)
+
+
+def start_server(args, env, log):
+    command = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+               '--bind', f'{args.host}:{args.port}', '--workers', str(args.workers),
+               '--access-logfile', os.devnull, 'app:app']
+    server = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with status {server.returncode}')
+        try:
+            connection = http.client.HTTPConnection(args.host, args.port, timeout=2)
+            connection.request('GET', '/auth/login')
+            if connection.getresponse().status == 200:
+                return server
+        except OSError:
+            pass
+        time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError('gunicorn did not become ready within 60 seconds')
+
+
+def run(args):
+    env = dict(os.environ, DATABASE_URL=args.database_url, SQL_STATS_HEADER='1',
+               PORT=str(args.port))
+    if not args.no_seed:
+        seed_database(args, env)
+
+    with open(args.server_log, 'w') as log:
+        server = start_server(args, env, log)
+        try:
+            measuring, stop = threading.Event(), threading.Event()
+            samples, errors = [], []
+            threads = [threading.Thread(target=run_user,
+                                        args=(n, args, measuring, stop, samples, errors))
+                       for n in range(args.concurrency)]
+            print(f"🚀 {args.concurrency} sessions against {args.workers} worker(s): "
+                  f"{args.warmup}s warm-up, {args.duration}s measured")
+            for thread in threads:
+                thread.start()
+            time.sleep(args.warmup)
+            measuring.set()
+            started = time.monotonic()
+            time.sleep(args.duration)
+            stop.set()
+            for thread in threads:
+                thread.join()
+            seconds = time.monotonic() - started
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    for error in errors:
+        print(f"❌ {error}")
+    return build_report(samples, seconds, args), errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the CRM routes under gunicorn')
+    parser.add_argument('--database-url', default=os.getenv('BENCHMARK_DATABASE_URL',
+                                                            f'sqlite:///{DEFAULT_DATABASE}'),
+                        help='Database to seed and serve (default: instance/benchmark.db)')
+    parser.add_argument('--no-seed', action='store_true',
+                        help='Reuse a database seeded earlier with the same --seed and volumes')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--orgs', type=int, default=4)
+    parser.add_argument('--users', type=int, default=5, help='Users per organization')
+    parser.add_argument('--accounts', type=int, default=1000, help='Accounts per organization')
+    parser.add_argument('--leads', type=int, default=4000, help='Leads per organization')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=2, help='Gunicorn worker processes')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent user sessions')
+    parser.add_argument('--warmup', type=float, default=5, help='Seconds before measuring')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds measured')
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--compare', help='Earlier results file to compare against')
+    parser.add_argument('--server-log', default='benchmark-server.log')
+    args = parser.parse_args()
+
+    if args.database_url.startswith('sqlite:///'):
+        os.makedirs(os.path.dirname(args.database_url[len('sqlite:///'):]) or '.', exist_ok=True)
+
+    report, errors = run(args)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    print(f"✅ Results written to {args.output}")
+    return not errors and report['overall']['errors'] == 0
+
+
+if __name__ == '__main__':
+    success = main()
+    sys.exit(0 if success else 1)
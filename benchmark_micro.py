@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the per-row CPU paths of a request
+
+Times model to_dict(), JSON serialization of API pages, the API's row-tuple
+path (serializers.py) against the object path it replaced, the validators in
+validation.py and Jinja rendering of the list templates over synthetic rows
+from datagen.py, then repeats each case under tracemalloc to record the
+memory it allocates. Results are compared against benchmark_baseline.json:
+
+    python benchmark_micro.py                      # 10k rows per case, compare with the baseline
+    python benchmark_micro.py --rows 1000000       # scale up
+    python benchmark_micro.py --only render --top 5
+    python benchmark_micro.py --save-baseline      # record the current numbers
+    python benchmark_micro.py --check              # exit 1 on a regression
+
+Cases cycle over a pool of at most POOL_SIZE distinct objects, so a million
+rows cost a million calls but not a million objects in memory. Timings are
+the best of --repeat runs with the garbage collector paused, like timeit;
+memory is traced over one pass of the pool, keeping every result alive, so
+bytes and allocations per row are what a full page of output holds on to.
+"""
+import argparse
+import gc
+import json
+import math
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+# Add the project root to the Python path
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+from flask import render_template
+from flask.json.provider import DefaultJSONProvider
+from flask_login import login_user
+from flask_sqlalchemy.pagination import Pagination
+
+from app import app
+from datagen import generate_rows
+from listing import PREVIEW_LENGTH, parse_list_args
+from pagination import DEFAULT_PAGE_SIZE
+from models import User, Lead, Account, Contact, Opportunity
+from serializers import api_columns, serialize_rows
+from validation import (validate_lead_data, validate_account_data,
+                        validate_contact_data, validate_opportunity_data)
+
+BASELINE_FILE = os.path.join(ROOT, 'benchmark_baseline.json')
+POOL_SIZE = 10000
+PAGE_SIZE = 25
+MODELS = {'leads': Lead, 'accounts': Account, 'contacts': Contact, 'opportunities': Opportunity}
+
+
+class _StaticPagination(Pagination):
+    """A Flask-SQLAlchemy page over an in-memory list, for template rendering"""
+
+    def _query_items(self):
+        return self._query_args['items']
+
+    def _query_count(self):
+        return self._query_args['total']
+
+
+def _preview(text):
+    return text[:PREVIEW_LENGTH + 1] if text else text
+
+
+def build_pool(rows):
+    """Transient model objects for up to POOL_SIZE rows of each entity"""
+    size = min(rows, POOL_SIZE)
+    data = generate_rows({
+        'users': 1,
+        'accounts': max(size // 3, 1),
+        'contacts_per_account': 3,
+        'opportunities_per_account': 3,
+        'leads': size,
+    })
+    accounts = {}
+    for row in data['accounts']:
+        account = Account(**row)
+        # What the list page's query_expression would load
+        account.description_preview = _preview(row['description'])
+        accounts[row['id']] = account
+    contacts = {}
+    for row in data['contacts']:
+        contact = Contact(**row)
+        contact.account = accounts[row['account_id']]
+        contacts[row['id']] = contact
+    opportunities = []
+    for row in data['opportunities']:
+        opportunity = Opportunity(**row)
+        opportunity.requirements_preview = _preview(row['requirements'])
+        opportunity.account = accounts[row['company_id']]
+        opportunity.contact = contacts[row['contact_id']]
+        opportunities.append(opportunity)
+    return {
+        'user': User(**data['users'][0]),
+        'leads': [Lead(**row) for row in data['leads']][:size],
+        'accounts': list(accounts.values())[:size],
+        'contacts': list(contacts.values())[:size],
+        'opportunities': opportunities[:size],
+    }
+
+
+def _pages(records, size=PAGE_SIZE):
+    return [records[i:i + size] for i in range(0, len(records), size)]
+
+
+def build_cases(pool):
+    """``{name: (function, items, rows per call)}`` for every benchmark case"""
+    cases = {}
+    for entity in ('leads', 'accounts', 'contacts', 'opportunities'):
+        records = pool[entity]
+        cases[f'to_dict/{entity}'] = (lambda record: record.to_dict(), records, 1)
+
+    validators = {
+        'leads': validate_lead_data,
+        'accounts': validate_account_data,
+        'contacts': validate_contact_data,
+        'opportunities': validate_opportunity_data,
+    }
+    for entity, validator in validators.items():
+        payloads = [record.to_dict() for record in pool[entity]]
+        cases[f'validate/{entity}'] = (validator, payloads, 1)
+
+    for entity in ('leads', 'accounts', 'contacts', 'opportunities'):
+        pages = [[record.to_dict() for record in page] for page in _pages(pool[entity])]
+        cases[f'serialize/{entity}'] = (
+            lambda page: app.json.dumps({'items': page, 'next_cursor': None}),
+            pages, PAGE_SIZE)
+
+    # A full API page, from what the query returns to the response body: ORM
+    # objects through to_dict() and the json module, as before serializers.py,
+    # against column tuples through serialize_rows() and orjson
+    default_json = DefaultJSONProvider(app)
+    for entity, model in MODELS.items():
+        keys = [column.key for column in api_columns(model)]
+        objects = _pages(pool[entity], DEFAULT_PAGE_SIZE)
+        tuples = [[tuple(getattr(record, key) for key in keys) for record in page]
+                  for page in objects]
+        cases[f'api/{entity}/objects'] = (
+            lambda page: default_json.response(
+                {'items': [record.to_dict() for record in page], 'next_cursor': None}).get_data(),
+            objects, DEFAULT_PAGE_SIZE)
+        cases[f'api/{entity}/rows'] = (
+            lambda page, model=model: app.json.response(
+                {'items': serialize_rows(model, page), 'next_cursor': None}).get_data(),
+            tuples, DEFAULT_PAGE_SIZE)
+
+    for entity in ('leads', 'accounts', 'contacts', 'opportunities'):
+        state = parse_list_args(entity, {})
+        pages = [_StaticPagination(page=1, per_page=PAGE_SIZE, items=page, total=len(pool[entity]))
+                 for page in _pages(pool[entity])]
+        cases[f'render/{entity}.html'] = (
+            lambda pagination, entity=entity, state=state: render_template(
+                f'{entity}.html', pagination=pagination, list_state=state,
+                **{entity: pagination.items}),
+            pages, PAGE_SIZE)
+    return cases
+
+
+def _sequence(items, rows, rows_per_call):
+    calls = math.ceil(rows / rows_per_call)
+    return [items[i % len(items)] for i in range(calls)], calls * rows_per_call
+
+
+def time_case(function, sequence, repeat):
+    """Best wall time in nanoseconds over ``repeat`` runs"""
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            started = time.perf_counter_ns()
+            for item in sequence:
+                function(item)
+            elapsed = time.perf_counter_ns() - started
+        finally:
+            gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _site(frame):
+    filename = frame.filename
+    if filename.startswith(ROOT):
+        filename = os.path.relpath(filename, ROOT)
+    else:
+        filename = '/'.join(filename.split(os.sep)[-2:])
+    return f'{filename}:{frame.lineno}'
+
+
+def trace_case(function, items, top):
+    """Allocations kept by one pass over the pool: bytes, blocks, peak and top sites"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    results = [function(item) for item in items]
+    after = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats = after.compare_to(before, 'lineno')
+    sites = [{'site': _site(stat.traceback[0]), 'bytes': stat.size_diff, 'blocks': stat.count_diff}
+             for stat in stats[:top]]
+    blocks = sum(stat.count_diff for stat in stats)
+    del results
+    return current, blocks, peak, sites
+
+
+def run(args):
+    started = time.monotonic()
+    with app.test_request_context('/'):
+        pool = build_pool(args.rows)
+        login_user(pool['user'])
+        cases = build_cases(pool)
+        print(f"Built {len(cases)} cases over {args.rows:,} rows in {time.monotonic() - started:.1f}s")
+
+        results = {}
+        for name, (function, items, rows_per_call) in cases.items():
+            if args.only and args.only not in name:
+                continue
+            sequence, rows = _sequence(items, args.rows, rows_per_call)
+            elapsed = time_case(function, sequence, args.repeat)
+            retained, blocks, peak, sites = trace_case(function, items, args.top)
+            traced_rows = len(items) * rows_per_call
+            results[name] = {
+                'rows': rows,
+                'seconds': round(elapsed / 1e9, 4),
+                'ns_per_row': round(elapsed / rows, 1),
+                'bytes_per_row': round(retained / traced_rows, 1),
+                'allocations_per_row': round(blocks / traced_rows, 2),
+                'peak_kib': round(peak / 1024, 1),
+                'top_allocations': sites,
+            }
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print each case against the baseline; returns the regressed case names"""
+    regressions = []
+    print(f"{'case':<28} {'ns/row':>10} {'baseline':>10} {'change':>8} {'B/row':>9} "
+          f"{'allocs/row':>10} {'peak KiB':>10}")
+    for name, result in results.items():
+        old = baseline.get(name)
+        change = ''
+        if old and old.get('ns_per_row'):
+            ratio = result['ns_per_row'] / old['ns_per_row'] - 1
+            change = f'{ratio * 100:+.0f}%'
+            if ratio > tolerance:
+                regressions.append(name)
+                change += ' ⚠️'
+        print(f"{name:<28} {result['ns_per_row']:>10} {old['ns_per_row'] if old else '-':>10} "
+              f"{change:>8} {result['bytes_per_row']:>9} {result['allocations_per_row']:>10} "
+              f"{result['peak_kib']:>10}")
+        for site in result['top_allocations']:
+            print(f"    {site['bytes'] / 1024:>10.1f} KiB {site['blocks']:>8} blocks  {site['site']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks for serialization, validation and rendering')
+    parser.add_argument('--rows', type=int, default=10000, help='Rows per case (10k to 1M)')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per case; the best is kept')
+    parser.add_argument('--only', help='Run only cases whose name contains this text')
+    parser.add_argument('--top', type=int, default=0, help='Show the top N allocation sites per case')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true', help='Write the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help='Slowdown (fraction of ns/row) counted as a regression')
+    parser.add_argument('--check', action='store_true', help='Exit 1 if any case regressed')
+    parser.add_argument('--output', help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    results = run(args)
+    report = {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'rows': args.rows,
+        },
+        'cases': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)['cases']
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        if args.only and baseline:
+            # Keep the cases that were not run this time
+            report['cases'] = dict(baseline, **results)
+        for case in report['cases'].values():
+            case['top_allocations'] = []
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+        print(f"✅ Baseline written to {args.baseline}")
+    elif regressions:
+        print(f"⚠️  {len(regressions)} case(s) slower than the baseline by more than "
+              f"{args.tolerance:.0%}: {', '.join(regressions)}")
+    return not (args.check and regressions)
+
+
+if __name__ == '__main__':
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,55 @@
+"""Response compression negotiated from ``Accept-Encoding``.
+
+JSON and HTML bodies of at least ``COMPRESS_MIN_SIZE`` bytes are compressed
+with brotli when the ``brotli`` package is installed and the client prefers
+it, and with gzip otherwise. Streamed responses such as the CSV export are
+left alone, and so is anything a proxy in front already encoded. Strong ETags
+become weak, because the compressed bytes differ from the identity body they
+were computed over.
+"""
+import gzip
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional, gzip is always available
+    brotli = None
+
+COMPRESSIBLE_TYPES = {'application/json', 'text/html'}
+
+
+def _encoders(app):
+    encoders = {}
+    if brotli is not None:
+        quality = app.config['COMPRESS_BROTLI_QUALITY']
+        encoders['br'] = lambda data: brotli.compress(data, quality=quality)
+    level = app.config['COMPRESS_LEVEL']
+    encoders['gzip'] = lambda data: gzip.compress(data, compresslevel=level, mtime=0)
+    return encoders
+
+
+def init_app(app):
+    app.config.setdefault('COMPRESS_MIN_SIZE', 1024)
+    app.config.setdefault('COMPRESS_LEVEL', 6)
+    app.config.setdefault('COMPRESS_BROTLI_QUALITY', 5)
+    encoders = _encoders(app)
+
+    @app.after_request
+    def compress_response(response):
+        if (response.status_code != 200 or response.is_streamed or response.direct_passthrough
+                or response.mimetype not in COMPRESSIBLE_TYPES
+                or 'Content-Encoding' in response.headers):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(list(encoders))
+        data = response.get_data()
+        if encoding is None or len(data) < app.config['COMPRESS_MIN_SIZE']:
+            return response
+
+        response.set_data(encoders[encoding](data))
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
@@ -0,0 +1,80 @@
+"""Conditional GET for the list endpoints.
+
+A list's version is the row count and latest ``updated_at`` of its org-scoped
+query, read in one aggregate statement that the ``(scope, updated_at, id)``
+indexes answer. Inserts and edits move ``max(updated_at)``, and deletes change
+the count. The version is hashed into a weak ``ETag``, together with the URL,
+whatever else the page shows (``vary``, e.g. the signed-in user for HTML) and
+``ETAG_SALT``, which defaults to a fingerprint of the code and templates so a
+deploy invalidates cached pages. ``If-None-Match`` is answered with 304 before
+the page's rows are loaded. ``Last-Modified`` is informational only: a delete
+does not move it, so ``If-Modified-Since`` alone never produces a 304.
+"""
+import hashlib
+import os
+from collections import namedtuple
+from datetime import timezone
+
+from flask import current_app, request, session
+from sqlalchemy import func
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+ListVersion = namedtuple('ListVersion', 'etag last_modified')
+
+
+def code_fingerprint(root=ROOT):
+    """Hash of the names, sizes and mtimes of the Python files and templates"""
+    digest = hashlib.sha1()
+    for directory in ('.', 'routes', 'templates'):
+        path = os.path.join(root, directory)
+        for name in sorted(os.listdir(path)):
+            if name.endswith(('.py', '.html')):
+                stat = os.stat(os.path.join(path, name))
+                digest.update(f'{directory}/{name}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+    return digest.hexdigest()[:12]
+
+
+def list_version(*queries, vary=()):
+    """Version of the rows of ``queries`` (single-model ORM queries) in one statement"""
+    aggregates = []
+    for query in queries:
+        model = query.column_descriptions[0]['entity']
+        aggregates.append(query.with_entities(func.count(), func.max(model.updated_at)).order_by(None))
+    union = aggregates[0].union_all(*aggregates[1:]) if len(aggregates) > 1 else aggregates[0]
+    rows = union.all() if len(aggregates) > 1 else [union.one()]
+
+    digest = hashlib.sha1()
+    for part in (current_app.config['ETAG_SALT'], request.full_path, *vary, *rows):
+        digest.update(repr(part).encode())
+        digest.update(b'\0')
+    latest = [updated_at for _, updated_at in rows if updated_at is not None]
+    last_modified = max(latest).replace(microsecond=0, tzinfo=timezone.utc) if latest else None
+    return ListVersion(digest.hexdigest()[:32], last_modified)
+
+
+def _set_validators(response, version):
+    response.set_etag(version.etag, weak=True)
+    if version.last_modified is not None:
+        response.last_modified = version.last_modified
+    # Cache per browser and revalidate on every visit
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
+
+
+def conditional_response(version, build):
+    """304 if the client holds ``version``, otherwise ``build()`` with validators"""
+    # A page with pending flash messages must render them
+    if request.if_none_match.contains_weak(version.etag) and '_flashes' not in session:
+        return _set_validators(current_app.response_class(status=304), version)
+    response = current_app.make_response(build())
+    if response.status_code == 200:
+        _set_validators(response, version)
+    return response
+
+
+def init_app(app):
+    if not app.config.get('ETAG_SALT'):
+        app.config['ETAG_SALT'] = code_fingerprint()
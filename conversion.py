@@ -0,0 +1,192 @@
+"""Lead conversion service shared by the API and the UI.
+
+Converting a lead creates an Account, a Contact and an Opportunity and marks
+the lead converted. A batch of leads is converted in one transaction:
+
+1. The leads are claimed with a single conditional
+   ``UPDATE leads SET is_converted = true ... WHERE is_converted = false``,
+   so two concurrent requests (e.g. a double click) can never convert the
+   same lead twice; only the request whose UPDATE matched the row goes on.
+2. Ids are generated here rather than by flushing ORM objects, so the three
+   new records per lead go out as three executemany INSERTs for the whole
+   batch instead of two flush round-trips per lead.
+"""
+import uuid
+from collections import Counter
+from datetime import datetime, date
+
+from sqlalchemy import insert, update, select
+
+from database import db
+from models import Lead, Account, Contact, Opportunity, get_organization_filter
+
+MAX_BATCH_SIZE = 500
+
+# Lead columns needed to build the converted records
+_LEAD_COLUMNS = (
+    Lead.id, Lead.company_name, Lead.contact_person, Lead.email, Lead.phone,
+    Lead.notes, Lead.stage, Lead.organization_id, Lead.created_by,
+)
+
+
+def _scope_clause(user):
+    return [getattr(Lead, name) == value for name, value in get_organization_filter(user).items()]
+
+
+def _claim_leads(lead_ids, user, now):
+    """Atomically mark unconverted leads converted; return the claimed rows"""
+    conditions = _scope_clause(user) + [Lead.is_converted == False]  # noqa: E712
+    values = {'is_converted': True, 'updated_at': now}
+    connection = db.session.connection()
+
+    if connection.dialect.update_returning:
+        stmt = (update(Lead).where(Lead.id.in_(lead_ids), *conditions)
+                .values(**values).returning(*_LEAD_COLUMNS))
+        return connection.execute(stmt, execution_options={'synchronize_session': False}).all()
+
+    # Databases without UPDATE ... RETURNING: claim one lead at a time, still
+    # guarded by the same condition, then read back the ones we won
+    claimed = []
+    for lead_id in lead_ids:
+        stmt = update(Lead).where(Lead.id == lead_id, *conditions).values(**values)
+        if connection.execute(stmt).rowcount == 1:
+            claimed.append(lead_id)
+    if not claimed:
+        return []
+    return connection.execute(select(*_LEAD_COLUMNS).where(Lead.id.in_(claimed))).all()
+
+
+def _converted_records(lead, user, options, today, now):
+    """Build the account, contact and opportunity column values for one lead"""
+    account_id, contact_id, opportunity_id = (str(uuid.uuid4()) for _ in range(3))
+    owner = {
+        'created_by': user.id,
+        'organization_id': user.organization_id,
+        'updated_at': now,
+    }
+    name_parts = lead.contact_person.split(' ', 1)
+
+    account = dict(
+        owner,
+        id=account_id,
+        company_name=lead.company_name,
+        description=f'Converted from lead: {lead.company_name}',
+        notes=lead.notes,
+        create_date=today,
+    )
+    contact = dict(
+        owner,
+        id=contact_id,
+        first_name=name_parts[0],
+        last_name=name_parts[1] if len(name_parts) > 1 else '',
+        email=lead.email,
+        phone=lead.phone,
+        account_id=account_id,
+        notes=f'Contact created from lead: {lead.contact_person}',
+        last_contact=today,
+        create_date=today,
+    )
+    opportunity = dict(
+        owner,
+        id=opportunity_id,
+        name=options.get('opportunityName') or f'Opportunity for {lead.company_name}',
+        sales_stage=options.get('salesStage') or 'Prospecting',
+        forecast=options.get('forecast') or '0%',
+        company_id=account_id,
+        contact_id=contact_id,
+        close_date=datetime.strptime(options['closeDate'], '%Y-%m-%d').date() if options.get('closeDate') else None,
+        next_steps=f'Follow up on converted lead from {lead.stage} stage',
+        requirements=options.get('requirements') or f"Converted from lead: {lead.notes or 'No specific requirements noted.'}",
+        created_date=today,
+    )
+    return account, contact, opportunity
+
+
+def _counter_deltas(claimed, user):
+    from counters import record_scopes
+
+    deltas = Counter()
+    for lead in claimed:
+        for scope in record_scopes(lead.organization_id, lead.created_by):
+            deltas[(scope, 'leads')] -= 1
+        for scope in record_scopes(user.organization_id, user.id):
+            for column in ('accounts', 'contacts', 'opportunities'):
+                deltas[(scope, column)] += 1
+    return deltas
+
+
+def _stage_changes(claimed, converted, now):
+    from stage_history import CONVERTED, change_row
+
+    rows = [change_row('leads', lead.id, lead.stage, CONVERTED,
+                       lead.organization_id, lead.created_by, now) for lead in claimed]
+    rows.extend(change_row('opportunities', c['opportunity']['id'], None,
+                           c['opportunity']['sales_stage'], c['opportunity']['organization_id'],
+                           c['opportunity']['created_by'], now) for c in converted)
+    return rows
+
+
+def convert_leads(lead_ids, user, options=None):
+    """Convert ``lead_ids`` for ``user`` in a single transaction.
+
+    ``options`` may override opportunityName, salesStage, forecast, closeDate
+    and requirements for every created opportunity. Returns
+    ``{'converted': [...], 'skipped': [...]}``; each converted entry holds the
+    lead id and the account, contact and opportunity column values, and each
+    skipped entry the lead id and a reason ('not_found' or 'already_converted').
+    The caller's session is committed.
+    """
+    from counters import apply_deltas
+    from stage_history import record_changes
+
+    options = options or {}
+    lead_ids = list(dict.fromkeys(lead_ids))
+    if len(lead_ids) > MAX_BATCH_SIZE:
+        raise ValueError(f'At most {MAX_BATCH_SIZE} leads can be converted at once')
+
+    today, now = date.today(), datetime.utcnow()
+    try:
+        claimed = _claim_leads(lead_ids, user, now) if lead_ids else []
+
+        converted = []
+        for lead in claimed:
+            account, contact, opportunity = _converted_records(lead, user, options, today, now)
+            converted.append({'lead_id': lead.id, 'account': account,
+                              'contact': contact, 'opportunity': opportunity})
+
+        if converted:
+            connection = db.session.connection()
+            connection.execute(insert(Account.__table__), [c['account'] for c in converted])
+            connection.execute(insert(Contact.__table__), [c['contact'] for c in converted])
+            connection.execute(insert(Opportunity.__table__), [c['opportunity'] for c in converted])
+            # Core statements bypass the ORM counter and stage history events
+            apply_deltas(connection, _counter_deltas(claimed, user))
+            record_changes(connection, _stage_changes(claimed, converted, now))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    # Lead objects already loaded in this session still say is_converted=False
+    db.session.expire_all()
+
+    claimed_ids = {c['lead_id'] for c in converted}
+    unclaimed = [lead_id for lead_id in lead_ids if lead_id not in claimed_ids]
+    skipped = []
+    if unclaimed:
+        visible = {row.id for row in db.session.execute(
+            select(Lead.id).where(Lead.id.in_(unclaimed), *_scope_clause(user)))}
+        skipped = [{'lead_id': lead_id,
+                    'reason': 'already_converted' if lead_id in visible else 'not_found'}
+                   for lead_id in unclaimed]
+    return {'converted': converted, 'skipped': skipped}
+
+
+def conversion_to_dict(entry):
+    """Serialize one converted entry in the API's camelCase shape"""
+    return {
+        'leadId': entry['lead_id'],
+        'account': Account(**entry['account']).to_dict(),
+        'contact': Contact(**entry['contact']).to_dict(),
+        'opportunity': Opportunity(**entry['opportunity']).to_dict(),
+    }
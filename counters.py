@@ -0,0 +1,219 @@
+"""Incrementally maintained per-organization record counts.
+
+Every insert, update and delete of a Lead, Account, Contact or Opportunity
+adjusts the matching rows of ``record_counters`` in the same flush, so the
+dashboard reads all four numbers with one primary key lookup.
+
+Each record counts towards two scopes: its organization ('org:<id>', if it
+has one) and its creator ('user:<id>'), mirroring get_organization_filter().
+Events only adjust counter rows that already exist. A missing row is built
+from scratch the first time it is read, and ``recount_all()`` (see
+repair_counters.py) rebuilds every row. Bulk statements that bypass the ORM
+(``Query.update``, Core inserts) must call ``recount_scope`` or
+``apply_deltas`` themselves.
+"""
+from collections import Counter
+
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, object_session
+
+from database import db
+from models import Lead, Account, Contact, Opportunity, RecordCounter
+
+COUNTED_MODELS = {
+    Lead: 'leads',
+    Account: 'accounts',
+    Contact: 'contacts',
+    Opportunity: 'opportunities',
+}
+
+_SESSION_KEY = 'record_counter_deltas'
+
+
+def org_scope(organization_id):
+    return f'org:{organization_id}'
+
+
+def user_scope(user_id):
+    return f'user:{user_id}'
+
+
+def scope_for_user(user):
+    """Return the counter scope a user's dashboard reads"""
+    if user.organization_id:
+        return org_scope(user.organization_id)
+    return user_scope(user.id)
+
+
+def record_scopes(organization_id, created_by):
+    """Return the scopes a record with these owner columns counts towards"""
+    scopes = []
+    if organization_id:
+        scopes.append(org_scope(organization_id))
+    if created_by is not None:
+        scopes.append(user_scope(created_by))
+    return scopes
+
+
+def _is_counted(model, is_converted):
+    # Only open leads are shown on the dashboard
+    return model is not Lead or is_converted is False
+
+
+def _record_delta(target, sign, organization_id, created_by, is_converted):
+    if not _is_counted(type(target), is_converted):
+        return
+    session = object_session(target)
+    if session is None:
+        return
+    deltas = session.info.setdefault(_SESSION_KEY, Counter())
+    column = COUNTED_MODELS[type(target)]
+    for scope in record_scopes(organization_id, created_by):
+        deltas[(scope, column)] += sign
+
+
+def _old_value(state, name):
+    history = state.attrs[name].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(state.obj(), name)
+
+
+def _after_insert(mapper, connection, target):
+    _record_delta(target, 1, target.organization_id, target.created_by,
+                  getattr(target, 'is_converted', None))
+
+
+def _before_delete(mapper, connection, target):
+    # Read the owner columns while the row still exists
+    state = inspect(target)
+    _record_delta(target, -1, _old_value(state, 'organization_id'),
+                  _old_value(state, 'created_by'),
+                  _old_value(state, 'is_converted') if isinstance(target, Lead) else None)
+
+
+def _after_update(mapper, connection, target):
+    state = inspect(target)
+    names = ['organization_id', 'created_by']
+    if isinstance(target, Lead):
+        names.append('is_converted')
+    if not any(state.attrs[name].history.has_changes() for name in names):
+        return
+    old = {name: _old_value(state, name) for name in names}
+    _record_delta(target, -1, old['organization_id'], old['created_by'], old.get('is_converted'))
+    _record_delta(target, 1, target.organization_id, target.created_by,
+                  getattr(target, 'is_converted', None))
+
+
+def apply_deltas(connection, deltas):
+    """Apply ``{(scope, column): delta}`` to existing counter rows"""
+    table = RecordCounter.__table__
+    by_scope = {}
+    for (scope, column), delta in deltas.items():
+        if delta:
+            by_scope.setdefault(scope, {})[column] = delta
+    for scope, columns in sorted(by_scope.items()):
+        values = {column: table.c[column] + delta for column, delta in columns.items()}
+        values['updated_at'] = db.func.current_timestamp()
+        connection.execute(table.update().where(table.c.scope == scope).values(**values))
+
+
+def _after_flush(session, flush_context):
+    deltas = session.info.pop(_SESSION_KEY, None)
+    if deltas:
+        apply_deltas(session.connection(), deltas)
+
+
+def _after_rollback(session):
+    session.info.pop(_SESSION_KEY, None)
+
+
+def _track_old_value(target, value, oldvalue, initiator):
+    return value
+
+
+for _model in COUNTED_MODELS:
+    event.listen(_model, 'after_insert', _after_insert)
+    event.listen(_model, 'after_update', _after_update)
+    event.listen(_model, 'before_delete', _before_delete)
+    # active_history loads the previous value even when the attribute was
+    # expired (e.g. by a commit) before being set, so updates know what to undo
+    for _name in ('organization_id', 'created_by', 'is_converted'):
+        if hasattr(_model, _name):
+            event.listen(getattr(_model, _name), 'set', _track_old_value,
+                         active_history=True, retval=True)
+event.listen(Session, 'after_flush', _after_flush)
+event.listen(Session, 'after_soft_rollback', lambda session, previous: _after_rollback(session))
+
+
+def _scope_filter(model, scope):
+    kind, _, value = scope.partition(':')
+    if kind == 'org':
+        return model.organization_id == value
+    return model.created_by == int(value)
+
+
+def count_scope(scope):
+    """Count the records of one scope directly from the entity tables"""
+    counts = {}
+    for model, column in COUNTED_MODELS.items():
+        query = model.query.filter(_scope_filter(model, scope))
+        if model is Lead:
+            query = query.filter(Lead.is_converted == False)  # noqa: E712
+        counts[column] = query.order_by(None).count()
+    return counts
+
+
+def recount_scope(scope):
+    """Rebuild the counter row of one scope in the current transaction"""
+    counter = db.session.get(RecordCounter, scope) or RecordCounter(scope=scope)
+    for column, value in count_scope(scope).items():
+        setattr(counter, column, value)
+    db.session.add(counter)
+    db.session.flush()
+    return counter
+
+
+def get_counts(user):
+    """Return the dashboard counts for ``user`` with a single lookup.
+
+    Builds and commits the scope's counter row if it does not exist yet.
+    When a concurrent request inserts it first, that request's row is read.
+    """
+    scope = scope_for_user(user)
+    counter = db.session.get(RecordCounter, scope)
+    if counter is not None:
+        return counter.to_dict()
+    counts = count_scope(scope)
+    db.session.add(RecordCounter(scope=scope, **counts))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return db.session.get(RecordCounter, scope).to_dict()
+    return counts
+
+
+def recount_all():
+    """Recompute every counter row from the entity tables.
+
+    Returns the number of scopes written.
+    """
+    totals = {}
+    for model, column in COUNTED_MODELS.items():
+        for owner, prefix in ((model.organization_id, 'org'), (model.created_by, 'user')):
+            query = db.session.query(owner, db.func.count()).filter(owner.isnot(None))
+            if model is Lead:
+                query = query.filter(Lead.is_converted == False)  # noqa: E712
+            for value, count in query.group_by(owner):
+                totals.setdefault(f'{prefix}:{value}', {})[column] = count
+
+    # Scopes left without records lose their row and are rebuilt as zeros on read
+    RecordCounter.query.delete()
+    db.session.add_all(
+        RecordCounter(scope=scope, **{column: counts.get(column, 0) for column in COUNTED_MODELS.values()})
+        for scope, counts in totals.items()
+    )
+    db.session.commit()
+    return len(totals)
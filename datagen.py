@@ -0,0 +1,333 @@
+"""Deterministic synthetic tenant data for load and benchmark runs.
+
+``generate()`` builds organizations with users, accounts, contacts,
+opportunities and leads. Every row comes from a per-organization
+``random.Random`` seeded with ``(seed, organization number)``, so the same
+arguments always produce the same rows and record ids. Rows go out as
+executemany Core INSERTs committed every ``batch_size`` rows, in foreign key
+order, on one connection. That loads millions of rows in minutes instead of
+building ORM objects.
+"""
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import insert, func, select
+from sqlalchemy.schema import CreateIndex, DropIndex
+from werkzeug.security import generate_password_hash
+
+from database import db
+from models import User, Lead, Account, Contact, Opportunity
+
+DEFAULT_BATCH_SIZE = 5000
+
+# Per-organization volumes; the per-account values are averages
+DEFAULT_VOLUMES = {
+    'users': 5,
+    'accounts': 100,
+    'contacts_per_account': 3,
+    'opportunities_per_account': 2,
+    'leads': 400,
+}
+
+# Generated timestamps fall within the year before this date so a seed
+# produces identical rows whenever it is run
+BASE_TIME = datetime(2025, 1, 1)
+
+FIRST_NAMES = (
+    'Alice', 'Ben', 'Carla', 'David', 'Elena', 'Farid', 'Grace', 'Hiro', 'Ines', 'Jonas',
+    'Kara', 'Luis', 'Maya', 'Nikolai', 'Olivia', 'Priya', 'Quentin', 'Rosa', 'Samir', 'Tara',
+    'Umar', 'Vera', 'Wei', 'Ximena', 'Yusuf', 'Zoe',
+)
+LAST_NAMES = (
+    'Anderson', 'Baker', 'Chen', 'Dubois', 'Evans', 'Fischer', 'Garcia', 'Hansen', 'Ito',
+    'Jensen', 'Kowalski', 'Larsen', 'Martin', 'Nakamura', 'Okafor', 'Patel', 'Quinn', 'Rossi',
+    'Schmidt', 'Tanaka', 'Usman', 'Varga', 'Williams', 'Xu', 'Yilmaz', 'Zimmermann',
+)
+COMPANY_WORDS = (
+    'Acme', 'Apex', 'Blue', 'Bright', 'Cedar', 'Delta', 'Summit', 'Evergreen', 'Falcon', 'Granite',
+    'Harbor', 'Iron', 'Juniper', 'Keystone', 'Lumen', 'Maple', 'Nova', 'Orbit', 'Pioneer',
+    'Quartz', 'River', 'Sterling', 'Tidal', 'Union', 'Vertex', 'Willow',
+)
+COMPANY_SUFFIXES = ('Systems', 'Labs', 'Logistics', 'Health', 'Foods', 'Energy', 'Partners',
+                    'Industries', 'Software', 'Manufacturing', 'Group', 'Analytics')
+CITIES = (('Toronto', 'ON', 'Canada'), ('Vancouver', 'BC', 'Canada'), ('Austin', 'TX', 'USA'),
+          ('Chicago', 'IL', 'USA'), ('Denver', 'CO', 'USA'), ('Boston', 'MA', 'USA'),
+          ('Berlin', None, 'Germany'), ('Lyon', None, 'France'), ('Oslo', None, 'Norway'))
+TITLES = ('CEO', 'CTO', 'VP Sales', 'Operations Manager', 'Procurement Lead', 'Engineer',
+          'Director of IT', 'Office Manager')
+LEAD_SOURCES = ('Website', 'Referral', 'Trade Show', 'Cold Call', 'LinkedIn', 'Webinar')
+LEAD_STAGES = ('MQL', 'SAL', 'SQL')
+# (stage, forecast) with relative weights
+SALES_STAGES = (
+    (('Prospecting', '10%'), 30), (('Qualification', '25%'), 25), (('Proposal', '50%'), 20),
+    (('Negotiation', '75%'), 10), (('Closed Won', '100%'), 8), (('Closed Lost', '0%'), 7),
+)
+NOTES = (
+    None, None, 'Interested in a pilot next quarter.', 'Budget approval pending.',
+    'Asked for a pricing sheet.', 'Met at the spring conference.', 'Evaluating competitors.',
+)
+
+
+def _uuid(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def _timestamp(rng):
+    return BASE_TIME - timedelta(seconds=rng.randrange(365 * 24 * 3600))
+
+
+def _company(rng):
+    return f'{rng.choice(COMPANY_WORDS)} {rng.choice(COMPANY_WORDS)} {rng.choice(COMPANY_SUFFIXES)}'
+
+
+def _person(rng):
+    return rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+
+
+def _email(first, last, serial, domain):
+    return f'{first}.{last}.{serial}@{domain}'.lower()
+
+
+def _count(rng, average):
+    """Integer count with the given average (e.g. 1.5 -> 1 or 2)"""
+    whole = int(average)
+    return whole + (1 if rng.random() < average - whole else 0)
+
+
+class _Writer:
+    """Buffers rows per table and writes them as executemany batches"""
+
+    def __init__(self, connection, batch_size, progress=None):
+        self.connection = connection
+        self.batch_size = batch_size
+        self.progress = progress
+        self.buffers = {}
+        self.totals = {}
+
+    def add(self, table, row):
+        buffer = self.buffers.setdefault(table, [])
+        buffer.append(row)
+        if len(buffer) >= self.batch_size:
+            self.flush(table)
+
+    def flush(self, table=None):
+        tables = [table] if table is not None else list(self.buffers)
+        for tbl in tables:
+            rows = self.buffers.get(tbl)
+            if not rows:
+                continue
+            self.connection.execute(insert(tbl), rows)
+            self.connection.commit()
+            self.totals[tbl.name] = self.totals.get(tbl.name, 0) + len(rows)
+            self.buffers[tbl] = []
+            if self.progress:
+                self.progress(dict(self.totals))
+
+
+def _generate_org(writer, rng, org_key, volumes, next_user_id, password_hash):
+    organization_id = _uuid(rng)
+    domain = f'{org_key}.example.com'
+
+    user_ids = []
+    for n in range(volumes['users']):
+        first, last = _person(rng)
+        user_ids.append(next_user_id + n)
+        writer.add(User.__table__, {
+            'id': next_user_id + n,
+            'username': f'{org_key}_user{n}',
+            'email': f'user{n}@{domain}',
+            'password_hash': password_hash,
+            'first_name': first,
+            'last_name': last,
+            'is_active': True,
+            'organization_id': organization_id,
+            'is_admin': n == 0,
+            'created_at': _timestamp(rng),
+        })
+    writer.flush(User.__table__)
+
+    def owned(row):
+        updated_at = _timestamp(rng)
+        row.update(created_by=rng.choice(user_ids), organization_id=organization_id,
+                   updated_at=updated_at)
+        return row, updated_at
+
+    accounts = []
+    for _ in range(volumes['accounts']):
+        city, province, country = rng.choice(CITIES)
+        row, updated_at = owned({
+            'id': _uuid(rng),
+            'company_name': _company(rng),
+            'address_line1': f'{rng.randrange(1, 9999)} {rng.choice(COMPANY_WORDS)} Street',
+            'city': city,
+            'province_state': province,
+            'postal_zip_code': f'{rng.randrange(10000, 99999)}',
+            'country': country,
+            'description': rng.choice(NOTES),
+            'notes': rng.choice(NOTES),
+        })
+        row['create_date'] = updated_at.date()
+        accounts.append(row['id'])
+        writer.add(Account.__table__, row)
+    writer.flush(Account.__table__)
+
+    contacts_by_account = {}
+    serial = 0
+    for account_id in accounts:
+        contact_ids = contacts_by_account.setdefault(account_id, [])
+        # Opportunities need a contact, so every account gets at least one
+        for _ in range(max(_count(rng, volumes['contacts_per_account']), 1)):
+            first, last = _person(rng)
+            serial += 1
+            row, updated_at = owned({
+                'id': _uuid(rng),
+                'first_name': first,
+                'last_name': last,
+                'email': _email(first, last, serial, domain),
+                'phone': f'555-{rng.randrange(1000, 9999)}',
+                'title': rng.choice(TITLES),
+                'notes': rng.choice(NOTES),
+                'account_id': account_id,
+                'last_contact': (BASE_TIME - timedelta(days=rng.randrange(90))).date(),
+            })
+            row['create_date'] = updated_at.date()
+            contact_ids.append(row['id'])
+            writer.add(Contact.__table__, row)
+    writer.flush(Contact.__table__)
+
+    stages, weights = zip(*SALES_STAGES)
+    for account_id in accounts:
+        for _ in range(_count(rng, volumes['opportunities_per_account'])):
+            stage, forecast = rng.choices(stages, weights)[0]
+            row, updated_at = owned({
+                'id': _uuid(rng),
+                'name': f'{rng.choice(COMPANY_SUFFIXES)} {rng.choice(("Renewal", "Expansion", "Pilot", "Rollout"))}',
+                'sales_stage': stage,
+                'forecast': forecast,
+                'amount': Decimal(rng.randrange(1000, 500000)),
+                'company_id': account_id,
+                'contact_id': rng.choice(contacts_by_account[account_id]),
+                'next_steps': rng.choice(NOTES),
+                'close_date': (BASE_TIME + timedelta(days=rng.randrange(-180, 180))).date(),
+                'requirements': rng.choice(NOTES),
+            })
+            row['created_date'] = updated_at.date()
+            writer.add(Opportunity.__table__, row)
+    writer.flush(Opportunity.__table__)
+
+    for _ in range(volumes['leads']):
+        first, last = _person(rng)
+        serial += 1
+        row, updated_at = owned({
+            'id': _uuid(rng),
+            'company_name': _company(rng),
+            'contact_person': f'{first} {last}',
+            'email': _email(first, last, serial, 'prospect.example.com'),
+            'phone': f'555-{rng.randrange(1000, 9999)}',
+            'source': rng.choice(LEAD_SOURCES),
+            'stage': rng.choice(LEAD_STAGES),
+            'notes': rng.choice(NOTES),
+            'is_converted': rng.random() < 0.1,
+        })
+        row['created_date'] = updated_at.date()
+        writer.add(Lead.__table__, row)
+    writer.flush(Lead.__table__)
+
+    return len(user_ids)
+
+
+class _Collector:
+    """Writer stand-in that keeps the rows in memory"""
+
+    def __init__(self):
+        self.rows = {}
+
+    def add(self, table, row):
+        self.rows.setdefault(table.name, []).append(row)
+
+    def flush(self, table=None):
+        pass
+
+
+def generate_rows(volumes=None, seed=0, org_no=0):
+    """Return one organization's rows as ``{table name: [row dicts]}``
+    without touching the database (used by benchmark_micro.py)"""
+    volumes = dict(DEFAULT_VOLUMES, **(volumes or {}))
+    collector = _Collector()
+    _generate_org(collector, random.Random(f'{seed}-{org_no}'), f's{seed}o{org_no}',
+                  volumes, 1, 'not-a-password-hash')
+    return collector.rows
+
+
+def drop_secondary_indexes(connection):
+    """Drop model and search indexes so a bulk load does not maintain them"""
+    from search import SEARCH_SPECS, drop_search_index
+
+    for entity in SEARCH_SPECS:
+        drop_search_index(connection, entity)
+    # IF EXISTS rather than checkfirst: expression indexes are not reflected
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            connection.execute(DropIndex(index, if_exists=True))
+    connection.commit()
+
+
+def create_secondary_indexes(connection):
+    """Rebuild what drop_secondary_indexes() removed and refresh statistics"""
+    from search import SEARCH_SPECS, create_search_index
+
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            connection.execute(CreateIndex(index, if_not_exists=True))
+    for entity in SEARCH_SPECS:
+        create_search_index(connection, entity, rebuild=True)
+    connection.exec_driver_sql('ANALYZE')
+    connection.commit()
+
+
+def generate(orgs, volumes=None, seed=0, batch_size=DEFAULT_BATCH_SIZE,
+             password='loadtest', defer_indexes=False, progress=None):
+    """Generate ``orgs`` organizations; returns ``{table: rows inserted}``.
+
+    Usernames are ``s<seed>o<N>_user<K>``, so different seeds can be loaded
+    into the same database; loading a seed twice fails on the unique
+    usernames. Must run inside an application context.
+    """
+    volumes = dict(DEFAULT_VOLUMES, **(volumes or {}))
+    # Hashing is deliberately slow; every generated user shares one hash
+    password_hash = generate_password_hash(password)
+
+    with db.engine.connect() as connection:
+        if connection.dialect.name == 'sqlite':
+            # Generated data can be regenerated; skip the fsync per commit
+            connection.exec_driver_sql('PRAGMA synchronous = OFF')
+        if defer_indexes:
+            drop_secondary_indexes(connection)
+
+        next_user_id = (connection.execute(select(func.max(User.id))).scalar() or 0) + 1
+        writer = _Writer(connection, batch_size, progress)
+        for org_no in range(orgs):
+            rng = random.Random(f'{seed}-{org_no}')
+            next_user_id += _generate_org(writer, rng, f's{seed}o{org_no}', volumes,
+                                          next_user_id, password_hash)
+
+        if connection.dialect.name == 'postgresql':
+            # Ids were assigned here, so move the sequence past them
+            connection.exec_driver_sql(
+                "SELECT setval(pg_get_serial_sequence('users', 'id'), (SELECT max(id) FROM users))"
+            )
+            connection.commit()
+        if defer_indexes:
+            started = time.monotonic()
+            create_secondary_indexes(connection)
+            writer.totals['index_seconds'] = round(time.monotonic() - started, 1)
+
+    from counters import recount_all
+    from stage_history import seed_missing
+    recount_all()
+    seed_missing()
+    db.session.commit()
+    return writer.totals
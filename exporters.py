@@ -0,0 +1,174 @@
+"""Constant-memory CSV and NDJSON export of org-scoped records.
+
+Rows are read with ``yield_per`` (a server-side cursor on PostgreSQL) and
+encoded one batch at a time, so an export holds a single batch in memory no
+matter how many rows the tenant has, and the first chunk can be sent as soon
+as the first batch arrives.
+
+Background export jobs pass ``paged=True``: every batch is then a query of
+its own after the last row's id, so no cursor stays open between batches and
+the job can report progress in between (on SQLite an open cursor would block
+the progress write). Rows are exported in primary key order, which an edit
+during the export does not change, so every row is written exactly once.
+"""
+import csv
+import json
+from io import StringIO
+
+from sqlalchemy import select
+
+from database import db
+from models import Lead, Account, Contact, Opportunity
+
+EXPORT_BATCH_SIZE = 1000
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def _date(value):
+    return value.isoformat() if value else None
+
+
+def _amount(value):
+    return float(value) if value else None
+
+
+# Exported fields per entity: (CSV header, NDJSON key, column, formatter).
+# NDJSON keys and value formats follow the models' to_dict().
+EXPORT_SPECS = {
+    # /leads/export serves this CSV, so its columns stay as they were
+    'leads': (Lead, (
+        ('Contact Person', 'contactPerson', Lead.contact_person, None),
+        ('Company', 'companyName', Lead.company_name, None),
+        ('Email', 'email', Lead.email, None),
+        ('Phone', 'phone', Lead.phone, None),
+        ('Stage', 'stage', Lead.stage, None),
+        ('Created Date', 'createdDate', Lead.created_date, _date),
+    )),
+    'accounts': (Account, (
+        ('Company', 'companyName', Account.company_name, None),
+        ('Address Line 1', 'addressLine1', Account.address_line1, None),
+        ('Address Line 2', 'addressLine2', Account.address_line2, None),
+        ('City', 'city', Account.city, None),
+        ('Province/State', 'provinceState', Account.province_state, None),
+        ('Postal/Zip Code', 'postalZipCode', Account.postal_zip_code, None),
+        ('Country', 'country', Account.country, None),
+        ('Description', 'description', Account.description, None),
+        ('Created Date', 'createDate', Account.create_date, _date),
+        ('ID', 'id', Account.id, None),
+    )),
+    'contacts': (Contact, (
+        ('First Name', 'firstName', Contact.first_name, None),
+        ('Last Name', 'lastName', Contact.last_name, None),
+        ('Email', 'email', Contact.email, None),
+        ('Phone', 'phone', Contact.phone, None),
+        ('Title', 'title', Contact.title, None),
+        ('Account ID', 'accountId', Contact.account_id, None),
+        ('Last Contact', 'lastContact', Contact.last_contact, _date),
+        ('Created Date', 'createDate', Contact.create_date, _date),
+        ('ID', 'id', Contact.id, None),
+    )),
+    'opportunities': (Opportunity, (
+        ('Name', 'name', Opportunity.name, None),
+        ('Sales Stage', 'salesStage', Opportunity.sales_stage, None),
+        ('Forecast', 'forecast', Opportunity.forecast, None),
+        ('Amount', 'amount', Opportunity.amount, _amount),
+        ('Account ID', 'companyId', Opportunity.company_id, None),
+        ('Contact ID', 'contactId', Opportunity.contact_id, None),
+        ('Close Date', 'closeDate', Opportunity.close_date, _date),
+        ('Contract Date', 'contractDate', Opportunity.contract_date, _date),
+        ('Created Date', 'createdDate', Opportunity.created_date, _date),
+        ('ID', 'id', Opportunity.id, None),
+    )),
+}
+
+
+def export_statement(entity, org_filter):
+    """Build the SELECT for one entity, in id order along the scoped index"""
+    model, fields = EXPORT_SPECS[entity]
+    stmt = select(*[column for _, _, column, _ in fields])
+    stmt = stmt.where(*[getattr(model, name) == value for name, value in org_filter.items()])
+    return stmt.order_by(model.id)
+
+
+def _streamed_rows(entity, org_filter, batch_size):
+    stmt = export_statement(entity, org_filter).execution_options(yield_per=batch_size)
+    result = db.session.execute(stmt)
+    try:
+        yield from result.partitions()
+    finally:
+        result.close()
+
+
+def page_statement(entity, org_filter, batch_size, after=None):
+    """The export SELECT for the ``batch_size`` rows with an id after
+    ``after``; the id comes last"""
+    model, _ = EXPORT_SPECS[entity]
+    stmt = export_statement(entity, org_filter).add_columns(model.id)
+    if after is not None:
+        stmt = stmt.where(model.id > after)
+    return stmt.limit(batch_size)
+
+
+def _paged_rows(entity, org_filter, batch_size):
+    _, fields = EXPORT_SPECS[entity]
+    after = None
+    while True:
+        rows = db.session.execute(page_statement(entity, org_filter, batch_size, after)).all()
+        if rows:
+            yield [row[:len(fields)] for row in rows]
+        if len(rows) < batch_size:
+            return
+        after = rows[-1][-1]
+
+
+def _iter_batches(entity, org_filter, batch_size, paged=False, progress=None):
+    _, fields = EXPORT_SPECS[entity]
+    formatters = [formatter for _, _, _, formatter in fields]
+    done = 0
+    for batch in (_paged_rows if paged else _streamed_rows)(entity, org_filter, batch_size):
+        yield [
+            [fmt(value) if fmt else value for fmt, value in zip(formatters, row)]
+            for row in batch
+        ]
+        done += len(batch)
+        if progress:
+            progress(done)
+
+
+def iter_csv(entity, org_filter, batch_size=EXPORT_BATCH_SIZE, paged=False, progress=None):
+    """Yield the CSV export as text chunks, one per batch"""
+    _, fields = EXPORT_SPECS[entity]
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([header for header, _, _, _ in fields])
+    yield buffer.getvalue()
+
+    for batch in _iter_batches(entity, org_filter, batch_size, paged, progress):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(['' if value is None else value for value in row] for row in batch)
+        yield buffer.getvalue()
+
+
+def iter_ndjson(entity, org_filter, batch_size=EXPORT_BATCH_SIZE, paged=False, progress=None):
+    """Yield the export as newline-delimited JSON, one chunk per batch"""
+    _, fields = EXPORT_SPECS[entity]
+    keys = [key for _, key, _, _ in fields]
+    for batch in _iter_batches(entity, org_filter, batch_size, paged, progress):
+        yield ''.join(json.dumps(dict(zip(keys, row))) + '\n' for row in batch)
+
+
+def iter_export(entity, fmt, org_filter, batch_size=EXPORT_BATCH_SIZE, paged=False, progress=None):
+    """Return a text chunk generator for ``entity`` in ``fmt``.
+
+    ``progress(rows so far)`` is called once each batch has been consumed.
+    """
+    if fmt == 'csv':
+        return iter_csv(entity, org_filter, batch_size, paged, progress)
+    if fmt == 'ndjson':
+        return iter_ndjson(entity, org_filter, batch_size, paged, progress)
+    raise ValueError(f'Unsupported export format: {fmt}')
@@ -44,3 +44,9 @@ def when_ready(server):
 def worker_init(worker):
     """Called just after a worker has been forked."""
     print(f"Worker {worker.pid} initialized")
+
+def post_worker_init(worker):
+    """Called after the worker has loaded the app."""
+    # Pick up background jobs queued or interrupted before this worker started
+    from jobs import runner
+    runner.resume_pending()
@@ -0,0 +1,147 @@
+"""Per-process cache of the identity behind ``current_user``.
+
+Flask-Login calls the user loader on every authenticated request. Instead of
+a ``users`` lookup each time, the loader returns a ``CachedUser`` holding the
+few fields the app reads from ``current_user`` (id, organization_id, is_admin,
+is_active and the name shown in the header), kept in a bounded LRU for at most
+``IDENTITY_CACHE_TTL`` seconds.
+
+Any ORM insert, update or delete of a User evicts that user once the
+transaction commits, so toggle_admin, remove_user, invite_user and
+setup_organization take effect on this process's next request. Other worker
+processes pick the change up when their entry expires, which bounds staleness
+to the TTL. Code that needs to modify the user must load the row itself
+(``current_user.load()``).
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from database import db
+from models import User
+
+DEFAULT_TTL = 30
+DEFAULT_MAX_SIZE = 1024
+
+_SESSION_KEY = 'identity_cache_evictions'
+
+
+class CachedUser(UserMixin):
+    """Detached, read-only stand-in for the logged-in User"""
+
+    def __init__(self, user):
+        self.id = user.id
+        self.username = user.username
+        self.first_name = user.first_name
+        self.last_name = user.last_name
+        self.organization_id = user.organization_id
+        self.is_admin = bool(user.is_admin)
+        self._active = user.is_active is not False
+
+    @property
+    def is_active(self):
+        return self._active
+
+    def load(self):
+        """Return the User row for this identity (one query)"""
+        return db.session.get(User, self.id)
+
+
+class IdentityCache:
+    """Thread-safe LRU of ``CachedUser`` entries with a time-to-live"""
+
+    def __init__(self, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, ttl, max_size):
+        with self._lock:
+            self.ttl = ttl
+            self.max_size = max_size
+            self._entries.clear()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            identity, expires = entry
+            if expires <= time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return identity
+
+    def put(self, identity):
+        if self.ttl <= 0 or self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[identity.id] = (identity, time.monotonic() + self.ttl)
+            self._entries.move_to_end(identity.id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+identity_cache = IdentityCache()
+
+
+def load_identity(user_id):
+    """User loader body: cached identity, or one lookup on a miss"""
+    identity = identity_cache.get(user_id)
+    if identity is not None:
+        return identity
+    user = db.session.get(User, user_id)
+    if user is None:
+        return None
+    identity = CachedUser(user)
+    identity_cache.put(identity)
+    return identity
+
+
+# Evict users written in a transaction once it commits; evicting at flush
+# time would let a concurrent request re-cache the old committed row
+
+def _queue_eviction(mapper, connection, target):
+    session = object_session(target)
+    if session is not None and target.id is not None:
+        session.info.setdefault(_SESSION_KEY, set()).add(target.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _after_commit(session):
+    for user_id in session.info.pop(_SESSION_KEY, ()):
+        identity_cache.invalidate(user_id)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _after_soft_rollback(session, previous_transaction):
+    # Nothing was written, but evicting is always safe
+    for user_id in session.info.pop(_SESSION_KEY, ()):
+        identity_cache.invalidate(user_id)
+
+
+for _name in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(User, _name, _queue_eviction)
+
+
+@event.listens_for(User.__table__, 'after_create')
+def _users_table_created(target, connection, **kw):
+    # A recreated table reuses ids, so nothing cached can still be valid
+    identity_cache.clear()
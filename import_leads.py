@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Bulk import leads from a CSV file
+
+Usage:
+    python import_leads.py --user <username> leads.csv [--batch-size 5000] [--errors errors.csv]
+
+The CSV needs Company Name, Contact Person and Email columns (API names such
+as companyName or the lead export headers are both accepted); Phone, Source,
+Stage and Notes are optional. Rows are validated like the API and inserted in
+batches; rejected rows are listed in the error report.
+"""
+import sys
+import os
+import csv
+import argparse
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app
+from models import User
+from importers import import_leads, ImportFormatError
+
+def run_import(path, username, batch_size, errors_path=None):
+    """Import ``path`` as leads owned by ``username``"""
+    with app.app_context():
+        user = User.query.filter_by(username=username).first()
+        if not user:
+            print(f"❌ User not found: {username}")
+            return False
+
+        def progress(report):
+            print(f"   {report['total']} rows read, {report['inserted']} inserted, "
+                  f"{len(report['errors'])} rejected")
+
+        print(f"Importing leads from {path} for {username} in batches of {batch_size}...")
+        try:
+            with open(path, newline='', encoding='utf-8-sig') as f:
+                report = import_leads(f, user, batch_size=batch_size, progress=progress)
+        except ImportFormatError as e:
+            print(f"❌ {str(e)}")
+            return False
+
+    print(f"✅ Imported {report['inserted']} of {report['total']} leads")
+    if report['errors']:
+        print(f"⚠️  {len(report['errors'])} rows rejected")
+        if errors_path:
+            with open(errors_path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['Row', 'Errors'])
+                for error in report['errors']:
+                    writer.writerow([error['row'], '; '.join(error['errors'])])
+            print(f"   Error report written to {errors_path}")
+        else:
+            for error in report['errors'][:20]:
+                print(f"   row {error['row']}: {'; '.join(error['errors'])}")
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Bulk import leads from a CSV file')
+    parser.add_argument('path', help='CSV file to import')
+    parser.add_argument('--user', required=True, help='username that will own the leads')
+    parser.add_argument('--batch-size', type=int, default=app.config['IMPORT_BATCH_SIZE'],
+                        help='rows per INSERT batch')
+    parser.add_argument('--errors', help='write rejected rows to this CSV file')
+    args = parser.parse_args()
+
+    success = run_import(args.path, args.user, args.batch_size, args.errors)
+    sys.exit(0 if success else 1)
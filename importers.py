@@ -0,0 +1,139 @@
+"""Bulk CSV import of leads.
+
+The CSV is read as a stream and every row goes through validate_lead_data().
+Valid rows are inserted with one executemany Core INSERT per batch, each batch
+in its own transaction, so a large migration neither builds ORM objects nor
+holds the whole file in memory. The report lists every rejected row.
+"""
+import csv
+import re
+import uuid
+from datetime import datetime, date
+
+from sqlalchemy import insert
+
+from database import db
+from models import Lead
+from validation import validate_lead_data
+
+DEFAULT_IMPORT_BATCH_SIZE = 1000
+
+# Accepted CSV headers (compared lower-case with punctuation removed) mapped
+# to the API field names validate_lead_data() expects. Both the API names and
+# the lead export headers are accepted, so an export can be re-imported.
+HEADER_ALIASES = {
+    'companyname': 'companyName',
+    'company': 'companyName',
+    'contactperson': 'contactPerson',
+    'contact': 'contactPerson',
+    'name': 'contactPerson',
+    'email': 'email',
+    'phone': 'phone',
+    'source': 'source',
+    'stage': 'stage',
+    'notes': 'notes',
+}
+
+REQUIRED_FIELDS = ('companyName', 'contactPerson', 'email')
+
+
+class ImportFormatError(ValueError):
+    """Raised when the CSV cannot be imported at all (e.g. missing columns)"""
+
+
+def map_headers(fieldnames):
+    """Map CSV headers to API field names, ignoring unknown columns"""
+    mapping = {}
+    for header in fieldnames or []:
+        key = re.sub(r'[^a-z]', '', header.lower())
+        if key in HEADER_ALIASES and HEADER_ALIASES[key] not in mapping.values():
+            mapping[header] = HEADER_ALIASES[key]
+    missing = [field for field in REQUIRED_FIELDS if field not in mapping.values()]
+    if missing:
+        raise ImportFormatError(f"Missing required columns: {', '.join(missing)}")
+    return mapping
+
+
+def _lead_row(data, user, today, now):
+    """Build the column values for one validated lead"""
+    return {
+        'id': str(uuid.uuid4()),
+        'company_name': data['companyName'],
+        'contact_person': data['contactPerson'],
+        'email': data['email'],
+        'phone': data.get('phone') or None,
+        'source': data.get('source') or None,
+        'stage': data.get('stage') or 'MQL',
+        'notes': data.get('notes') or None,
+        'is_converted': False,
+        'created_date': today,
+        'created_by': user.id,
+        'organization_id': user.organization_id,
+        'updated_at': now,
+    }
+
+
+def _flush_batch(rows, line_numbers, user, report):
+    """Insert one batch in its own transaction"""
+    from counters import apply_deltas, record_scopes
+    from stage_history import change_row, record_changes
+
+    try:
+        db.session.execute(insert(Lead.__table__), rows)
+        # Core inserts bypass the ORM counter and stage history events
+        connection = db.session.connection()
+        apply_deltas(connection, {
+            (scope, 'leads'): len(rows)
+            for scope in record_scopes(user.organization_id, user.id)
+        })
+        record_changes(connection, [
+            change_row('leads', row['id'], None, row['stage'], row['organization_id'],
+                       row['created_by'], row['updated_at'])
+            for row in rows
+        ])
+        db.session.commit()
+        report['inserted'] += len(rows)
+    except Exception as e:
+        db.session.rollback()
+        print(f"Database error during lead import batch: {str(e)}")
+        for line in line_numbers:
+            report['errors'].append({'row': line, 'errors': ['Database error while inserting batch']})
+
+
+def import_leads(lines, user, batch_size=DEFAULT_IMPORT_BATCH_SIZE, progress=None):
+    """Import leads for ``user`` from an iterable of CSV text lines.
+
+    Returns ``{'total', 'inserted', 'errors': [{'row', 'errors'}]}`` where
+    ``row`` is the 1-based line number in the file (the header is line 1).
+    ``progress`` is called with the report after every batch.
+    """
+    reader = csv.DictReader(lines)
+    mapping = map_headers(reader.fieldnames)
+    report = {'total': 0, 'inserted': 0, 'errors': []}
+    today = date.today()
+    now = datetime.utcnow()
+
+    batch, line_numbers = [], []
+    for record in reader:
+        report['total'] += 1
+        line = reader.line_num
+        data = {field: (record.get(header) or '').strip() for header, field in mapping.items()}
+
+        errors = validate_lead_data(data)
+        if errors:
+            report['errors'].append({'row': line, 'errors': errors})
+            continue
+
+        batch.append(_lead_row(data, user, today, now))
+        line_numbers.append(line)
+        if len(batch) >= batch_size:
+            _flush_batch(batch, line_numbers, user, report)
+            batch, line_numbers = [], []
+            if progress:
+                progress(report)
+
+    if batch:
+        _flush_batch(batch, line_numbers, user, report)
+    if progress:
+        progress(report)
+    return report
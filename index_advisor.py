@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Index advisor: run the application's query shapes through EXPLAIN
+
+Builds the same queries the routes issue (org- and user-scoped lists, keyset
+pages, list page search/sort/filter, list versions, delta sync, the pipeline, trend and funnel reports, dashboard counts, export job batches, record lookups, full-text
+search, form pickers and the organization re-parenting updates) and reports every plan step that falls
+back to a full table scan (and, as a warning, sorts that no index serves). Works against SQLite and PostgreSQL.
+
+Usage:
+    python index_advisor.py            # print the report
+    python index_advisor.py --verbose  # include the full plan for every query
+    python index_advisor.py --strict   # exit 1 if any sequential scan is found
+"""
+import sys
+import os
+import json
+import argparse
+from datetime import datetime
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import update
+
+from models import db, User, Lead, Account, Contact, Opportunity, StageChange, Job
+from pagination import keyset_filter
+from listing import LIST_SPECS, parse_list_args, apply_list_state
+from search import search_statement
+from exporters import EXPORT_SPECS, EXPORT_BATCH_SIZE, page_statement
+from typeahead import account_lookup_statement, contact_lookup_statements
+from sync import records_statement, tombstones_statement
+from counters import org_scope, user_scope
+from reparenting import batch_statement
+from reports import parse_pipeline_args, pipeline_statement, parse_trend_args, trend_statement
+from analytics import (FUNNELS, funnel_statement, conversion_rates_statement,
+                       time_in_stage_statement, cohorts_statement)
+
+# Placeholder scope values; plans do not depend on the actual tenant
+SAMPLE_SCOPES = {
+    'org': {'organization_id': '00000000-0000-0000-0000-000000000000'},
+    'owner': {'created_by': 1},
+}
+SAMPLE_CURSOR = (datetime(2025, 1, 1), '00000000-0000-0000-0000-000000000000')
+SAMPLE_ID = '00000000-0000-0000-0000-000000000000'
+
+API_LISTS = (
+    ('leads', Lead, {'is_converted': False}),
+    ('accounts', Account, {}),
+    ('contacts', Contact, {}),
+    ('opportunities', Opportunity, {}),
+)
+
+def query_shapes():
+    """Yield ``(name, statement)`` for every query shape worth checking.
+
+    Must be called inside an application context.
+    """
+    for scope_name, scope in SAMPLE_SCOPES.items():
+        # /api list endpoints: first page and a resumed page
+        for entity, model, extra in API_LISTS:
+            base = model.query.filter_by(**scope, **extra)
+            ordered = base.order_by(model.updated_at, model.id).limit(101)
+            yield f'api.{entity} first page [{scope_name}]', ordered.statement
+            resumed = base.filter(keyset_filter(model, SAMPLE_CURSOR))
+            resumed = resumed.order_by(model.updated_at, model.id).limit(101)
+            yield f'api.{entity} next page [{scope_name}]', resumed.statement
+
+        # HTML list pages: default order, every sort, filters and their counts
+        for entity, spec in LIST_SPECS.items():
+            model = spec['model']
+            base = model.query.filter_by(**scope)
+            for sort in spec['sorts']:
+                state = parse_list_args(entity, {'sort': sort})
+                query = apply_list_state(entity, base, state).limit(25)
+                yield f'main.{entity} sort={sort} [{scope_name}]', query.statement
+            for name in spec['filters']:
+                state = parse_list_args(entity, {name: 'x'})
+                query = apply_list_state(entity, base, state)
+                yield f'main.{entity} {name} filter [{scope_name}]', query.limit(25).statement
+                yield f'main.{entity} {name} filter count [{scope_name}]', \
+                    query.order_by(None).with_entities(db.func.count()).statement
+
+        # Dashboard counts
+        for entity, model, extra in API_LISTS:
+            query = model.query.filter_by(**scope, **extra).with_entities(db.func.count())
+            yield f'dashboard {entity} count [{scope_name}]', query.statement
+
+        # List versions behind the list ETags (conditional.list_version)
+        for entity, model, extra in API_LISTS:
+            for prefix, filters in (('api', extra), ('main', {})):
+                query = model.query.filter_by(**scope, **filters).with_entities(
+                    db.func.count(), db.func.max(model.updated_at))
+                yield f'{prefix}.{entity} version [{scope_name}]', query.statement
+
+        # ?since= delta sync: changed records and tombstones after a token
+        for entity, model, _ in API_LISTS:
+            for name, statement in (('records', records_statement), ('tombstones', tombstones_statement)):
+                yield (f'api.{entity} since {name} [{scope_name}]',
+                       statement(model, scope, SAMPLE_CURSOR, SAMPLE_CURSOR[0], 101))
+
+        # Pipeline report aggregation
+        yield f'pipeline report [{scope_name}]', pipeline_statement(
+            db.engine.dialect.name, scope, parse_pipeline_args({}))
+
+        # Pipeline trend from the daily snapshots
+        snapshot_scope = (org_scope(scope['organization_id']) if 'organization_id' in scope
+                          else user_scope(scope['created_by']))
+        for interval in ('day', 'month'):
+            yield f'pipeline trend by {interval} [{scope_name}]', trend_statement(
+                db.engine.dialect.name, snapshot_scope, parse_trend_args({'interval': interval}))
+
+        # Funnel and velocity reports over the stage history
+        no_period = {'from': None, 'to': None}
+        dialect_name = db.engine.dialect.name
+        for entity in FUNNELS:
+            yield f'{entity} funnel [{scope_name}]', funnel_statement(entity, scope, no_period)
+            yield f'{entity} conversion rates [{scope_name}]', \
+                conversion_rates_statement(entity, scope, no_period)
+            yield f'{entity} time in stage [{scope_name}]', \
+                time_in_stage_statement(dialect_name, entity, scope, no_period)
+            yield f'{entity} cohorts [{scope_name}]', \
+                cohorts_statement(dialect_name, entity, scope, no_period)
+
+        # Background export jobs: one query per batch
+        for entity in EXPORT_SPECS:
+            for name, after in (('first', None), ('next', SAMPLE_ID)):
+                yield f'export {entity} {name} batch [{scope_name}]', \
+                    page_statement(entity, scope, EXPORT_BATCH_SIZE, after)
+
+        # Single record lookups by id within the scope
+        for entity, model, _ in API_LISTS:
+            query = model.query.filter_by(id=SAMPLE_ID, **scope)
+            yield f'{entity} lookup [{scope_name}]', query.statement
+
+        # Contacts of one account (edit account page)
+        query = Contact.query.filter_by(account_id=SAMPLE_ID).filter_by(**scope)
+        yield f'contacts of account [{scope_name}]', query.statement
+
+        # Full-text search across all entities
+        yield f'search [{scope_name}]', search_statement(db.engine.dialect.name, 'acme corp', scope)
+
+        # Account and contact pickers on the forms
+        yield f'account lookup [{scope_name}]', account_lookup_statement(scope, 'acm')
+        yield f'account lookup empty [{scope_name}]', account_lookup_statement(scope)
+        for i, stmt in enumerate(contact_lookup_statements(scope, 'gre')):
+            yield f'contact lookup #{i + 1} [{scope_name}]', stmt
+        stmt, = contact_lookup_statements(scope, 'greta zep')
+        yield f'contact lookup full name [{scope_name}]', stmt
+
+    # Organization members (user management page)
+    query = User.query.filter_by(**SAMPLE_SCOPES['org'])
+    yield 'users of organization', query.statement
+
+    # A user's background jobs (/api/jobs)
+    query = Job.query.filter_by(created_by=1).order_by(Job.created_at.desc()).limit(50)
+    yield 'jobs of user', query.statement
+
+    # The stale job sweep run on job polls, and the long-queued jobs it submits
+    yield 'stale job sweep', update(Job).where(
+        Job.status == 'running', Job.heartbeat_at < SAMPLE_CURSOR[0],
+        Job.kind.in_(['setup_organization'])).values(status='queued')
+    query = Job.query.filter(Job.status == 'queued', Job.created_at < SAMPLE_CURSOR[0])
+    yield 'long-queued jobs', query.order_by(Job.created_at).with_entities(Job.id).statement
+
+    # Re-parenting a user's records when they set up an organization, one
+    # batch at a time (reparenting.py)
+    org_id = SAMPLE_SCOPES['org']['organization_id']
+    for entity, model, _ in API_LISTS:
+        for position, after in (('first', None), ('next', SAMPLE_ID)):
+            yield (f'setup_organization {entity} {position} batch',
+                   batch_statement(model, 1, org_id, after, 500))
+        stmt = update(model).where(model.id.in_([SAMPLE_ID])).values(organization_id=org_id)
+        yield f'setup_organization {entity} update', stmt
+    stmt = update(StageChange).where(StageChange.entity == 'leads', StageChange.record_id.in_([SAMPLE_ID]),
+                                     StageChange.created_by == 1).values(organization_id=org_id)
+    yield 'setup_organization stage history update', stmt
+
+def explain(conn, statement):
+    """Return ``(plan_lines, scans, sorts)`` for one statement on the current dialect"""
+    dialect = conn.dialect
+    # Sample values are rendered inline; they never come from user input
+    sql = str(statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+
+    if dialect.name == 'sqlite':
+        rows = conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}').fetchall()
+        plan = [row[-1] for row in rows]
+        # "SCAN <table>" without an index is a full table scan; "SCAN ... USING
+        # (COVERING) INDEX" walks an index and "SEARCH" is an index range lookup.
+        # Scans of subquery results (co-routines, materialized views) read
+        # rows an earlier step already produced
+        derived = {line.split(' ', 1)[1] for line in plan
+                   if line.startswith(('CO-ROUTINE ', 'MATERIALIZE '))}
+        scans = [line for line in plan
+                 if line.startswith('SCAN') and 'INDEX' not in line
+                 and not line.startswith('SCAN CONSTANT')
+                 and line[len('SCAN '):] not in derived]
+        sorts = [line for line in plan if line.startswith('USE TEMP B-TREE')]
+        return plan, scans, sorts
+
+    if dialect.name == 'postgresql':
+        # Make sequential scans a last resort so small development tables
+        # still show whether a usable index exists
+        conn.exec_driver_sql('SET LOCAL enable_seqscan = off')
+        rows = conn.exec_driver_sql(f'EXPLAIN (FORMAT JSON) {sql}').fetchall()
+        document = rows[0][0]
+        if isinstance(document, str):
+            document = json.loads(document)
+        plan, scans, sorts = [], [], []
+
+        def walk(node, depth=0):
+            label = node['Node Type']
+            if 'Relation Name' in node:
+                label += f" on {node['Relation Name']}"
+            if 'Index Name' in node:
+                label += f" using {node['Index Name']}"
+            plan.append('  ' * depth + label)
+            if node['Node Type'] == 'Seq Scan':
+                scans.append(label)
+            elif node['Node Type'] in ('Sort', 'Incremental Sort'):
+                sorts.append(label)
+            for child in node.get('Plans', []):
+                walk(child, depth + 1)
+
+        walk(document[0]['Plan'])
+        return plan, scans, sorts
+
+    raise RuntimeError(f'Unsupported dialect for the index advisor: {dialect.name}')
+
+def run_advisor():
+    """Explain every query shape and return a list of result dicts"""
+    results = []
+    with db.engine.connect() as conn:
+        for name, statement in query_shapes():
+            trans = conn.begin()
+            try:
+                plan, scans, sorts = explain(conn, statement)
+            finally:
+                # Keep PostgreSQL's SET LOCAL scoped to this one EXPLAIN
+                trans.rollback()
+            results.append({'query': name, 'plan': plan,
+                            'sequential_scans': scans, 'sorts': sorts})
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Report query shapes that need a full table scan')
+    parser.add_argument('--verbose', action='store_true', help='print the plan of every query')
+    parser.add_argument('--strict', action='store_true', help='exit with status 1 if any scan is found')
+    args = parser.parse_args(argv)
+
+    from app import app
+
+    with app.app_context():
+        print(f"Index advisor on {db.engine.dialect.name}")
+        results = run_advisor()
+
+    flagged = [r for r in results if r['sequential_scans']]
+    sorted_ = [r for r in results if r['sorts'] and not r['sequential_scans']]
+    for result in results:
+        if result['sequential_scans']:
+            status = '❌'
+        elif result['sorts']:
+            status = '⚠️ '
+        else:
+            status = '✅'
+        if args.verbose or result['sequential_scans']:
+            print(f"{status} {result['query']}")
+            for line in result['plan']:
+                print(f"     {line}")
+    print(f"\n{len(results)} query shapes checked, {len(flagged)} with sequential scans, "
+          f"{len(sorted_)} sorting outside an index")
+    return 1 if args.strict and flagged else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
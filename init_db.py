@@ -6,20 +6,16 @@ This script creates all necessary database tables and sample data
 
 import os
 import sys
-from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash
+from datetime import date
 
 # Add the current directory to the path so we can import our modules
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from models import db, User, Account, Contact, Lead, Opportunity, Task
-from app import create_app
+from models import db, User, Account, Contact, Lead, Opportunity
+from app import app
 
 def init_database():
     """Initialize the database with tables and sample data"""
-    app = create_app()
-    
     with app.app_context():
         print("Creating database tables...")
         
@@ -36,17 +32,18 @@ def init_database():
             email='admin@elscrm.com',
             first_name='Admin',
             last_name='User',
-            password_hash=generate_password_hash('admin123')
+            is_admin=True
         )
+        admin_user.set_password('admin123')
         
         # Create demo user
         demo_user = User(
             username='demo',
             email='demo@elscrm.com',
             first_name='Demo',
-            last_name='User',
-            password_hash=generate_password_hash('demo123')
+            last_name='User'
         )
+        demo_user.set_password('demo123')
         
         db.session.add(admin_user)
         db.session.add(demo_user)
@@ -61,13 +58,14 @@ def init_database():
         
         # Sample Account
         sample_account = Account(
-            name='Acme Corporation',
-            industry='Technology',
-            phone='555-0123',
-            email='info@acme.com',
-            website='https://acme.com',
-            address='123 Business St, Tech City, TC 12345',
-            user_id=demo_user.id
+            company_name='Acme Corporation',
+            address_line1='123 Business St',
+            city='Tech City',
+            province_state='TC',
+            postal_zip_code='12345',
+            country='USA',
+            description='Technology company',
+            created_by=demo_user.id
         )
         db.session.add(sample_account)
         db.session.commit()
@@ -78,24 +76,22 @@ def init_database():
             last_name='Smith',
             email='john.smith@acme.com',
             phone='555-0124',
-            position='CTO',
-            company='Acme Corporation',
+            title='CTO',
             account_id=sample_account.id,
-            user_id=demo_user.id
+            created_by=demo_user.id
         )
         db.session.add(sample_contact)
+        db.session.commit()
         
         # Sample Lead
         sample_lead = Lead(
-            first_name='Jane',
-            last_name='Doe',
+            company_name='Prospect Inc',
+            contact_person='Jane Doe',
             email='jane.doe@prospect.com',
             phone='555-0125',
-            company='Prospect Inc',
-            position='CEO',
             source='Website',
-            status='New',
-            user_id=demo_user.id
+            stage='MQL',
+            created_by=demo_user.id
         )
         db.session.add(sample_lead)
         
@@ -103,26 +99,16 @@ def init_database():
         sample_opportunity = Opportunity(
             name='Enterprise Software License',
             amount=50000.00,
-            stage='Proposal',
-            probability=75,
-            close_date='2025-07-01',
-            description='Large enterprise software licensing deal',
-            account_id=sample_account.id,
-            user_id=demo_user.id
-        )
-        db.session.add(sample_opportunity)
-        
-        # Sample Task
-        sample_task = Task(
-            title='Follow up with John Smith',
-            description='Schedule demo call for next week',
-            status='Pending',
-            priority='High',
-            due_date='2025-06-10',
+            sales_stage='Proposal',
+            forecast='50%',
+            close_date=date(2025, 7, 1),
+            next_steps='Schedule demo call with John Smith for next week',
+            requirements='Large enterprise software licensing deal',
+            company_id=sample_account.id,
             contact_id=sample_contact.id,
-            user_id=demo_user.id
+            created_by=demo_user.id
         )
-        db.session.add(sample_task)
+        db.session.add(sample_opportunity)
         
         db.session.commit()
         print("Sample data created successfully!")
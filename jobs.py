@@ -0,0 +1,360 @@
+"""Background jobs: long-running work off the request thread.
+
+A request that starts a job inserts a ``Job`` row (the queue) and returns
+202 at once; a thread pool in the same process runs it. Handlers registered
+with ``job_handler`` get a ``JobContext`` for the uploaded input, progress
+reports and a result artifact, plus the submitting ``User`` row, and
+return a JSON-able result. Clients poll ``/api/jobs/<id>`` and download the
+artifact from ``/api/jobs/<id>/artifact``. Uploads and artifacts are files
+in ``JOB_SPOOL_DIR`` (default ``instance/jobs``), which every worker must
+share; neither is held in memory or in the database whole.
+
+Jobs are claimed with a conditional ``UPDATE ... WHERE status = 'queued'``,
+so a job runs once even when several worker processes resume the queue.
+Handlers report progress after every batch, which refreshes the heartbeat.
+The stale sweep deals with running jobs whose heartbeat went quiet for
+``JOB_STALE_SECONDS``: resumable kinds are queued again, others fail. It
+runs after every gunicorn fork (``resume_pending``) and, at most every
+``JOB_SWEEP_SECONDS``, when clients poll their jobs (``sweep_if_due``).
+Progress reports and the final outcome are only written while the run still
+holds its claim (status 'running' and its own ``started_at``), so a swept
+run cannot overwrite what the sweep decided; its next progress report
+raises ``JobLost`` and stops it. ``JOB_WORKERS`` sets the pool size; 0 runs
+jobs inline, after the submitting transaction commits.
+"""
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import update
+
+from database import db
+from models import Job, User
+
+DEFAULT_WORKERS = 2
+DEFAULT_STALE_SECONDS = 300
+DEFAULT_SWEEP_SECONDS = 60
+MAX_CONVERSION_JOB_SIZE = 10000
+
+HANDLERS = {}
+
+
+class JobLost(Exception):
+    """The stale sweep took the job away from this run"""
+
+
+def job_handler(kind, resumable=False):
+    """Register ``handler(context, user, params)`` for jobs of ``kind``.
+
+    A resumable handler must be safe to run again after being interrupted.
+    """
+    def decorator(handler):
+        handler.resumable = resumable
+        HANDLERS[kind] = handler
+        return handler
+    return decorator
+
+
+class JobContext:
+    """What a running handler can see and report"""
+
+    def __init__(self, job_id, claimed_at):
+        self.job_id = job_id
+        self.claimed_at = claimed_at
+        self.artifact = None
+
+    @property
+    def input_path(self):
+        """Path of the uploaded input file"""
+        return db.session.query(Job.input_path).filter_by(id=self.job_id).scalar()
+
+    @property
+    def checkpoint(self):
+        """The checkpoint of the last progress report, for a resumed job"""
+        return db.session.query(Job.checkpoint).filter_by(id=self.job_id).scalar()
+
+    def progress(self, done, total=None, checkpoint=None):
+        """Record progress (and a checkpoint to resume from) and refresh the
+        heartbeat. Written and committed on a connection of its own; on
+        SQLite, report between transactions. Raises JobLost once the run
+        no longer holds its claim."""
+        values = {'progress': {'done': done, 'total': total}, 'heartbeat_at': datetime.utcnow()}
+        if checkpoint is not None:
+            values['checkpoint'] = checkpoint
+        jobs = Job.__table__
+        with db.engine.begin() as connection:
+            reported = connection.execute(update(jobs).where(
+                jobs.c.id == self.job_id, jobs.c.status == 'running',
+                jobs.c.started_at == self.claimed_at).values(**values)).rowcount
+        if not reported:
+            raise JobLost(self.job_id)
+
+    def artifact_file(self, name, mimetype):
+        """Path to write the result file to; attached when the job succeeds"""
+        self.artifact = (name, mimetype, spool_path(self.job_id, 'artifact'))
+        return self.artifact[2]
+
+
+class JobRunner:
+    """Runs jobs of one process in a thread pool created on first use, so a
+    preloaded app does not fork the pool's threads"""
+
+    def __init__(self):
+        self.app = None
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._futures = {}
+        self._last_sweep = None
+
+    def init_app(self, app):
+        from reparenting import DEFAULT_BATCH_SIZE
+        app.config.setdefault('JOB_WORKERS', DEFAULT_WORKERS)
+        app.config.setdefault('JOB_SPOOL_DIR', os.path.join(app.instance_path, 'jobs'))
+        app.config.setdefault('REPARENT_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+        app.config.setdefault('JOB_STALE_SECONDS', DEFAULT_STALE_SECONDS)
+        app.config.setdefault('JOB_SWEEP_SECONDS', DEFAULT_SWEEP_SECONDS)
+        self.app = app
+        app.extensions['jobs'] = self
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.app.config['JOB_WORKERS'],
+                                                    thread_name_prefix='job')
+                self._pid = os.getpid()
+                self._futures = {}
+            return self._executor
+
+    def submit(self, job_id):
+        """Run a committed, queued job"""
+        if not self.app.config['JOB_WORKERS']:
+            self.run(job_id)
+            return
+        self._futures[job_id] = self._pool().submit(self.run, job_id)
+
+    def wait(self, job_id=None, timeout=None):
+        """Wait for one submitted job, or all of them, to finish"""
+        futures = [self._futures.get(job_id)] if job_id else list(self._futures.values())
+        for future in futures:
+            if future is not None:
+                future.exception(timeout)
+
+    def run(self, job_id):
+        with self.app.app_context():
+            now = datetime.utcnow()
+            claimed = db.session.execute(
+                update(Job).where(Job.id == job_id, Job.status == 'queued')
+                .values(status='running', started_at=now, heartbeat_at=now),
+                execution_options={'synchronize_session': False}).rowcount
+            db.session.commit()
+            if not claimed:
+                return
+
+            job = db.session.get(Job, job_id)
+            context = JobContext(job_id, now)
+            try:
+                user = db.session.get(User, job.created_by)
+                result = HANDLERS[job.kind](context, user, job.params or {})
+            except JobLost:
+                db.session.rollback()
+                current_app.logger.warning('Job %s (%s) was taken over by the stale sweep', job_id, job.kind)
+                if context.artifact:
+                    _remove(context.artifact[2])
+                return
+            except Exception as e:
+                db.session.rollback()
+                current_app.logger.exception('Job %s (%s) failed', job_id, job.kind)
+                if context.artifact:
+                    _remove(context.artifact[2])
+                self._finish(context, status='failed', error=f'{type(e).__name__}: {e}')
+                return
+            self._finish(context, status='succeeded', result=result, artifact=context.artifact)
+
+    def _finish(self, context, artifact=None, **values):
+        """Record the outcome, unless the stale sweep took the job away"""
+        if artifact:
+            values.update(artifact_name=artifact[0], artifact_mimetype=artifact[1],
+                          artifact_path=artifact[2], artifact_size=os.path.getsize(artifact[2]))
+        input_path = db.session.query(Job.input_path).filter_by(id=context.job_id).scalar()
+        finished = db.session.execute(
+            update(Job).where(Job.id == context.job_id, Job.status == 'running',
+                              Job.started_at == context.claimed_at)
+            .values(input_path=None, finished_at=datetime.utcnow(), **values),
+            execution_options={'synchronize_session': False}).rowcount
+        db.session.commit()
+        if not finished:
+            current_app.logger.warning('Job %s finished after the stale sweep took it; outcome dropped',
+                                       context.job_id)
+            if artifact:
+                _remove(artifact[2])
+        elif input_path:
+            _remove(input_path)
+
+    def sweep_stale(self):
+        """Requeue resumable running jobs whose heartbeat went quiet and fail
+        the others; returns how many. Each is a conditional UPDATE, so a
+        heartbeat that commits first keeps its job."""
+        now = datetime.utcnow()
+        quiet = [Job.status == 'running',
+                 Job.heartbeat_at < now - timedelta(seconds=self.app.config['JOB_STALE_SECONDS'])]
+        resumable = [kind for kind, handler in HANDLERS.items() if handler.resumable]
+        options = {'synchronize_session': False}
+        swept = db.session.execute(update(Job).where(*quiet, Job.kind.in_(resumable))
+                                   .values(status='queued'), execution_options=options).rowcount
+        swept += db.session.execute(update(Job).where(*quiet, Job.kind.not_in(resumable)).values(
+            status='failed', error='Interrupted before it finished', finished_at=now),
+            execution_options=options).rowcount
+        db.session.commit()
+        return swept
+
+    def _queued(self, before=None):
+        query = Job.query.filter_by(status='queued')
+        if before is not None:
+            query = query.filter(Job.created_at < before)
+        return [job_id for job_id, in query.order_by(Job.created_at).with_entities(Job.id)]
+
+    def resume_pending(self):
+        """Requeue or fail jobs whose process died, then submit the queue"""
+        with self.app.app_context():
+            self.sweep_stale()
+            queued = self._queued()
+        for job_id in queued:
+            self.submit(job_id)
+
+    def sweep_if_due(self):
+        """Run the stale sweep at most every JOB_SWEEP_SECONDS in this
+        process, and submit jobs queued for longer than JOB_STALE_SECONDS
+        (requeued ones, or ones whose process died before running them)"""
+        now = time.monotonic()
+        with self._lock:
+            if self._last_sweep is not None and now - self._last_sweep < self.app.config['JOB_SWEEP_SECONDS']:
+                return
+            self._last_sweep = now
+        self.sweep_stale()
+        waiting = datetime.utcnow() - timedelta(seconds=self.app.config['JOB_STALE_SECONDS'])
+        for job_id in self._queued(before=waiting):
+            self.submit(job_id)
+
+
+runner = JobRunner()
+
+
+def init_app(app):
+    runner.init_app(app)
+
+
+def spool_path(job_id, name):
+    """Path of one of a job's files in the spool directory"""
+    directory = current_app.config['JOB_SPOOL_DIR']
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f'{job_id}.{name}')
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def add_job(kind, user, params=None, upload=None):
+    """Add a queued job for ``user`` to the session without committing, so
+    it commits together with the change that needs it; returns the Job.
+    Submit it to ``runner`` after the commit.
+
+    ``upload`` (a werkzeug FileStorage) is saved to the spool directory.
+    """
+    job = Job(id=str(uuid.uuid4()), kind=kind, params=params, created_by=user.id,
+              organization_id=user.organization_id, progress={'done': 0, 'total': None})
+    if upload is not None:
+        job.input_path = spool_path(job.id, 'input')
+        upload.save(job.input_path)
+    db.session.add(job)
+    return job
+
+
+def enqueue(kind, user, params=None, upload=None):
+    """Queue a job for ``user``, commit it and start it; returns the Job"""
+    job = add_job(kind, user, params, upload)
+    db.session.commit()
+    runner.submit(job.id)
+    return job
+
+
+def purge_jobs(retention_days, now=None):
+    """Delete finished jobs, artifact files included, older than the retention"""
+    cutoff = (now or datetime.utcnow()) - timedelta(days=retention_days)
+    expired = Job.query.filter(Job.status.in_(('succeeded', 'failed')), Job.finished_at < cutoff)
+    paths = [path for row in expired.with_entities(Job.input_path, Job.artifact_path)
+             for path in row if path]
+    deleted = expired.delete(synchronize_session=False)
+    db.session.commit()
+    for path in paths:
+        _remove(path)
+    return deleted
+
+
+@job_handler('export')
+def export_job(context, user, params):
+    """Write an export file of ``params['entity']`` in ``params['format']``,
+    one batch at a time"""
+    from models import get_organization_filter
+    from exporters import EXPORT_FORMATS, export_statement, iter_export
+
+    entity, fmt = params['entity'], params['format']
+    org_filter = get_organization_filter(user)
+    rows = export_statement(entity, org_filter).order_by(None).subquery()
+    total = db.session.execute(db.select(db.func.count()).select_from(rows)).scalar()
+    context.progress(0, total)
+    path = context.artifact_file(f'{entity}_export.{fmt}', EXPORT_FORMATS[fmt])
+    with open(path, 'w', encoding='utf-8', newline='') as artifact:
+        for chunk in iter_export(entity, fmt, org_filter, paged=True,
+                                 progress=lambda done: context.progress(done, total)):
+            artifact.write(chunk)
+    return {'rows': total}
+
+
+@job_handler('import_leads')
+def import_leads_job(context, user, params):
+    """Import the uploaded CSV, reporting progress after every batch"""
+    from importers import import_leads
+
+    with open(context.input_path, encoding='utf-8-sig', newline='') as lines:
+        return import_leads(lines, user, batch_size=params['batchSize'],
+                            progress=lambda report: context.progress(report['total']))
+
+
+@job_handler('convert_leads')
+def convert_leads_job(context, user, params):
+    """Convert ``params['leadIds']`` in transactions of MAX_BATCH_SIZE leads"""
+    from conversion import convert_leads, MAX_BATCH_SIZE
+
+    lead_ids = params['leadIds']
+    converted, skipped = [], []
+    for start in range(0, len(lead_ids), MAX_BATCH_SIZE):
+        result = convert_leads(lead_ids[start:start + MAX_BATCH_SIZE], user, params.get('options'))
+        converted.extend({'leadId': entry['lead_id'],
+                          'accountId': entry['account']['id'],
+                          'contactId': entry['contact']['id'],
+                          'opportunityId': entry['opportunity']['id']}
+                         for entry in result['converted'])
+        skipped.extend({'leadId': s['lead_id'], 'reason': s['reason']} for s in result['skipped'])
+        context.progress(min(start + MAX_BATCH_SIZE, len(lead_ids)), len(lead_ids))
+    return {'converted': converted, 'skipped': skipped}
+
+
+@job_handler('setup_organization', resumable=True)
+def setup_organization_job(context, user, params):
+    """Move the user's existing records into their new organization in
+    committed batches, resuming from the last checkpoint after a restart"""
+    from reparenting import reparent_records
+
+    moved = reparent_records(user.id, params['organizationId'],
+                             batch_size=current_app.config['REPARENT_BATCH_SIZE'],
+                             checkpoint=context.checkpoint, progress=context.progress)
+    return {'moved': moved}
@@ -0,0 +1,159 @@
+"""Server-side search, filtering, sorting and paging for the HTML list pages."""
+from sqlalchemy import func, or_
+from sqlalchemy.orm import joinedload, load_only, with_expression
+
+from models import Lead, Account, Contact, Opportunity
+
+DEFAULT_PER_PAGE = 25
+MAX_PER_PAGE = 100
+# Long text shown in a list cell; one extra character tells the template
+# whether to add an ellipsis
+PREVIEW_LENGTH = 60
+
+
+def _preview(column):
+    return func.substr(column, 1, PREVIEW_LENGTH + 1)
+
+
+# Per-page configuration: which columns the search box matches (case-insensitive
+# prefix, evaluated inside the tenant's index range), which query arg filters on
+# which column, and the whitelist of sortable columns. The first sort key is
+# the default and every sort appends ``id`` as a stable tie-breaker.
+# ``load`` is the page's query profile: only the columns the template shows,
+# previews instead of long text, and eager loads for the relationships it
+# reads, so a page costs the same two queries (count + rows) at any size.
+LIST_SPECS = {
+    'leads': {
+        'model': Lead,
+        # notes prefill the edit dialog, so they are loaded in full
+        'load': (
+            load_only(Lead.id, Lead.company_name, Lead.contact_person, Lead.email, Lead.phone,
+                      Lead.source, Lead.stage, Lead.notes, Lead.is_converted, Lead.created_date),
+        ),
+        'search': (Lead.contact_person, Lead.company_name, Lead.email),
+        'filters': {'stage': Lead.stage},
+        'sorts': {
+            'updated': (Lead.updated_at,),
+            'name': (Lead.contact_person,),
+            'company': (Lead.company_name,),
+            'stage': (Lead.stage,),
+            'created': (Lead.created_date,),
+        },
+    },
+    'accounts': {
+        'model': Account,
+        'load': (
+            load_only(Account.id, Account.company_name, Account.create_date),
+            with_expression(Account.description_preview, _preview(Account.description)),
+        ),
+        'search': (Account.company_name, Account.city),
+        'filters': {},
+        'sorts': {
+            'updated': (Account.updated_at,),
+            'name': (Account.company_name,),
+            'created': (Account.create_date,),
+        },
+    },
+    'contacts': {
+        'model': Contact,
+        'load': (
+            load_only(Contact.id, Contact.first_name, Contact.last_name, Contact.email,
+                      Contact.phone, Contact.title, Contact.create_date),
+            joinedload(Contact.account, innerjoin=True).load_only(Account.id, Account.company_name),
+        ),
+        'search': (Contact.first_name, Contact.last_name, Contact.email),
+        'filters': {},
+        'sorts': {
+            'updated': (Contact.updated_at,),
+            'name': (Contact.last_name, Contact.first_name),
+            'email': (Contact.email,),
+            'created': (Contact.create_date,),
+        },
+    },
+    'opportunities': {
+        'model': Opportunity,
+        'load': (
+            load_only(Opportunity.id, Opportunity.name, Opportunity.sales_stage, Opportunity.forecast,
+                      Opportunity.amount, Opportunity.close_date, Opportunity.created_date),
+            with_expression(Opportunity.requirements_preview, _preview(Opportunity.requirements)),
+            joinedload(Opportunity.account, innerjoin=True).load_only(Account.id, Account.company_name),
+        ),
+        'search': (Opportunity.name,),
+        'filters': {'stage': Opportunity.sales_stage},
+        'sorts': {
+            'updated': (Opportunity.updated_at,),
+            'name': (Opportunity.name,),
+            'stage': (Opportunity.sales_stage,),
+            'amount': (Opportunity.amount,),
+            'close_date': (Opportunity.close_date,),
+            'created': (Opportunity.created_date,),
+        },
+    },
+}
+
+
+def escape_like(term):
+    """Escape LIKE wildcards in user input"""
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def parse_list_args(entity, args):
+    """Normalise list page query args against the entity's whitelist"""
+    spec = LIST_SPECS[entity]
+    default_sort = next(iter(spec['sorts']))
+
+    sort = args.get('sort', default_sort)
+    if sort not in spec['sorts']:
+        sort = default_sort
+    # Recently changed records first unless the user picked a column
+    direction = args.get('dir', 'desc' if sort == 'updated' else 'asc')
+    if direction not in ('asc', 'desc'):
+        direction = 'asc'
+
+    try:
+        page = max(int(args.get('page', 1)), 1)
+    except (TypeError, ValueError):
+        page = 1
+    try:
+        per_page = min(max(int(args.get('per_page', DEFAULT_PER_PAGE)), 1), MAX_PER_PAGE)
+    except (TypeError, ValueError):
+        per_page = DEFAULT_PER_PAGE
+
+    state = {
+        'q': (args.get('q') or '').strip(),
+        'sort': sort,
+        'dir': direction,
+        'page': page,
+        'per_page': per_page,
+    }
+    for name in spec['filters']:
+        state[name] = (args.get(name) or '').strip()
+    return state
+
+
+def apply_list_state(entity, query, state):
+    """Apply search, filters and ordering from ``state`` to ``query``"""
+    spec = LIST_SPECS[entity]
+    model = spec['model']
+
+    if state['q']:
+        pattern = escape_like(state['q']) + '%'
+        query = query.filter(or_(*[col.ilike(pattern, escape='\\') for col in spec['search']]))
+
+    for name, column in spec['filters'].items():
+        if state.get(name):
+            query = query.filter(column == state[name])
+
+    order = []
+    for column in spec['sorts'][state['sort']] + (model.id,):
+        order.append(column.desc() if state['dir'] == 'desc' else column.asc())
+    return query.order_by(*order)
+
+
+def list_page(entity, query, args):
+    """Return ``(pagination, state)`` for one page of an org-scoped list query"""
+    state = parse_list_args(entity, args)
+    query = apply_list_state(entity, query, state).options(*LIST_SPECS[entity]['load'])
+    pagination = query.paginate(page=state['page'], per_page=state['per_page'],
+                                max_per_page=MAX_PER_PAGE, error_out=False)
+    return pagination, state
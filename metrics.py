@@ -0,0 +1,213 @@
+"""Request instrumentation exposed in the Prometheus text format on /metrics.
+
+Every request is observed per endpoint (``main.leads``, ``api.get_leads``,
+...): latency, SQL statements and SQL time (from querystats.py), Jinja render
+time and time spent waiting for a pool connection. Together these show
+whether a slow endpoint spends its time in the database, in templates or
+queued for a worker. The queue time comes from an ``X-Request-Start``
+header, when a proxy in front of gunicorn sets one.
+
+Metrics live in process memory, so each gunicorn worker reports its own
+numbers. /metrics requires ``Authorization: Bearer <METRICS_TOKEN>``. Without
+a token configured it only answers requests from the same host (a local
+scraper or sidecar); anyone else gets 404.
+"""
+import hmac
+import ipaddress
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, abort, before_render_template, g, request, template_rendered
+
+from querystats import request_stats
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self.values = {}
+
+    def inc(self, labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in sorted(self.values.items()):
+            yield self.name, labels, value
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self.values = {}
+
+    def observe(self, labels, value):
+        # [count per bucket..., +Inf count, sum]
+        series = self.values.setdefault(labels, [0] * (len(self.buckets) + 1) + [0.0])
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self):
+        for labels, series in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                yield f'{self.name}_bucket', labels + (('le', str(bound)),), cumulative
+            yield f'{self.name}_sum', labels, series[-1]
+            yield f'{self.name}_count', labels, cumulative
+
+
+class Registry:
+    """Thread-safe set of metrics rendered in the text exposition format"""
+
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def counter(self, name, help_text, label_names=('endpoint',)):
+        metric = Counter(name, help_text, label_names)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, buckets, label_names=('endpoint',)):
+        metric = Histogram(name, help_text, label_names, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self, gauges=()):
+        lines = []
+        with self.lock:
+            for metric in self.metrics:
+                kind = 'histogram' if isinstance(metric, Histogram) else 'counter'
+                lines.append(f'# HELP {metric.name} {metric.help}')
+                lines.append(f'# TYPE {metric.name} {kind}')
+                for name, labels, value in metric.samples():
+                    lines.append(_sample(name, metric.label_names, labels, value))
+        for name, help_text, value in gauges:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _sample(name, label_names, labels, value):
+    pairs = list(zip(label_names, labels[:len(label_names)])) + list(labels[len(label_names):])
+    rendered = ','.join(f'{key}="{_escape(val)}"' for key, val in pairs)
+    return f'{name}{{{rendered}}} {value}' if rendered else f'{name} {value}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
+requests_total = registry.counter(
+    'crm_http_requests_total', 'Requests handled', ('endpoint', 'method', 'status'))
+request_seconds = registry.histogram(
+    'crm_http_request_duration_seconds', 'Time to build the response', LATENCY_BUCKETS)
+queue_seconds = registry.histogram(
+    'crm_http_request_queue_seconds', 'Time between X-Request-Start and the worker picking the request up',
+    LATENCY_BUCKETS)
+sql_statements = registry.histogram(
+    'crm_sql_statements_per_request', 'SQL statements executed per request', STATEMENT_BUCKETS)
+sql_seconds = registry.histogram(
+    'crm_sql_duration_seconds', 'Time per request spent executing SQL', LATENCY_BUCKETS)
+template_seconds = registry.histogram(
+    'crm_template_render_seconds', 'Time per request spent rendering templates', LATENCY_BUCKETS)
+pool_wait_seconds = registry.histogram(
+    'crm_db_pool_checkout_seconds', 'Time per request spent checking connections out of the pool',
+    LATENCY_BUCKETS)
+
+_in_flight = 0
+
+
+def parse_request_start(value, now):
+    """Seconds since ``X-Request-Start`` (``t=<epoch>`` in s, ms or us)"""
+    try:
+        started = float(value.strip().removeprefix('t='))
+    except (AttributeError, ValueError):
+        return None
+    if started > 1e14:
+        started /= 1e6
+    elif started > 1e11:
+        started /= 1e3
+    waited = now - started
+    return waited if waited >= 0 else None
+
+
+def _before_request():
+    global _in_flight
+    g.request_started = time.perf_counter()
+    with registry.lock:
+        _in_flight += 1
+        waited = parse_request_start(request.headers.get('X-Request-Start'), time.time())
+        if waited is not None:
+            queue_seconds.observe((request.endpoint or 'unmatched',), waited)
+
+
+def _after_request(response):
+    global _in_flight
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    stats = request_stats()
+    endpoint = (request.endpoint or 'unmatched',)
+    with registry.lock:
+        _in_flight -= 1
+        requests_total.inc(endpoint + (request.method, str(response.status_code)))
+        request_seconds.observe(endpoint, elapsed)
+        sql_statements.observe(endpoint, stats['sql_statements'])
+        sql_seconds.observe(endpoint, stats['sql_seconds'])
+        template_seconds.observe(endpoint, g.get('template_seconds', 0.0))
+        pool_wait_seconds.observe(endpoint, stats['pool_wait_seconds'])
+    return response
+
+
+def _template_started(sender, template, context, **extra):
+    g.template_started = time.perf_counter()
+
+
+def _template_rendered(sender, template, context, **extra):
+    started = g.pop('template_started', None)
+    if started is not None:
+        g.template_seconds = g.get('template_seconds', 0.0) + time.perf_counter() - started
+
+
+def _is_local(remote_addr):
+    try:
+        return ipaddress.ip_address(remote_addr or '').is_loopback
+    except ValueError:
+        return False
+
+
+def init_app(app, engine):
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_rendered, app)
+
+    def metrics_view():
+        token = app.config.get('METRICS_TOKEN')
+        if not token:
+            if not _is_local(request.remote_addr):
+                abort(404)
+        elif not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            abort(401)
+        gauges = [('crm_http_requests_in_flight', 'Requests being handled by this process',
+                   _in_flight)]
+        pool = engine.pool
+        if hasattr(pool, 'checkedout'):
+            gauges.append(('crm_db_pool_checked_out', 'Connections checked out of the pool',
+                           pool.checkedout()))
+        return Response(registry.render(gauges), mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
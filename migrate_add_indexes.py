@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Migration script to create the indexes declared in models.py on an existing database
+
+db.create_all() only creates indexes together with new tables, so databases
+created before an index was added to a model need this script. Indexes whose
+definition changed under the same name (such as the organization indexes,
+which became partial) are dropped and created again.
+"""
+import re
+import sys
+import os
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app
+from sqlalchemy import text
+from sqlalchemy.schema import CreateIndex, DropIndex
+
+from models import db, Lead, Account, Contact, Opportunity
+
+def existing_indexes(table_name):
+    """Index name -> CREATE INDEX statement for the indexes on a table,
+    including expression indexes (which the SQLAlchemy inspector skips)"""
+    if db.engine.dialect.name == 'postgresql':
+        sql = "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = :table"
+    else:
+        sql = "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = :table"
+    with db.engine.connect() as conn:
+        return dict(conn.execute(text(sql), {'table': table_name}).all())
+
+def normalized(definition):
+    """An index statement without the schema, casts, quoting and spacing
+    that PostgreSQL adds to pg_indexes.indexdef"""
+    sql = re.sub(r'\bif not exists\b|\busing btree\b|\bpublic\.', '', (definition or '').lower())
+    sql = re.sub(r'::[a-z ]+', '', sql)
+    return re.sub(r'[\s"()]', '', sql)
+
+def migrate_add_indexes():
+    """Backfill NULL timestamps and create any missing model indexes"""
+    with app.app_context():
+        try:
+            # Keyset pagination orders by updated_at, which must not be NULL
+            for model in (Lead, Account, Contact, Opportunity):
+                updated = model.query.filter(model.updated_at.is_(None)).update(
+                    {'updated_at': db.func.current_timestamp()}, synchronize_session=False
+                )
+                if updated:
+                    print(f"Backfilled updated_at on {updated} {model.__tablename__} rows")
+            db.session.commit()
+
+            inspector = db.inspect(db.engine)
+            for table in db.metadata.sorted_tables:
+                if not inspector.has_table(table.name):
+                    continue
+                existing = existing_indexes(table.name)
+                for index in table.indexes:
+                    wanted = str(CreateIndex(index).compile(dialect=db.engine.dialect))
+                    if index.name in existing:
+                        if normalized(existing[index.name]) == normalized(wanted):
+                            print(f"ℹ️  Index {index.name} already exists")
+                            continue
+                        print(f"Recreating index {index.name} on {table.name}, its definition changed...")
+                        with db.engine.begin() as conn:
+                            conn.execute(DropIndex(index))
+                            conn.execute(CreateIndex(index))
+                        print(f"✅ Recreated index {index.name}")
+                        continue
+                    print(f"Creating index {index.name} on {table.name}...")
+                    with db.engine.begin() as conn:
+                        conn.execute(CreateIndex(index, if_not_exists=True))
+                    print(f"✅ Created index {index.name}")
+
+        except Exception as e:
+            print(f"❌ Error creating indexes: {str(e)}")
+            db.session.rollback()
+            return False
+
+        return True
+
+if __name__ == "__main__":
+    success = migrate_add_indexes()
+    sys.exit(0 if success else 1)
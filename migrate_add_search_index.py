@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Migration script to create the full-text search indexes on an existing database
+
+New databases get them from db.create_all(). On PostgreSQL the GIN indexes are
+built CONCURRENTLY so writes are not blocked; on SQLite the FTS5 tables and
+their triggers are dropped, created again and filled from the existing rows.
+"""
+import sys
+import os
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app
+from models import db
+from search import SEARCH_SPECS, create_search_index
+
+def migrate_add_search_index():
+    """Create (or rebuild) the search index of every searchable table"""
+    with app.app_context():
+        try:
+            is_postgres = db.engine.dialect.name == 'postgresql'
+            connection = db.engine.connect()
+            if is_postgres:
+                # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+                connection = connection.execution_options(isolation_level='AUTOCOMMIT')
+            with connection:
+                for entity in SEARCH_SPECS:
+                    print(f"Creating search index for {entity}...")
+                    create_search_index(connection, entity, rebuild=True, concurrently=is_postgres)
+                    print(f"✅ Search index for {entity} ready")
+                if not is_postgres:
+                    connection.commit()
+
+        except Exception as e:
+            print(f"❌ Error creating search indexes: {str(e)}")
+            return False
+
+        return True
+
+if __name__ == "__main__":
+    success = migrate_add_search_index()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Migration script to add opportunities.forecast_probability and fill it in
+
+forecast is free text ('40%', '40', 'High'); forecast_probability holds the
+same probability as a number so the pipeline report can weight amounts in
+SQL. Existing rows are parsed in primary key batches, each committed on its
+own, so the table is never locked for long and an interrupted run picks up
+where it stopped:
+
+    python migrate_forecast_probability.py
+    python migrate_forecast_probability.py --batch-size 500
+"""
+import sys
+import os
+import argparse
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app
+from sqlalchemy import bindparam, select, text, update
+
+from models import db, Opportunity, parse_forecast
+
+DEFAULT_BATCH_SIZE = 1000
+
+def add_column():
+    """Add the column if this database predates it"""
+    columns = [col['name'] for col in db.inspect(db.engine).get_columns('opportunities')]
+    if 'forecast_probability' in columns:
+        print("ℹ️  forecast_probability column already exists")
+        return
+    print("Adding forecast_probability column to opportunities table...")
+    db.session.execute(text('ALTER TABLE opportunities ADD COLUMN forecast_probability NUMERIC(5, 2)'))
+    db.session.commit()
+    print("✅ Added forecast_probability column")
+
+def backfill(batch_size=DEFAULT_BATCH_SIZE):
+    """Parse forecast into forecast_probability for rows that have none yet"""
+    table = Opportunity.__table__
+    # Keep updated_at: the API output does not change, so sync clients and
+    # list ETags should not see every opportunity as modified
+    statement = (update(table).where(table.c.id == bindparam('row_id'))
+                 .values(forecast_probability=bindparam('probability'),
+                         updated_at=table.c.updated_at))
+    last_id, scanned, filled = '', 0, 0
+    while True:
+        rows = db.session.execute(
+            select(table.c.id, table.c.forecast)
+            .where(table.c.id > last_id, table.c.forecast_probability.is_(None),
+                   table.c.forecast.is_not(None))
+            .order_by(table.c.id).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        scanned += len(rows)
+        values = [{'row_id': row.id, 'probability': parse_forecast(row.forecast)} for row in rows]
+        values = [value for value in values if value['probability'] is not None]
+        if values:
+            db.session.execute(statement, values)
+        db.session.commit()
+        filled += len(values)
+        print(f"   {scanned} rows scanned, {filled} filled")
+    print(f"✅ Filled forecast_probability on {filled} rows "
+          f"({scanned - filled} with free-text forecasts left empty)")
+
+def migrate_forecast_probability(batch_size=DEFAULT_BATCH_SIZE):
+    with app.app_context():
+        try:
+            add_column()
+            backfill(batch_size)
+        except Exception as e:
+            print(f"❌ Error migrating forecast: {str(e)}")
+            db.session.rollback()
+            return False
+
+        return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Add and backfill opportunities.forecast_probability')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    success = migrate_forecast_probability(args.batch_size)
+    sys.exit(0 if success else 1)
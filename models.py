@@ -1,13 +1,44 @@
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, date
+from decimal import Decimal, InvalidOperation
 import uuid
 
 from database import db
 
+def org_index(name, *columns):
+    """Partial index on organization_id + columns for org-scoped queries.
+
+    Records of users without an organization are reached through the
+    created_by indexes instead, so they are left out of the org indexes.
+    Any ``organization_id = ?`` predicate implies the index condition on
+    both PostgreSQL and SQLite.
+    """
+    condition = db.text('organization_id IS NOT NULL')
+    return db.Index(name, 'organization_id', *columns,
+                    postgresql_where=condition, sqlite_where=condition)
+
+def parse_forecast(value):
+    """Win probability in percent from a forecast such as '40%' or '40'.
+
+    Returns a Decimal between 0 and 100, or None for free text such as 'High'.
+    """
+    if value is None:
+        return None
+    try:
+        probability = Decimal(str(value).strip().rstrip('%').strip())
+    except InvalidOperation:
+        return None
+    if not probability.is_finite() or not 0 <= probability <= 100:
+        return None
+    return probability.quantize(Decimal('0.01'))
+
 class User(UserMixin, db.Model):
     """User model for authentication"""
     __tablename__ = 'users'
+    __table_args__ = (
+        org_index('ix_users_org'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -57,6 +88,18 @@ def create_organization_for_user(user):
 class Lead(db.Model):
     """Lead model - prospects that haven't been qualified yet"""
     __tablename__ = 'leads'
+    __table_args__ = (
+        # Keyset pagination over the org/user scoped lists: (updated_at, id)
+        org_index('ix_leads_org_converted_updated', 'is_converted', 'updated_at', 'id'),
+        org_index('ix_leads_org_updated', 'updated_at', 'id'),
+        db.Index('ix_leads_owner_converted_updated', 'created_by', 'is_converted', 'updated_at', 'id'),
+        db.Index('ix_leads_owner_updated', 'created_by', 'updated_at', 'id'),
+        # Rows in primary key order (exports, re-parenting)
+        org_index('ix_leads_org_id', 'id'),
+        db.Index('ix_leads_owner_id', 'created_by', 'id'),
+        # Stage filter on the leads page
+        org_index('ix_leads_org_stage_updated', 'stage', 'updated_at'),
+    )
     
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     company_name = db.Column(db.String(200), nullable=False)
@@ -92,6 +135,17 @@ class Lead(db.Model):
 class Account(db.Model):
     """Account model - qualified companies we do business with"""
     __tablename__ = 'accounts'
+    __table_args__ = (
+        org_index('ix_accounts_org_updated', 'updated_at', 'id'),
+        db.Index('ix_accounts_owner_updated', 'created_by', 'updated_at', 'id'),
+        # Rows in primary key order (exports, re-parenting)
+        org_index('ix_accounts_org_id', 'id'),
+        db.Index('ix_accounts_owner_id', 'created_by', 'id'),
+        org_index('ix_accounts_org_name', 'company_name'),
+        # Case-insensitive prefix lookups (typeahead)
+        org_index('ix_accounts_org_name_lower', db.text('lower(company_name)'), 'id'),
+        db.Index('ix_accounts_owner_name_lower', 'created_by', db.text('lower(company_name)'), 'id'),
+    )
     
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     company_name = db.Column(db.String(200), nullable=False)
@@ -109,6 +163,9 @@ class Account(db.Model):
     organization_id = db.Column(db.String(36), nullable=True)  # Shared organization
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # SQL-side truncated description, loaded only by the list page (listing.py)
+    description_preview = db.query_expression()
+    
     # Relationships
     user = db.relationship('User', backref='accounts')
     contacts = db.relationship('Contact', backref='account', lazy=True)
@@ -133,6 +190,21 @@ class Account(db.Model):
 class Contact(db.Model):
     """Contact model - individual people at accounts"""
     __tablename__ = 'contacts'
+    __table_args__ = (
+        org_index('ix_contacts_org_updated', 'updated_at', 'id'),
+        db.Index('ix_contacts_owner_updated', 'created_by', 'updated_at', 'id'),
+        # Rows in primary key order (exports, re-parenting)
+        org_index('ix_contacts_org_id', 'id'),
+        db.Index('ix_contacts_owner_id', 'created_by', 'id'),
+        org_index('ix_contacts_org_name', 'last_name', 'first_name'),
+        # Case-insensitive prefix lookups (typeahead)
+        org_index('ix_contacts_org_last_lower', db.text('lower(last_name)'), 'id'),
+        org_index('ix_contacts_org_first_lower', db.text('lower(first_name)'), 'id'),
+        db.Index('ix_contacts_owner_last_lower', 'created_by', db.text('lower(last_name)'), 'id'),
+        db.Index('ix_contacts_owner_first_lower', 'created_by', db.text('lower(first_name)'), 'id'),
+        # Contacts of an account (edit account page)
+        db.Index('ix_contacts_account', 'account_id'),
+    )
     
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     first_name = db.Column(db.String(100), nullable=False)
@@ -171,11 +243,29 @@ class Contact(db.Model):
 class Opportunity(db.Model):
     """Opportunity model - potential sales deals"""
     __tablename__ = 'opportunities'
+    __table_args__ = (
+        org_index('ix_opportunities_org_updated', 'updated_at', 'id'),
+        db.Index('ix_opportunities_owner_updated', 'created_by', 'updated_at', 'id'),
+        # Rows in primary key order (exports, re-parenting)
+        org_index('ix_opportunities_org_id', 'id'),
+        db.Index('ix_opportunities_owner_id', 'created_by', 'id'),
+        # Stage filter and close date sort on the opportunities page
+        org_index('ix_opportunities_org_stage_updated', 'sales_stage', 'updated_at'),
+        org_index('ix_opportunities_org_close', 'close_date'),
+        db.Index('ix_opportunities_company', 'company_id'),
+        db.Index('ix_opportunities_contact', 'contact_id'),
+    )
     
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     name = db.Column(db.String(200), nullable=False)
     sales_stage = db.Column(db.String(50), default='Prospecting')
     forecast = db.Column(db.String(10), default='0%')
+    # forecast as a number (percent); NULL when the forecast is free text.
+    # Inserts (Core ones included) derive it from forecast, and
+    # _parse_forecast below keeps it in step on updates
+    forecast_probability = db.Column(db.Numeric(5, 2), nullable=True,
+                                     default=lambda context: parse_forecast(
+                                         context.get_current_parameters().get('forecast')))
     amount = db.Column(db.Numeric(15, 2), nullable=True)  # Expected revenue amount
     company_id = db.Column(db.String(36), db.ForeignKey('accounts.id'), nullable=False)
     contact_id = db.Column(db.String(36), db.ForeignKey('contacts.id'), nullable=False)
@@ -188,9 +278,17 @@ class Opportunity(db.Model):
     organization_id = db.Column(db.String(36), nullable=True)  # Shared organization
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # SQL-side truncated requirements, loaded only by the list page (listing.py)
+    requirements_preview = db.query_expression()
+    
     # Relationships
     user = db.relationship('User', backref='opportunities')
     
+    @db.validates('forecast')
+    def _parse_forecast(self, key, value):
+        self.forecast_probability = parse_forecast(value)
+        return value
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -206,3 +304,156 @@ class Opportunity(db.Model):
             'requirements': self.requirements,
             'createdDate': self.created_date.isoformat() if self.created_date else None
         }
+
+class RecordCounter(db.Model):
+    """Per-scope record counts for the dashboard, maintained by counters.py.
+
+    A scope is either an organization ('org:<organization_id>') or a user
+    without one ('user:<id>'), matching get_organization_filter().
+    """
+    __tablename__ = 'record_counters'
+    
+    scope = db.Column(db.String(64), primary_key=True)
+    leads = db.Column(db.Integer, nullable=False, default=0)  # Unconverted leads only
+    accounts = db.Column(db.Integer, nullable=False, default=0)
+    contacts = db.Column(db.Integer, nullable=False, default=0)
+    opportunities = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'leads': self.leads,
+            'accounts': self.accounts,
+            'contacts': self.contacts,
+            'opportunities': self.opportunities
+        }
+
+class Tombstone(db.Model):
+    """A record that left a scope, written by sync.py for ?since= clients.
+
+    Deletes record the record's last owner columns; moves to another
+    organization or owner record the ones it had before the move.
+    """
+    __tablename__ = 'tombstones'
+    __table_args__ = (
+        org_index('ix_tombstones_org_entity_deleted', 'entity', 'deleted_at', 'id'),
+        db.Index('ix_tombstones_owner_entity_deleted', 'created_by', 'entity', 'deleted_at', 'id'),
+        db.Index('ix_tombstones_deleted', 'deleted_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(20), nullable=False)  # 'leads', 'accounts', ...
+    record_id = db.Column(db.String(36), nullable=False)
+    organization_id = db.Column(db.String(36), nullable=True)
+    created_by = db.Column(db.Integer, nullable=True)
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class StageChange(db.Model):
+    """One stage transition of a lead or opportunity, written by stage_history.py.
+
+    Append-only. A record's first row has no from_stage (it was created in
+    to_stage); a converted lead's last row goes to 'Converted'. The owner
+    columns are the record's at the time of the change.
+    """
+    __tablename__ = 'stage_changes'
+    __table_args__ = (
+        org_index('ix_stage_changes_org_entity_changed', 'entity', 'changed_at'),
+        db.Index('ix_stage_changes_owner_entity_changed', 'created_by', 'entity', 'changed_at'),
+        # Each record's history in order within a scope (funnel, time in stage)
+        org_index('ix_stage_changes_org_entity_record', 'entity', 'record_id', 'changed_at', 'id'),
+        db.Index('ix_stage_changes_owner_entity_record', 'created_by', 'entity', 'record_id', 'changed_at', 'id'),
+        # Records without history (stage_history.seed_missing)
+        db.Index('ix_stage_changes_record', 'entity', 'record_id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(20), nullable=False)  # 'leads' or 'opportunities'
+    record_id = db.Column(db.String(36), nullable=False)
+    from_stage = db.Column(db.String(50), nullable=True)
+    to_stage = db.Column(db.String(50), nullable=False)
+    organization_id = db.Column(db.String(36), nullable=True)
+    created_by = db.Column(db.Integer, nullable=True)
+    changed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class PipelineSnapshot(db.Model):
+    """Open pipeline of one scope on one day, written by reports.snapshot_pipeline.
+
+    One row per scope, sales stage and close month (YYYY-MM, NULL without a
+    close date). The scope is 'org:<organization_id>', or 'user:<id>' for
+    records of users without an organization, as in record_counters.
+    """
+    __tablename__ = 'pipeline_snapshots'
+    __table_args__ = (
+        db.Index('ix_pipeline_snapshots_scope_date', 'scope', 'snapshot_date', 'sales_stage'),
+        db.Index('ix_pipeline_snapshots_date', 'snapshot_date'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    snapshot_date = db.Column(db.Date, nullable=False)
+    scope = db.Column(db.String(64), nullable=False)
+    sales_stage = db.Column(db.String(50), nullable=True)
+    close_month = db.Column(db.String(7), nullable=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    amount = db.Column(db.Numeric(17, 2), nullable=False, default=0)
+    weighted_amount = db.Column(db.Numeric(17, 2), nullable=False, default=0)
+
+class SchemaVersion(db.Model):
+    """The model schema this database was last fully checked against.
+
+    One row, written by schema_version.stamp at the end of a full
+    app.init_database(); while it matches the models, start-up reads only
+    this row.
+    """
+    __tablename__ = 'schema_version'
+    
+    id = db.Column(db.Integer, primary_key=True)  # Always 1
+    version = db.Column(db.String(64), nullable=False)
+    stamped_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class Job(db.Model):
+    """A background job run by jobs.py: its input, progress and result.
+
+    Uploaded input and the result artifact (e.g. an export file) are files
+    in the job spool directory; the row keeps their paths.
+    """
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        db.Index('ix_jobs_owner_created', 'created_by', 'created_at'),
+        db.Index('ix_jobs_status_heartbeat', 'status', 'heartbeat_at'),
+    )
+    
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    kind = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, succeeded, failed
+    params = db.Column(db.JSON, nullable=True)
+    input_path = db.Column(db.String(500), nullable=True)  # Removed when the job finishes
+    progress = db.Column(db.JSON, nullable=True)  # {'done', 'total'}
+    checkpoint = db.Column(db.JSON, nullable=True)  # Where a resumable handler stopped
+    result = db.Column(db.JSON, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    artifact_name = db.Column(db.String(200), nullable=True)
+    artifact_mimetype = db.Column(db.String(100), nullable=True)
+    artifact_path = db.Column(db.String(500), nullable=True)
+    artifact_size = db.Column(db.BigInteger, nullable=True)
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    organization_id = db.Column(db.String(36), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)  # Last claim or progress report
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': self.progress,
+            'result': self.result,
+            'error': self.error,
+            'artifact': {'name': self.artifact_name, 'mimetype': self.artifact_mimetype,
+                         'size': self.artifact_size}
+                        if self.artifact_name else None,
+            'createdAt': self.created_at.isoformat() if self.created_at else None,
+            'startedAt': self.started_at.isoformat() if self.started_at else None,
+            'finishedAt': self.finished_at.isoformat() if self.finished_at else None
+        }
@@ -0,0 +1,83 @@
+"""Keyset (cursor) pagination helpers for the list endpoints.
+
+Pages are ordered by ``(updated_at, id)`` and each page resumes strictly after
+the last row of the previous one, so fetching page N uses the same index range
+scan as page 1 instead of an ever-growing OFFSET. ``updated_at`` is assumed to be
+non-null; migrate_add_indexes.py backfills any legacy NULLs.
+"""
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+
+class InvalidCursor(ValueError):
+    """Raised when a client sends a cursor we did not issue"""
+
+
+def encode_cursor(updated_at, record_id):
+    """Encode the sort key of the last row on a page as an opaque token"""
+    payload = json.dumps([updated_at.isoformat(), record_id])
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode a token produced by encode_cursor back into (updated_at, id)"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        updated_at, record_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        updated_at = datetime.fromisoformat(updated_at)
+        if not isinstance(record_id, str):
+            raise ValueError('cursor id must be a string')
+        return updated_at, record_id
+    except (ValueError, TypeError, UnicodeError) as e:
+        raise InvalidCursor(f'Invalid cursor: {cursor}') from e
+
+
+def parse_page_args(args):
+    """Read ``limit`` and ``cursor`` from request args.
+
+    Returns ``(limit, cursor)`` where cursor is already decoded (or None).
+    Raises InvalidCursor or ValueError for malformed input.
+    """
+    limit = args.get('limit', DEFAULT_PAGE_SIZE)
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise ValueError('limit must be an integer')
+    if limit < 1:
+        raise ValueError('limit must be at least 1')
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    cursor = args.get('cursor')
+    return limit, decode_cursor(cursor) if cursor else None
+
+
+def keyset_filter(model, cursor):
+    """Return the WHERE clause selecting rows strictly after ``cursor``"""
+    updated_at, record_id = cursor
+    return or_(
+        model.updated_at > updated_at,
+        and_(model.updated_at == updated_at, model.id > record_id)
+    )
+
+
+def keyset_page(query, model, limit, cursor=None):
+    """Fetch one page of ``query`` ordered by (updated_at, id).
+
+    Returns ``(rows, next_cursor)``; next_cursor is None on the last page.
+    """
+    if cursor is not None:
+        query = query.filter(keyset_filter(model, cursor))
+    rows = query.order_by(model.updated_at, model.id).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last.updated_at, last.id)
+    return rows, next_cursor
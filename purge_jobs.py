@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Delete finished background jobs, and their artifacts, past the retention period
+
+    python purge_jobs.py              # JOB_RETENTION_DAYS (default 7)
+    python purge_jobs.py --days 1
+"""
+import sys
+import os
+import argparse
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app
+from models import db
+
+def purge(days):
+    """Delete jobs that finished more than ``days`` ago"""
+    from jobs import purge_jobs
+
+    try:
+        deleted = purge_jobs(days)
+        print(f"✅ Deleted {deleted} jobs finished more than {days} days ago")
+    except Exception as e:
+        print(f"❌ Error purging jobs: {str(e)}")
+        db.session.rollback()
+        return False
+
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Delete finished background jobs')
+    parser.add_argument('--days', type=int, help='retention in days (default JOB_RETENTION_DAYS)')
+    args = parser.parse_args()
+
+    with app.app_context():
+        success = purge(args.days or app.config['JOB_RETENTION_DAYS'])
+    sys.exit(0 if success else 1)
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Delete sync tombstones older than the retention period
+
+Clients holding a ?since= token older than the retention are told to resync
+from scratch, so tombstones past it are never read again:
+
+    python purge_tombstones.py              # SYNC_TOMBSTONE_DAYS (default 30)
+    python purge_tombstones.py --days 7
+"""
+import sys
+import os
+import argparse
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app
+from models import db
+
+def purge(days):
+    """Delete tombstones older than ``days``"""
+    from sync import purge_tombstones
+
+    try:
+        deleted = purge_tombstones(days)
+        print(f"✅ Deleted {deleted} tombstones older than {days} days")
+    except Exception as e:
+        print(f"❌ Error purging tombstones: {str(e)}")
+        db.session.rollback()
+        return False
+
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Delete expired sync tombstones')
+    parser.add_argument('--days', type=int, help='retention in days (default SYNC_TOMBSTONE_DAYS)')
+    args = parser.parse_args()
+
+    with app.app_context():
+        success = purge(args.days or app.config['SYNC_TOMBSTONE_DAYS'])
+    sys.exit(0 if success else 1)
@@ -0,0 +1,193 @@
+"""Per-request database statistics.
+
+While an application context is active, every statement sent to the database
+adds to a count and a total execution time on ``flask.g``, and every pool
+checkout adds the time spent waiting for a connection, so each request starts
+from zero. metrics.py turns these into per-endpoint histograms. With
+``SQL_STATS_HEADER`` enabled, responses also report the statement count in an
+``X-SQL-Statements`` header; benchmark_http.py reads it to compute SQL
+statements per request. Streamed responses run their remaining queries after
+the header is sent, so only the statements issued before streaming are counted.
+
+With ``SQL_DEBUG`` enabled (development and tests), each statement is also
+logged with its normalized shape and the template or Python line that issued
+it. After the request, shapes repeated ``SQL_REPEAT_THRESHOLD`` times or more
+are reported as likely N+1 queries, with the lazy-loaded relationship that
+caused them. Views declare their maximum statement count with
+``@query_budget(n)``; going over it is logged, and raises
+``QueryBudgetExceeded`` when ``TESTING`` is set, so the test suite enforces
+every declared budget.
+"""
+import os
+import re
+import sys
+import time
+from collections import Counter
+
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+HEADER = 'X-SQL-Statements'
+DEFAULT_REPEAT_THRESHOLD = 3
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+_timed_pool_classes = {}
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LISTS = re.compile(r'\((?:\s*(?:\?|%\(\w+\)s|%s|:\w+)\s*,)+\s*(?:\?|%\(\w+\)s|%s|:\w+)\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A view issued more SQL statements than its declared budget"""
+
+
+def query_budget(limit):
+    """Declare the most SQL statements a view may issue per request"""
+    def decorator(view):
+        # login_required copies the attribute onto its wrapper (functools.wraps)
+        view.query_budget = limit
+        return view
+    return decorator
+
+
+def normalize(statement):
+    """Statement shape: literals and placeholder lists collapsed, one line"""
+    shape = _LITERALS.sub('?', statement)
+    shape = _PLACEHOLDER_LISTS.sub('(...)', shape)
+    return _WHITESPACE.sub(' ', shape).strip()
+
+
+def _origin():
+    """The template line or project source line that issued the statement"""
+    frame = sys._getframe(2)
+    while frame is not None:
+        template = frame.f_globals.get('__jinja_template__')
+        if template is not None and template.filename:
+            lineno = template.get_corresponding_lineno(frame.f_lineno)
+            return f'{os.path.relpath(template.filename, ROOT)}:{lineno}'
+        filename = frame.f_code.co_filename
+        if (filename.startswith(ROOT) and filename != __file__
+                and 'site-packages' not in filename):
+            return f'{os.path.relpath(filename, ROOT)}:{frame.f_lineno}'
+        frame = frame.f_back
+    return None
+
+
+def _debugging():
+    return has_app_context() and current_app.config.get('SQL_DEBUG')
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _tag_lazy_load(orm_execute_state):
+    if orm_execute_state.is_relationship_load and _debugging():
+        path = orm_execute_state.loader_strategy_path
+        g.sql_pending_lazy_load = str(path[-1]) if len(path) else 'relationship'
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context():
+        g.sql_statements = g.get('sql_statements', 0) + 1
+        if context is not None:
+            context._stats_started = time.perf_counter()
+        if current_app.config.get('SQL_DEBUG'):
+            g.setdefault('sql_log', []).append(
+                (normalize(statement), _origin(), g.pop('sql_pending_lazy_load', None)))
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_stats_started', None)
+    if started is not None and has_app_context():
+        g.sql_seconds = g.get('sql_seconds', 0.0) + time.perf_counter() - started
+
+
+def _timed_pool_class(base):
+    """Subclass of a pool class that times connection checkouts"""
+    if base not in _timed_pool_classes:
+        class TimedPool(base):
+            def _do_get(self):
+                started = time.perf_counter()
+                try:
+                    return super()._do_get()
+                finally:
+                    if has_app_context():
+                        g.pool_wait_seconds = (g.get('pool_wait_seconds', 0.0)
+                                               + time.perf_counter() - started)
+
+        TimedPool.__name__ = TimedPool.__qualname__ = f'Timed{base.__name__}'
+        _timed_pool_classes[base] = TimedPool
+    return _timed_pool_classes[base]
+
+
+def instrument_pool(engine):
+    """Time checkouts from ``engine``'s pool; survives ``Pool.recreate()``,
+    which builds the replacement from ``self.__class__``"""
+    pool = engine.pool
+    if type(pool) not in _timed_pool_classes.values():
+        pool.__class__ = _timed_pool_class(type(pool))
+
+
+def statement_count():
+    """Statements executed so far in the current application context"""
+    return g.get('sql_statements', 0)
+
+
+def request_stats():
+    """Statement count, SQL seconds and pool wait seconds so far"""
+    return {
+        'sql_statements': g.get('sql_statements', 0),
+        'sql_seconds': g.get('sql_seconds', 0.0),
+        'pool_wait_seconds': g.get('pool_wait_seconds', 0.0),
+    }
+
+
+def repeated_statements(log, threshold):
+    """Shapes issued ``threshold`` times or more: likely N+1 queries"""
+    counts = Counter(shape for shape, _, _ in log)
+    report = []
+    for shape, count in counts.most_common():
+        if count < threshold:
+            break
+        entries = [(origin, lazy) for s, origin, lazy in log if s == shape]
+        report.append({
+            'shape': shape,
+            'count': count,
+            'lazy_load': next((lazy for _, lazy in entries if lazy), None),
+            'origins': sorted({origin for origin, _ in entries if origin}),
+        })
+    return report
+
+
+def _check_request(app):
+    endpoint = request.endpoint or 'unmatched'
+    log = g.get('sql_log', [])
+    threshold = app.config.get('SQL_REPEAT_THRESHOLD', DEFAULT_REPEAT_THRESHOLD)
+    for entry in repeated_statements(log, threshold):
+        cause = f" (lazy load of {entry['lazy_load']})" if entry['lazy_load'] else ''
+        app.logger.warning(
+            f"N+1 suspect on {endpoint}: {entry['count']} x {entry['shape'][:200]}{cause} "
+            f"from {', '.join(entry['origins']) or 'unknown'}"
+        )
+
+    view = app.view_functions.get(request.endpoint)
+    budget = getattr(view, 'query_budget', None)
+    if budget is not None and len(log) > budget:
+        message = (f'{endpoint} issued {len(log)} SQL statements, budget is {budget}:\n'
+                   + '\n'.join(f'  {origin or "?"}: {shape[:200]}' for shape, origin, _ in log))
+        if app.testing:
+            raise QueryBudgetExceeded(message)
+        app.logger.warning(message)
+
+
+def init_app(app):
+    @app.after_request
+    def add_statement_header(response):
+        if app.config.get('SQL_DEBUG'):
+            _check_request(app)
+        if app.config.get('SQL_STATS_HEADER'):
+            response.headers[HEADER] = str(statement_count())
+        return response
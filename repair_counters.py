@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Recompute the dashboard record counters from scratch
+
+The counters are kept up to date by counters.py on every ORM write. Run this
+after bulk SQL changes made outside the application, or to verify drift:
+
+    python repair_counters.py            # rebuild every counter row
+    python repair_counters.py --check    # only report scopes that drifted
+"""
+import sys
+import os
+import argparse
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app
+from models import db, RecordCounter
+
+def check_counters():
+    """Compare every stored counter row with a fresh count"""
+    from counters import count_scope
+
+    drifted = 0
+    for counter in RecordCounter.query.order_by(RecordCounter.scope):
+        expected = count_scope(counter.scope)
+        if expected != counter.to_dict():
+            drifted += 1
+            print(f"❌ {counter.scope}: stored {counter.to_dict()}, actual {expected}")
+    print(f"{drifted} drifted counter rows")
+    return drifted == 0
+
+def repair_counters():
+    """Rebuild all counter rows"""
+    from counters import recount_all
+
+    try:
+        print("Recomputing record counters...")
+        scopes = recount_all()
+        print(f"✅ Rebuilt counters for {scopes} scopes")
+    except Exception as e:
+        print(f"❌ Error rebuilding counters: {str(e)}")
+        db.session.rollback()
+        return False
+
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Rebuild the dashboard record counters')
+    parser.add_argument('--check', action='store_true', help='report drift without rewriting')
+    args = parser.parse_args()
+
+    with app.app_context():
+        success = check_counters() if args.check else repair_counters()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,123 @@
+"""Move a user's records into their new organization, one chunk at a time.
+
+``setup_organization`` used to move every lead, account, contact and
+opportunity of the user with four unbounded UPDATEs in one transaction,
+which held row locks for as long as the biggest book of business took.
+``reparent_records`` walks each table in batches instead, in primary key
+order along the owner index ``(created_by, id)``. Each batch is its own
+short transaction and does four things:
+
+- tombstones the rows that leave a previous organization (sync.py)
+- moves the rows, which bumps ``updated_at`` so delta sync clients of the
+  new organization receive them
+- moves the rows' stage history (stage_history.py)
+- adjusts the dashboard counters of both organizations (counters.py)
+
+After every batch, ``progress`` gets the running totals and a checkpoint
+holding the last id moved. Passing that checkpoint back resumes after the
+last committed batch. A run that starts over without one finds the same
+rows, because moved rows no longer match.
+"""
+from collections import Counter
+
+from sqlalchemy import func, or_, select, update
+
+from database import db
+from models import Lead, Account, Contact, Opportunity, StageChange
+
+REPARENTED_MODELS = (Lead, Account, Contact, Opportunity)
+DEFAULT_BATCH_SIZE = 500
+
+
+def _movable(model, user_id, organization_id):
+    return [model.created_by == user_id,
+            or_(model.organization_id.is_(None), model.organization_id != organization_id)]
+
+
+def count_movable(user_id, organization_id):
+    """Records of the user not yet in ``organization_id``"""
+    return sum(db.session.execute(
+        select(func.count()).where(*_movable(model, user_id, organization_id))).scalar()
+        for model in REPARENTED_MODELS)
+
+
+def _counter_deltas(model, rows, organization_id):
+    from counters import COUNTED_MODELS, org_scope
+
+    deltas = Counter()
+    column = COUNTED_MODELS[model]
+    for row in rows:
+        if model is Lead and row.is_converted:
+            continue
+        if row.organization_id:
+            deltas[(org_scope(row.organization_id), column)] -= 1
+        deltas[(org_scope(organization_id), column)] += 1
+    return deltas
+
+
+def batch_statement(model, user_id, organization_id, after, batch_size):
+    """The next ``batch_size`` movable rows with an id after ``after``,
+    along the owner index"""
+    columns = [model.id, model.organization_id]
+    if model is Lead:
+        columns.append(Lead.is_converted)
+    criteria = _movable(model, user_id, organization_id)
+    if after is not None:
+        criteria.append(model.id > after)
+    return select(*columns).where(*criteria).order_by(model.id).limit(batch_size)
+
+
+def move_batch(model, user_id, organization_id, after=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Move the next batch of ``model`` rows after ``after`` and commit.
+    Returns ``(moved, last id moved)``; the id is None once the table is
+    done."""
+    from sync import tombstone_moved
+    from counters import apply_deltas
+
+    rows = db.session.execute(
+        batch_statement(model, user_id, organization_id, after, batch_size)).all()
+    if not rows:
+        return 0, None
+
+    ids = [row.id for row in rows]
+    try:
+        tombstone_moved(model, [model.id.in_(ids)], organization_id)
+        db.session.execute(update(model).where(model.id.in_(ids)).values(
+            organization_id=organization_id),
+            execution_options={'synchronize_session': False})
+        if model in (Lead, Opportunity):
+            db.session.execute(update(StageChange).where(
+                StageChange.entity == model.__tablename__, StageChange.record_id.in_(ids),
+                StageChange.created_by == user_id).values(organization_id=organization_id))
+        # Core statements bypass the ORM counter events
+        apply_deltas(db.session.connection(), _counter_deltas(model, rows, organization_id))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(rows), rows[-1].id
+
+
+def reparent_records(user_id, organization_id, batch_size=DEFAULT_BATCH_SIZE,
+                     checkpoint=None, progress=None):
+    """Move all of the user's records into ``organization_id``.
+
+    ``progress(done, total, checkpoint)`` is called after every batch.
+    Returns ``{table name: rows moved}`` for this run.
+    """
+    checkpoint = checkpoint or {'table': REPARENTED_MODELS[0].__tablename__, 'after': None,
+                                'done': 0, 'total': count_movable(user_id, organization_id)}
+    tables = [model.__tablename__ for model in REPARENTED_MODELS]
+    moved = dict.fromkeys(tables, 0)
+    for model in REPARENTED_MODELS[tables.index(checkpoint['table']):]:
+        after = checkpoint['after'] if checkpoint['table'] == model.__tablename__ else None
+        while True:
+            count, after = move_batch(model, user_id, organization_id, after, batch_size)
+            if after is None:
+                break
+            moved[model.__tablename__] += count
+            checkpoint = {'table': model.__tablename__, 'after': after,
+                          'done': checkpoint['done'] + count, 'total': checkpoint['total']}
+            if progress:
+                progress(checkpoint['done'], checkpoint['total'], checkpoint)
+    return moved
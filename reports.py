@@ -0,0 +1,208 @@
+"""Pipeline report: opportunity count, amount and weighted amount in SQL.
+
+One ``GROUP BY`` over the scope's opportunities returns a row per sales
+stage, close month and owner. Weighted amount is ``amount`` times
+``forecast_probability`` / 100. Opportunities without an amount count as 0,
+and so do free-text forecasts. Closed stages are left out unless
+``include_closed`` is set.
+
+For trends, ``snapshot_pipeline`` rolls the same numbers up once a day into
+``pipeline_snapshots`` (see snapshot_pipeline.py), one row per scope, stage
+and close month. ``pipeline_trend`` reads those rows instead of the
+opportunities, so a two-year chart reads a few hundred rows.
+"""
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import String, case, cast, delete, func, insert, literal, select
+
+from models import Opportunity, PipelineSnapshot, User
+
+CLOSED_STAGES = ('Closed Won', 'Closed Lost')
+
+
+def month_of(dialect_name, column):
+    """``YYYY-MM`` of a date or timestamp column in SQL"""
+    if dialect_name == 'postgresql':
+        return func.to_char(column, 'YYYY-MM')
+    return func.strftime('%Y-%m', column)
+
+
+def close_month(dialect_name):
+    """``YYYY-MM`` of Opportunity.close_date in SQL"""
+    return month_of(dialect_name, Opportunity.close_date)
+
+
+def _month_start(month):
+    return datetime.strptime(month, '%Y-%m').date()
+
+
+def parse_pipeline_args(args):
+    """Read ``from``/``to`` close months (YYYY-MM), ``stage`` and
+    ``include_closed``; raises ValueError for malformed input"""
+    filters = {'stage': (args.get('stage') or '').strip() or None,
+               'include_closed': args.get('include_closed', '').lower() in ('1', 'true', 'yes')}
+    for name in ('from', 'to'):
+        value = (args.get(name) or '').strip()
+        if value:
+            try:
+                _month_start(value)
+            except ValueError:
+                raise ValueError(f'{name} must be a month in YYYY-MM format')
+        filters[name] = value or None
+    return filters
+
+
+def _stage_criteria(stage_column, filters):
+    if filters['stage']:
+        return [stage_column == filters['stage']]
+    if not filters['include_closed']:
+        return [stage_column.not_in(CLOSED_STAGES)]
+    return []
+
+
+def _amounts():
+    """``(sum of amount, sum of weighted amount)`` over opportunities"""
+    amount = func.coalesce(Opportunity.amount, 0)
+    weighted = func.sum(amount * func.coalesce(Opportunity.forecast_probability, 0)) / 100
+    return func.sum(amount), weighted
+
+
+def pipeline_statement(dialect_name, org_filter, filters):
+    """The single aggregate query behind ``pipeline_report``"""
+    month = close_month(dialect_name).label('close_month')
+    amount, weighted = _amounts()
+
+    criteria = [getattr(Opportunity, name) == value for name, value in org_filter.items()]
+    criteria += _stage_criteria(Opportunity.sales_stage, filters)
+    if filters['from']:
+        criteria.append(Opportunity.close_date >= _month_start(filters['from']))
+    if filters['to']:
+        start = _month_start(filters['to'])
+        following = date(start.year + start.month // 12, start.month % 12 + 1, 1)
+        criteria.append(Opportunity.close_date < following)
+
+    return (select(Opportunity.sales_stage, month, Opportunity.created_by,
+                   User.first_name, User.last_name,
+                   func.count().label('count'), amount.label('amount'),
+                   weighted.label('weighted_amount'))
+            .outerjoin(User, User.id == Opportunity.created_by)
+            .where(*criteria)
+            .group_by(Opportunity.sales_stage, month, Opportunity.created_by,
+                      User.first_name, User.last_name)
+            .order_by(Opportunity.sales_stage, month, Opportunity.created_by))
+
+
+def _money(value):
+    return float(Decimal(value or 0).quantize(Decimal('0.01')))
+
+
+def pipeline_report(session, org_filter, filters):
+    """Grouped pipeline rows and their totals"""
+    rows = session.execute(pipeline_statement(session.get_bind().dialect.name,
+                                              org_filter, filters)).all()
+    groups = [{
+        'salesStage': row.sales_stage,
+        'closeMonth': row.close_month,
+        'owner': {'id': row.created_by,
+                  'name': ' '.join(part for part in (row.first_name, row.last_name) if part) or None},
+        'count': row.count,
+        'amount': _money(row.amount),
+        'weightedAmount': _money(row.weighted_amount),
+    } for row in rows]
+    totals = {
+        'count': sum(group['count'] for group in groups),
+        'amount': _money(sum(Decimal(row.amount or 0) for row in rows)),
+        'weightedAmount': _money(sum(Decimal(row.weighted_amount or 0) for row in rows)),
+    }
+    return {'groups': groups, 'totals': totals}
+
+
+def snapshot_scope():
+    """Scope of an opportunity in SQL, as in record_counters: its organization,
+    or its owner when it has none"""
+    return case((Opportunity.organization_id.is_not(None),
+                 literal('org:') + Opportunity.organization_id),
+                else_=literal('user:') + cast(Opportunity.created_by, String))
+
+
+def snapshot_pipeline(session, day=None):
+    """Replace the ``day`` (default today, UTC) snapshot of every scope with
+    the current pipeline; returns the number of rows written. The caller
+    commits."""
+    day = day or datetime.utcnow().date()
+    dialect_name = session.get_bind().dialect.name
+    scope, month = snapshot_scope(), close_month(dialect_name)
+    amount, weighted = _amounts()
+    source = (select(literal(day), scope, Opportunity.sales_stage, month,
+                     func.count(), amount, weighted)
+              .group_by(scope, Opportunity.sales_stage, month))
+    # Re-running a day (a retried job) replaces its rows
+    session.execute(delete(PipelineSnapshot).where(PipelineSnapshot.snapshot_date == day))
+    return session.execute(insert(PipelineSnapshot).from_select(
+        ['snapshot_date', 'scope', 'sales_stage', 'close_month', 'count',
+         'amount', 'weighted_amount'], source)).rowcount
+
+
+def _parse_day(name, value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError(f'{name} must be a date in YYYY-MM-DD format')
+
+
+def parse_trend_args(args, today=None):
+    """Read ``from``/``to`` snapshot dates (YYYY-MM-DD, default the last year),
+    ``interval`` ('day' or 'month'), ``stage`` and ``include_closed``; raises
+    ValueError for malformed input"""
+    today = today or datetime.utcnow().date()
+    filters = {'stage': (args.get('stage') or '').strip() or None,
+               'include_closed': args.get('include_closed', '').lower() in ('1', 'true', 'yes'),
+               'interval': args.get('interval') or 'day'}
+    if filters['interval'] not in ('day', 'month'):
+        raise ValueError("interval must be 'day' or 'month'")
+    filters['to'] = _parse_day('to', args['to']) if args.get('to') else today
+    filters['from'] = (_parse_day('from', args['from']) if args.get('from')
+                       else filters['to'] - timedelta(days=365))
+    return filters
+
+
+def trend_statement(dialect_name, scope, filters):
+    """Snapshot totals per date and sales stage; with ``interval=month`` only
+    the last snapshot of each month"""
+    criteria = [PipelineSnapshot.scope == scope,
+                PipelineSnapshot.snapshot_date >= filters['from'],
+                PipelineSnapshot.snapshot_date <= filters['to']]
+    dates = list(criteria)
+    criteria += _stage_criteria(PipelineSnapshot.sales_stage, filters)
+    if filters['interval'] == 'month':
+        month = month_of(dialect_name, PipelineSnapshot.snapshot_date)
+        criteria.append(PipelineSnapshot.snapshot_date.in_(
+            select(func.max(PipelineSnapshot.snapshot_date)).where(*dates).group_by(month)))
+    return (select(PipelineSnapshot.snapshot_date, PipelineSnapshot.sales_stage,
+                   func.sum(PipelineSnapshot.count).label('count'),
+                   func.sum(PipelineSnapshot.amount).label('amount'),
+                   func.sum(PipelineSnapshot.weighted_amount).label('weighted_amount'))
+            .where(*criteria)
+            .group_by(PipelineSnapshot.snapshot_date, PipelineSnapshot.sales_stage)
+            .order_by(PipelineSnapshot.snapshot_date, PipelineSnapshot.sales_stage))
+
+
+def pipeline_trend(session, scope, filters):
+    """``{points: [{date, count, amount, weightedAmount, stages}]}``, one point
+    per snapshot with its totals and a breakdown by sales stage"""
+    rows = session.execute(trend_statement(session.get_bind().dialect.name, scope, filters)).all()
+    points = {}
+    for row in rows:
+        point = points.setdefault(row.snapshot_date, {
+            'date': row.snapshot_date.isoformat(), 'count': 0,
+            'amount': Decimal(0), 'weightedAmount': Decimal(0), 'stages': []})
+        point['count'] += int(row.count)
+        point['amount'] += Decimal(row.amount or 0)
+        point['weightedAmount'] += Decimal(row.weighted_amount or 0)
+        point['stages'].append({'salesStage': row.sales_stage, 'count': int(row.count),
+                                'amount': _money(row.amount),
+                                'weightedAmount': _money(row.weighted_amount)})
+    for point in points.values():
+        point['amount'], point['weightedAmount'] = _money(point['amount']), _money(point['weightedAmount'])
+    return {'points': list(points.values())}
@@ -1,24 +1,108 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app, url_for, send_file
 from flask_login import login_required, current_user
-from models import Lead, Account, Contact, Opportunity, get_organization_filter, set_organization_data
+from werkzeug.datastructures import FileStorage
+from models import Lead, Account, Contact, Opportunity, Job, get_organization_filter, set_organization_data
 from database import db
 from datetime import datetime
+import io
+import os
 import uuid
+from pagination import parse_page_args, keyset_page
+from serializers import api_columns, serialize_rows
+from conditional import list_version, conditional_response
+from sync import changes, ExpiredSyncToken
+from importers import import_leads, ImportFormatError
+from search import parse_search_args, search
+from typeahead import parse_lookup_args, lookup_accounts, lookup_contacts
+from reports import parse_pipeline_args, pipeline_report, parse_trend_args, pipeline_trend
+from analytics import parse_analytics_args, funnel, conversion_rates, time_in_stage, cohorts
+from conversion import convert_leads, conversion_to_dict, MAX_BATCH_SIZE as MAX_CONVERSION_BATCH
+from querystats import query_budget
+from jobs import enqueue, runner, MAX_CONVERSION_JOB_SIZE
+from exporters import EXPORT_SPECS, EXPORT_FORMATS
 from validation import (
     validate_lead_data, validate_account_data, validate_contact_data, 
-    validate_opportunity_data, validation_error_response, handle_database_error
+    validate_opportunity_data, validate_conversion_options, validation_error_response,
+    handle_database_error
 )
 
 api_bp = Blueprint('api', __name__)
 
+def sync_response(model):
+    """Return the changes to ``model`` after ``?since=<token>`` as
+    {items, deleted, next_since, has_more}"""
+    try:
+        limit, _ = parse_page_args(request.args)
+        batch = changes(model, get_organization_filter(current_user), request.args['since'], limit,
+                        lag=current_app.config['SYNC_LAG_SECONDS'],
+                        retention_days=current_app.config['SYNC_TOMBSTONE_DAYS'])
+    except ExpiredSyncToken as e:
+        # The client has to start over with an empty token
+        return jsonify({'error': str(e), 'resync': True}), 410
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(batch)
+
+def paginated_response(query, model):
+    """Return one keyset page of ``query`` as {items, next_cursor}, or 304
+    when the client's ETag still matches the list. Without ``limit`` or
+    ``cursor`` return the whole list as a bare array, as before pagination.
+    With ``?since=`` return the changes after the token instead (see sync.py)."""
+    if 'since' in request.args:
+        return sync_response(model)
+    
+    try:
+        limit, cursor = parse_page_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    paged = 'limit' in request.args or 'cursor' in request.args
+    
+    def build():
+        # Plain row tuples of the to_dict() columns instead of ORM objects
+        rows_query = query.with_entities(*api_columns(model))
+        if not paged:
+            rows = rows_query.order_by(model.updated_at, model.id).all()
+            return jsonify(serialize_rows(model, rows))
+        rows, next_cursor = keyset_page(rows_query, model, limit, cursor)
+        return jsonify({
+            'items': serialize_rows(model, rows),
+            'next_cursor': next_cursor
+        })
+    
+    return conditional_response(list_version(query), build)
+
+@api_bp.route('/search', methods=['GET'])
+@login_required
+@query_budget(2)
+def search_records():
+    """Ranked full-text search across leads, accounts, contacts and opportunities"""
+    try:
+        q, entities, page, per_page = parse_search_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        items, has_next = search(db.session, q, get_organization_filter(current_user),
+                                 entities, page, per_page)
+    except Exception as e:
+        return handle_database_error(e, "search")
+    
+    return jsonify({
+        'items': items,
+        'page': page,
+        'per_page': per_page,
+        'has_next': has_next
+    })
+
 # Lead API endpoints
 @api_bp.route('/leads', methods=['GET'])
 @login_required
+@query_budget(3)
 def get_leads():
-    """Get all leads for current user"""
+    """Get the leads of the current user, or a page of them, ordered by (updated_at, id)"""
     org_filter = get_organization_filter(current_user)
-    leads = Lead.query.filter_by(**org_filter, is_converted=False).all()
-    return jsonify([lead.to_dict() for lead in leads])
+    query = Lead.query.filter_by(**org_filter, is_converted=False)
+    return paginated_response(query, Lead)
 
 @api_bp.route('/leads', methods=['POST'])
 @login_required
@@ -55,6 +139,34 @@ def create_lead():
         db.session.rollback()
         return jsonify({'error': 'Failed to create lead'}), 500
 
+@api_bp.route('/leads/import', methods=['POST'])
+@login_required
+def import_leads_csv():
+    """Bulk import leads from an uploaded CSV file (multipart field 'file' or a text/csv body)"""
+    if 'file' in request.files:
+        stream = request.files['file'].stream
+    elif request.mimetype == 'text/csv':
+        stream = request.stream
+    else:
+        return jsonify({'error': 'No CSV file provided'}), 400
+    
+    try:
+        batch_size = int(request.args.get('batch_size', current_app.config['IMPORT_BATCH_SIZE']))
+        if batch_size < 1:
+            raise ValueError
+    except ValueError:
+        return jsonify({'error': 'batch_size must be a positive integer'}), 400
+    
+    lines = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    try:
+        report = import_leads(lines, current_user, batch_size=batch_size)
+    except ImportFormatError as e:
+        return jsonify({'error': str(e)}), 400
+    except UnicodeDecodeError:
+        return jsonify({'error': 'CSV file must be UTF-8 encoded'}), 400
+    
+    return jsonify(report)
+
 @api_bp.route('/leads/<lead_id>', methods=['PUT'])
 @login_required
 def update_lead(lead_id):
@@ -93,81 +205,75 @@ def update_lead(lead_id):
 @login_required
 def convert_lead(lead_id):
     """Convert lead to account, contact, and opportunity"""
-    org_filter = get_organization_filter(current_user)
-    lead = Lead.query.filter_by(id=lead_id, **org_filter).first()
-    if not lead:
+    options = request.get_json(silent=True) or {}
+    errors = validate_conversion_options(options)
+    if errors:
+        return validation_error_response(errors)
+    
+    try:
+        result = convert_leads([lead_id], current_user, options)
+    except Exception as e:
+        return handle_database_error(e, "lead conversion")
+    
+    if result['skipped']:
+        if result['skipped'][0]['reason'] == 'already_converted':
+            return jsonify({'error': 'Lead already converted'}), 400
         return jsonify({'error': 'Lead not found or access denied'}), 404
     
-    if lead.is_converted:
-        return jsonify({'error': 'Lead already converted'}), 400
+    entry = conversion_to_dict(result['converted'][0])
+    return jsonify({
+        'message': 'Lead converted successfully',
+        'account_id': entry['account']['id'],
+        'contact_id': entry['contact']['id'],
+        'opportunity_id': entry['opportunity']['id'],
+        'account': entry['account'],
+        'contact': entry['contact'],
+        'opportunity': entry['opportunity']
+    })
+
+@api_bp.route('/leads/convert', methods=['POST'])
+@login_required
+def convert_leads_batch():
+    """Convert several leads in one transaction"""
+    data = request.get_json(silent=True) or {}
+    lead_ids = data.get('leadIds')
+    if not isinstance(lead_ids, list) or not lead_ids or not all(isinstance(i, str) for i in lead_ids):
+        return validation_error_response(['leadIds must be a non-empty list of lead ids'])
+    if len(lead_ids) > MAX_CONVERSION_BATCH:
+        return validation_error_response([f'At most {MAX_CONVERSION_BATCH} leads can be converted at once'])
+    
+    options = data.get('options') or {}
+    errors = validate_conversion_options(options)
+    if errors:
+        return validation_error_response(errors)
     
     try:
-        # Create Account
-        account = Account(
-            company_name=lead.company_name,
-            description=f'Account created from lead: {lead.company_name}',
-            notes=lead.notes,
-            created_by=current_user.id
-        )
-        account = set_organization_data(account, current_user)
-        db.session.add(account)
-        db.session.flush()  # Get the account ID
-        
-        # Create Contact
-        name_parts = lead.contact_person.split(' ', 1)
-        first_name = name_parts[0]
-        last_name = name_parts[1] if len(name_parts) > 1 else ''
-        
-        contact = Contact(
-            first_name=first_name,
-            last_name=last_name,
-            email=lead.email,
-            account_id=account.id,
-            notes=f'Contact created from lead: {lead.contact_person}',
-            last_contact=datetime.utcnow().date(),
-            created_by=current_user.id
-        )
-        contact = set_organization_data(contact, current_user)
-        db.session.add(contact)
-        db.session.flush()  # Get the contact ID
-        
-        # Create Opportunity
-        opportunity = Opportunity(
-            name=f'Opportunity for {lead.company_name}',
-            sales_stage='Prospecting',
-            forecast='0%',
-            company_id=account.id,
-            contact_id=contact.id,
-            next_steps='Initial outreach and discovery call',
-            requirements=f'Initial requirements from lead: {lead.notes or "No specific requirements noted yet."}',
-            created_by=current_user.id
-        )
-        opportunity = set_organization_data(opportunity, current_user)
-        db.session.add(opportunity)
-        
-        # Mark lead as converted
-        lead.is_converted = True
-        
-        db.session.commit()
-        
-        return jsonify({
-            'message': 'Lead converted successfully',
-            'account_id': account.id,
-            'contact_id': contact.id,
-            'opportunity_id': opportunity.id
-        })
+        result = convert_leads(lead_ids, current_user, options)
     except Exception as e:
-        db.session.rollback()
-        return jsonify({'error': 'Failed to convert lead'}), 500
+        return handle_database_error(e, "lead conversion")
+    
+    return jsonify({
+        'converted': [conversion_to_dict(entry) for entry in result['converted']],
+        'skipped': [{'leadId': s['lead_id'], 'reason': s['reason']} for s in result['skipped']]
+    })
 
 # Account API endpoints
+@api_bp.route('/accounts/lookup', methods=['GET'])
+@login_required
+@query_budget(2)
+def lookup_accounts_route():
+    """Account name prefix lookup for the form pickers"""
+    q, limit = parse_lookup_args(request.args)
+    return jsonify({'items': lookup_accounts(get_organization_filter(current_user), q, limit)})
+
 @api_bp.route('/accounts', methods=['GET'])
 @login_required
+@query_budget(3)
 def get_accounts():
-    """Get all accounts for current user"""
+    """Get the accounts of the current user, or a page of them, ordered by (updated_at, id)"""
     org_filter = get_organization_filter(current_user)
-    accounts = Account.query.filter_by(**org_filter).all()
-    return jsonify([account.to_dict() for account in accounts])
+    query = Account.query.filter_by(**org_filter)
+    return paginated_response(query, Account)
 
 @api_bp.route('/accounts', methods=['POST'])
 @login_required
@@ -238,13 +344,23 @@ def update_account(account_id):
         return jsonify({'error': 'Failed to update account'}), 500
 
 # Contact API endpoints
+@api_bp.route('/contacts/lookup', methods=['GET'])
+@login_required
+@query_budget(3)
+def lookup_contacts_route():
+    """Contact name prefix lookup for the form pickers, optionally within one account"""
+    q, limit = parse_lookup_args(request.args)
+    account_id = request.args.get('account_id') or None
+    return jsonify({'items': lookup_contacts(get_organization_filter(current_user), q, account_id, limit)})
+
 @api_bp.route('/contacts', methods=['GET'])
 @login_required
+@query_budget(3)
 def get_contacts():
-    """Get all contacts for current user"""
+    """Get the contacts of the current user, or a page of them, ordered by (updated_at, id)"""
     org_filter = get_organization_filter(current_user)
-    contacts = Contact.query.filter_by(**org_filter).all()
-    return jsonify([contact.to_dict() for contact in contacts])
+    query = Contact.query.filter_by(**org_filter)
+    return paginated_response(query, Contact)
 
 @api_bp.route('/contacts', methods=['POST'])
 @login_required
@@ -328,11 +444,12 @@ def update_contact(contact_id):
 # Opportunity API endpoints
 @api_bp.route('/opportunities', methods=['GET'])
 @login_required
+@query_budget(3)
 def get_opportunities():
-    """Get all opportunities for current user"""
+    """Get the opportunities of the current user, or a page of them, ordered by (updated_at, id)"""
     org_filter = get_organization_filter(current_user)
-    opportunities = Opportunity.query.filter_by(**org_filter).all()
-    return jsonify([opportunity.to_dict() for opportunity in opportunities])
+    query = Opportunity.query.filter_by(**org_filter)
+    return paginated_response(query, Opportunity)
 
 @api_bp.route('/opportunities', methods=['POST'])
 @login_required
@@ -423,3 +540,152 @@ def update_opportunity(opportunity_id):
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': 'Failed to update opportunity'}), 500
+
+# Report endpoints
+@api_bp.route('/reports/pipeline', methods=['GET'])
+@login_required
+@query_budget(2)
+def pipeline_report_route():
+    """Opportunity count, amount and weighted amount by sales stage, close month and owner"""
+    try:
+        filters = parse_pipeline_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        report = pipeline_report(db.session, get_organization_filter(current_user), filters)
+    except Exception as e:
+        return handle_database_error(e, "pipeline report")
+    
+    return jsonify(report)
+
+@api_bp.route('/reports/pipeline/trend', methods=['GET'])
+@login_required
+@query_budget(2)
+def pipeline_trend_route():
+    """Pipeline count, amount and weighted amount over time from the daily snapshots"""
+    from counters import scope_for_user
+    
+    try:
+        filters = parse_trend_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        trend = pipeline_trend(db.session, scope_for_user(current_user), filters)
+    except Exception as e:
+        return handle_database_error(e, "pipeline trend")
+    
+    return jsonify(trend)
+
+ANALYTICS_REPORTS = {
+    'funnel': funnel,
+    'conversion-rates': conversion_rates,
+    'time-in-stage': time_in_stage,
+    'cohorts': cohorts,
+}
+
+@api_bp.route('/reports/<any(leads, opportunities):entity>/<any(funnel, "conversion-rates", "time-in-stage", cohorts):report>',
+              methods=['GET'])
+@login_required
+@query_budget(2)
+def stage_analytics_route(entity, report):
+    """Funnel, conversion rates, time in stage or cohorts from the stage history"""
+    try:
+        filters = parse_analytics_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        result = ANALYTICS_REPORTS[report](db.session, entity, get_organization_filter(current_user), filters)
+    except Exception as e:
+        return handle_database_error(e, f"{report} report")
+    
+    return jsonify(result)
+
+# Background job endpoints
+def job_accepted(job):
+    """202 with the job and where to poll it"""
+    response = jsonify(job.to_dict())
+    response.status_code = 202
+    response.headers['Location'] = url_for('api.get_job', job_id=job.id)
+    return response
+
+def own_job(job_id):
+    return Job.query.filter_by(id=job_id, created_by=current_user.id).first()
+
+@api_bp.route('/jobs/export/<entity>.<fmt>', methods=['POST'])
+@login_required
+def start_export_job(entity, fmt):
+    """Build an export file in the background"""
+    if entity not in EXPORT_SPECS or fmt not in EXPORT_FORMATS:
+        return jsonify({'error': 'Unknown export'}), 404
+    return job_accepted(enqueue('export', current_user, {'entity': entity, 'format': fmt}))
+
+@api_bp.route('/jobs/import/leads', methods=['POST'])
+@login_required
+def start_import_job():
+    """Import leads from an uploaded CSV file in the background"""
+    if 'file' in request.files:
+        upload = request.files['file']
+    elif request.mimetype == 'text/csv':
+        upload = FileStorage(request.stream)
+    else:
+        return jsonify({'error': 'No CSV file provided'}), 400
+    
+    try:
+        batch_size = int(request.args.get('batch_size', current_app.config['IMPORT_BATCH_SIZE']))
+        if batch_size < 1:
+            raise ValueError
+    except ValueError:
+        return jsonify({'error': 'batch_size must be a positive integer'}), 400
+    
+    return job_accepted(enqueue('import_leads', current_user, {'batchSize': batch_size}, upload=upload))
+
+@api_bp.route('/jobs/convert/leads', methods=['POST'])
+@login_required
+def start_conversion_job():
+    """Convert a large set of leads in the background"""
+    data = request.get_json(silent=True) or {}
+    lead_ids = data.get('leadIds')
+    if not isinstance(lead_ids, list) or not lead_ids or not all(isinstance(i, str) for i in lead_ids):
+        return validation_error_response(['leadIds must be a non-empty list of lead ids'])
+    if len(lead_ids) > MAX_CONVERSION_JOB_SIZE:
+        return validation_error_response([f'At most {MAX_CONVERSION_JOB_SIZE} leads can be converted in one job'])
+    
+    options = data.get('options') or {}
+    errors = validate_conversion_options(options)
+    if errors:
+        return validation_error_response(errors)
+    
+    return job_accepted(enqueue('convert_leads', current_user,
+                                {'leadIds': list(dict.fromkeys(lead_ids)), 'options': options}))
+
+@api_bp.route('/jobs', methods=['GET'])
+@login_required
+def list_jobs():
+    """The current user's most recent jobs"""
+    runner.sweep_if_due()
+    jobs = (Job.query.filter_by(created_by=current_user.id)
+            .order_by(Job.created_at.desc()).limit(50).all())
+    return jsonify({'items': [job.to_dict() for job in jobs]})
+
+@api_bp.route('/jobs/<job_id>', methods=['GET'])
+@login_required
+def get_job(job_id):
+    """Status, progress and result of one job"""
+    runner.sweep_if_due()
+    job = own_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found or access denied'}), 404
+    return jsonify(job.to_dict())
+
+@api_bp.route('/jobs/<job_id>/artifact', methods=['GET'])
+@login_required
+def get_job_artifact(job_id):
+    """Download the file a job produced"""
+    job = own_job(job_id)
+    if not job or not job.artifact_path or not os.path.exists(job.artifact_path):
+        return jsonify({'error': 'Job artifact not found'}), 404
+    return send_file(job.artifact_path, mimetype=job.artifact_mimetype,
+                     as_attachment=True, download_name=job.artifact_name)
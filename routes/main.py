@@ -1,15 +1,34 @@
-from flask import Blueprint, render_template, request, jsonify, current_app, redirect, url_for, flash, make_response
+from flask import Blueprint, render_template, request, jsonify, current_app, redirect, url_for, flash, Response, stream_with_context
 from flask_login import login_required, current_user
 from models import Lead, Account, Contact, Opportunity, User, get_organization_filter, set_organization_data, create_organization_for_user
 from database import db
-import csv
-from io import StringIO
+from listing import list_page
+from conditional import list_version, conditional_response
+from counters import get_counts
+from exporters import EXPORT_SPECS, EXPORT_FORMATS, iter_export
+from conversion import convert_leads
+from querystats import query_budget
 from datetime import datetime, date
 
 main_bp = Blueprint('main', __name__)
 
+def render_list_page(entity, query, *related):
+    """Render a list page, or 304 if neither ``query`` nor the ``related``
+    queries whose rows the page shows have changed since the client's copy"""
+    # The navigation bar shows who is signed in
+    user = (current_user.id, current_user.first_name, current_user.last_name,
+            current_user.is_admin, current_user.organization_id)
+    
+    def build():
+        pagination, list_state = list_page(entity, query, request.args)
+        return render_template(f'{entity}.html', pagination=pagination, list_state=list_state,
+                               **{entity: pagination.items})
+    
+    return conditional_response(list_version(query, *related, vary=user), build)
+
 @main_bp.route('/')
 @login_required
+@query_budget(9)
 def dashboard():
     """Main dashboard view"""
     try:
@@ -17,30 +36,17 @@ def dashboard():
         org_filter = get_organization_filter(current_user)
         current_app.logger.info(f"Dashboard: org_filter = {org_filter}")
         
-        # Get counts for dashboard using organization filter with fallback to 0
-        try:
-            leads_count = Lead.query.filter_by(**org_filter, is_converted=False).count()
-        except Exception as e:
-            current_app.logger.warning(f"Error counting leads: {e}")
-            leads_count = 0
-            
+        # Read all dashboard counts from the scope's counter row
         try:
-            accounts_count = Account.query.filter_by(**org_filter).count()
+            counts = get_counts(current_user)
         except Exception as e:
-            current_app.logger.warning(f"Error counting accounts: {e}")
-            accounts_count = 0
-            
-        try:
-            contacts_count = Contact.query.filter_by(**org_filter).count()
-        except Exception as e:
-            current_app.logger.warning(f"Error counting contacts: {e}")
-            contacts_count = 0
-            
-        try:
-            opportunities_count = Opportunity.query.filter_by(**org_filter).count()
-        except Exception as e:
-            current_app.logger.warning(f"Error counting opportunities: {e}")
-            opportunities_count = 0
+            current_app.logger.warning(f"Error reading dashboard counts: {e}")
+            db.session.rollback()
+            counts = {'leads': 0, 'accounts': 0, 'contacts': 0, 'opportunities': 0}
+        leads_count = counts['leads']
+        accounts_count = counts['accounts']
+        contacts_count = counts['contacts']
+        opportunities_count = counts['opportunities']
         
         current_app.logger.info(f"Dashboard counts: leads={leads_count}, accounts={accounts_count}, contacts={contacts_count}, opportunities={opportunities_count}")
         
@@ -68,11 +74,11 @@ def dashboard():
 
 @main_bp.route('/leads')
 @login_required
+@query_budget(4)
 def leads():
     """Leads management page"""
     org_filter = get_organization_filter(current_user)
-    leads = Lead.query.filter_by(**org_filter).all()
-    return render_template('leads.html', leads=leads)
+    return render_list_page('leads', Lead.query.filter_by(**org_filter))
 
 @main_bp.route('/leads/add', methods=['GET', 'POST'])
 @login_required
@@ -105,6 +111,7 @@ def add_lead():
 
 @main_bp.route('/leads/edit/<lead_id>', methods=['GET', 'POST'])
 @login_required
+@query_budget(4)
 def edit_lead(lead_id):
     """Edit an existing lead"""
     # Find the lead using organization filter
@@ -199,11 +206,11 @@ def edit_lead_post(lead_id):
 
 @main_bp.route('/accounts')
 @login_required
+@query_budget(4)
 def accounts():
     """Accounts management page"""
     org_filter = get_organization_filter(current_user)
-    accounts = Account.query.filter_by(**org_filter).all()
-    return render_template('accounts.html', accounts=accounts)
+    return render_list_page('accounts', Account.query.filter_by(**org_filter))
 
 @main_bp.route('/accounts/add', methods=['GET', 'POST'])
 @login_required
@@ -232,6 +239,7 @@ def add_account():
 
 @main_bp.route('/accounts/edit/<account_id>', methods=['GET', 'POST'])
 @login_required
+@query_budget(4)
 def edit_account(account_id):
     """Edit an existing account"""
     # Find the account using organization filter
@@ -297,11 +305,13 @@ def edit_account(account_id):
 
 @main_bp.route('/contacts')
 @login_required
+@query_budget(4)
 def contacts():
     """Contacts management page"""
     org_filter = get_organization_filter(current_user)
-    contacts = Contact.query.filter_by(**org_filter).all()
-    return render_template('contacts.html', contacts=contacts)
+    # Rows show their account's name
+    return render_list_page('contacts', Contact.query.filter_by(**org_filter),
+                            Account.query.filter_by(**org_filter))
 
 @main_bp.route('/contacts/add', methods=['GET', 'POST'])
 @login_required
@@ -320,8 +330,7 @@ def add_contact():
                 account = Account.query.filter_by(id=account_id, **org_filter).first()
                 if not account:
                     flash('Invalid account selected', 'error')
-                    accounts = Account.query.filter_by(**org_filter).all()
-                    return render_template('add_contact.html', accounts=accounts)
+                    return render_template('add_contact.html')
             else:
                 account_id = None  # Set to None if empty string
             
@@ -344,18 +353,14 @@ def add_contact():
         except Exception as e:
             flash(f'Error adding contact: {str(e)}', 'error')
             db.session.rollback()
-            # Get accounts for template in case of error
-            org_filter = get_organization_filter(current_user)
-            accounts = Account.query.filter_by(**org_filter).all()
-            return render_template('add_contact.html', accounts=accounts)
+            return render_template('add_contact.html')
     
-    # Get accounts for this organization
-    org_filter = get_organization_filter(current_user)
-    accounts = Account.query.filter_by(**org_filter).all()
-    return render_template('add_contact.html', accounts=accounts)
+    # Accounts are picked through /api/accounts/lookup
+    return render_template('add_contact.html')
 
 @main_bp.route('/contacts/edit/<contact_id>', methods=['GET', 'POST'])
 @login_required
+@query_budget(5)
 def edit_contact(contact_id):
     """Edit existing contact"""
     # Find the contact using organization filter
@@ -381,16 +386,14 @@ def edit_contact(contact_id):
             # Validate required fields
             if not first_name or not last_name or not email:
                 flash('First name, last name, and email are required', 'error')
-                accounts = Account.query.filter_by(**org_filter).all()
-                return render_template('edit_contact.html', contact=contact, accounts=accounts)
+                return render_template('edit_contact.html', contact=contact)
             
             # Validate account if provided
             if account_id and account_id.strip():
                 account = Account.query.filter_by(id=account_id, **org_filter).first()
                 if not account:
                     flash('Invalid account selected', 'error')
-                    accounts = Account.query.filter_by(**org_filter).all()
-                    return render_template('edit_contact.html', contact=contact, accounts=accounts)
+                    return render_template('edit_contact.html', contact=contact)
             else:
                 account_id = None  # Set to None if empty string
             
@@ -421,18 +424,17 @@ def edit_contact(contact_id):
             db.session.rollback()
     
     # GET request - show the edit form
-    accounts = Account.query.filter_by(**org_filter).all()
-    return render_template('edit_contact.html', contact=contact, accounts=accounts)
+    return render_template('edit_contact.html', contact=contact)
 
 @main_bp.route('/opportunities')
 @login_required
+@query_budget(4)
 def opportunities():
     """Opportunities management page"""
     org_filter = get_organization_filter(current_user)
-    opportunities = Opportunity.query.filter_by(**org_filter).options(
-        db.joinedload(Opportunity.account)
-    ).all()
-    return render_template('opportunities.html', opportunities=opportunities)
+    # Rows show their account's name
+    return render_list_page('opportunities', Opportunity.query.filter_by(**org_filter),
+                            Account.query.filter_by(**org_filter))
 
 @main_bp.route('/opportunities/add', methods=['GET', 'POST'])
 @login_required
@@ -457,26 +459,17 @@ def add_opportunity():
             # Validate required fields
             if not name:
                 flash('Opportunity name is required', 'error')
-                org_filter = get_organization_filter(current_user)
-                accounts = Account.query.filter_by(**org_filter).all()
-                contacts = Contact.query.filter_by(**org_filter).all()
-                return render_template('add_opportunity.html', accounts=accounts, contacts=contacts)
+                return render_template('add_opportunity.html')
             
             if not company_id:
                 flash('Account selection is required', 'error')
-                org_filter = get_organization_filter(current_user)
-                accounts = Account.query.filter_by(**org_filter).all()
-                contacts = Contact.query.filter_by(**org_filter).all()
-                return render_template('add_opportunity.html', accounts=accounts, contacts=contacts)
+                return render_template('add_opportunity.html')
             
             # Validate account exists and belongs to organization
             account = Account.query.filter_by(id=company_id, **org_filter).first()
             if not account:
                 flash('Invalid account selected', 'error')
-                org_filter = get_organization_filter(current_user)
-                accounts = Account.query.filter_by(**org_filter).all()
-                contacts = Contact.query.filter_by(**org_filter).all()
-                return render_template('add_opportunity.html', accounts=accounts, contacts=contacts)
+                return render_template('add_opportunity.html')
             
             # Validate contact if provided
             contact = None
@@ -484,10 +477,7 @@ def add_opportunity():
                 contact = Contact.query.filter_by(id=contact_id, **org_filter).first()
                 if not contact:
                     flash('Invalid contact selected', 'error')
-                    org_filter = get_organization_filter(current_user)
-                    accounts = Account.query.filter_by(**org_filter).all()
-                    contacts = Contact.query.filter_by(**org_filter).all()
-                    return render_template('add_opportunity.html', accounts=accounts, contacts=contacts)
+                    return render_template('add_opportunity.html')
             
             # Parse forecast
             try:
@@ -537,14 +527,12 @@ def add_opportunity():
             flash(f'Error adding opportunity: {str(e)}', 'error')
             db.session.rollback()
     
-    # Get accounts and contacts for this organization
-    org_filter = get_organization_filter(current_user)
-    accounts = Account.query.filter_by(**org_filter).all()
-    contacts = Contact.query.filter_by(**org_filter).all()
-    return render_template('add_opportunity.html', accounts=accounts, contacts=contacts)
+    # Accounts and contacts are picked through the /api/*/lookup endpoints
+    return render_template('add_opportunity.html')
 
 @main_bp.route('/opportunities/edit/<opportunity_id>', methods=['GET', 'POST'])
 @login_required
+@query_budget(6)
 def edit_opportunity(opportunity_id):
     """Edit an existing opportunity"""
     # Find the opportunity using organization filter
@@ -555,10 +543,7 @@ def edit_opportunity(opportunity_id):
         return redirect(url_for('main.opportunities'))
     
     if request.method == 'GET':
-        # Get accounts and contacts for this organization for dropdowns
-        accounts = Account.query.filter_by(**org_filter).all()
-        contacts = Contact.query.filter_by(**org_filter).all()
-        return render_template('edit_opportunity.html', opportunity=opportunity, accounts=accounts, contacts=contacts)
+        return render_template('edit_opportunity.html', opportunity=opportunity)
     
     # Handle POST request (form submission)
     try:
@@ -576,9 +561,7 @@ def edit_opportunity(opportunity_id):
         # Validate required fields
         if not name or not sales_stage:
             flash('Please fill in all required fields (Name and Sales Stage)', 'error')
-            accounts = Account.query.filter_by(**org_filter).all()
-            contacts = Contact.query.filter_by(**org_filter).all()
-            return render_template('edit_opportunity.html', opportunity=opportunity, accounts=accounts, contacts=contacts)
+            return render_template('edit_opportunity.html', opportunity=opportunity)
         
         # Parse close date
         close_date = None
@@ -588,10 +571,16 @@ def edit_opportunity(opportunity_id):
                 close_date = datetime.strptime(close_date_str, '%Y-%m-%d').date()
             except ValueError:
                 flash('Invalid date format', 'error')
-                accounts = Account.query.filter_by(**org_filter).all()
-                contacts = Contact.query.filter_by(**org_filter).all()
-                return render_template('edit_opportunity.html', opportunity=opportunity, accounts=accounts, contacts=contacts)
-        
+                return render_template('edit_opportunity.html', opportunity=opportunity)
+
+        # Picked ids must belong to the user's organization
+        if company_id and not Account.query.filter_by(id=company_id, **org_filter).first():
+            flash('Invalid account selected', 'error')
+            return render_template('edit_opportunity.html', opportunity=opportunity)
+        if contact_id and not Contact.query.filter_by(id=contact_id, **org_filter).first():
+            flash('Invalid contact selected', 'error')
+            return render_template('edit_opportunity.html', opportunity=opportunity)
+
         # Process amount
         amount_value = None
         if amount:
@@ -626,31 +615,19 @@ def edit_opportunity(opportunity_id):
 @login_required
 def export_leads():
     """Export leads to CSV"""
-    org_filter = get_organization_filter(current_user)
-    leads = Lead.query.filter_by(**org_filter).all()
-    
-    output = StringIO()
-    writer = csv.writer(output)
-    
-    # Write header
-    writer.writerow(['Contact Person', 'Company', 'Email', 'Phone', 'Stage', 'Created Date'])
-    
-    # Write data
-    for lead in leads:
-        writer.writerow([
-            lead.contact_person,
-            lead.company_name or '',
-            lead.email,
-            lead.phone or '',
-            lead.stage,
-            lead.created_date.strftime('%Y-%m-%d') if lead.created_date else ''
-        ])
-    
-    output.seek(0)
-    response = make_response(output.getvalue())
-    response.headers['Content-Type'] = 'text/csv'
-    response.headers['Content-Disposition'] = 'attachment; filename=leads_export.csv'
+    return export_records('leads', 'csv')
+
+@main_bp.route('/export/<entity>.<fmt>')
+@login_required
+def export_records(entity, fmt):
+    """Stream an export of leads, accounts, contacts or opportunities as CSV or NDJSON"""
+    if entity not in EXPORT_SPECS or fmt not in EXPORT_FORMATS:
+        return "Page not found.", 404
     
+    org_filter = get_organization_filter(current_user)
+    chunks = iter_export(entity, fmt, org_filter)
+    response = Response(stream_with_context(chunks), mimetype=EXPORT_FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename={entity}_export.{fmt}'
     return response
 
 @main_bp.route('/db-test')
@@ -689,66 +666,24 @@ def db_test():
 @login_required
 def convert_lead(lead_id):
     """Convert a lead via the UI (GET request)"""
-    org_filter = get_organization_filter(current_user)
-    lead = Lead.query.filter_by(id=lead_id, **org_filter).first()
-    if not lead:
-        flash("Lead not found or access denied.", "error")
-        return redirect(url_for("main.leads"))
-    if lead.is_converted:
-        flash("Lead already converted.", "info")
-        return redirect(url_for("main.leads"))
     try:
-        # Create account
-        account = Account(
-            company_name=lead.company_name, 
-            description=f"Converted from lead: {lead.company_name}", 
-            notes=lead.notes,
-            created_by=current_user.id
-        )
-        account = set_organization_data(account, current_user)
-        db.session.add(account)
-        db.session.flush()
-        
-        # Create contact
-        name_parts = lead.contact_person.split(" ", 1)
-        first_name = name_parts[0]
-        last_name = name_parts[1] if len(name_parts) > 1 else ""
-        contact = Contact(
-            first_name=first_name, 
-            last_name=last_name, 
-            email=lead.email, 
-            phone=lead.phone,
-            account_id=account.id, 
-            last_contact=date.today(),
-            created_by=current_user.id
-        )
-        contact = set_organization_data(contact, current_user)
-        db.session.add(contact)
-        db.session.flush()
-        
-        # Create opportunity
-        opportunity = Opportunity(
-            name=f"Opportunity for {lead.company_name}", 
-            sales_stage="Prospecting", 
-            forecast="0%", 
-            company_id=account.id, 
-            contact_id=contact.id, 
-            next_steps=f"Follow up on converted lead from {lead.stage} stage", 
-            requirements=f"Converted from lead: {lead.notes or 'No specific requirements noted.'}",
-            created_by=current_user.id
-        )
-        opportunity = set_organization_data(opportunity, current_user)
-        db.session.add(opportunity)
-        
-        lead.is_converted = True
-        db.session.commit()
-        flash(f"Lead '{lead.contact_person}' successfully converted to Account, Contact, and Opportunity!", "success")
-        # Redirect to opportunities page as specified in conversion logic
-        return redirect(url_for("main.opportunities"))
+        result = convert_leads([lead_id], current_user)
     except Exception as e:
-        db.session.rollback()
         flash(f"Error converting lead: {str(e)}", "error")
-    return redirect(url_for("main.leads"))
+        return redirect(url_for("main.leads"))
+    
+    if result['skipped']:
+        if result['skipped'][0]['reason'] == 'already_converted':
+            flash("Lead already converted.", "info")
+        else:
+            flash("Lead not found or access denied.", "error")
+        return redirect(url_for("main.leads"))
+    
+    contact = result['converted'][0]['contact']
+    contact_person = f"{contact['first_name']} {contact['last_name']}".strip()
+    flash(f"Lead '{contact_person}' successfully converted to Account, Contact, and Opportunity!", "success")
+    # Redirect to opportunities page as specified in conversion logic
+    return redirect(url_for("main.opportunities"))
 
 @main_bp.route('/admin/migrate-database', methods=['POST'])
 def migrate_database():
@@ -1,17 +1,19 @@
 """
 User management routes for sharing access
 """
-from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify
+from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify, current_app
 from flask_login import login_required, current_user
 from werkzeug.security import generate_password_hash
 from models import User, get_organization_filter, set_organization_data, create_organization_for_user
 from database import db
+from querystats import query_budget
 import uuid
 
 users_bp = Blueprint('users', __name__, url_prefix='/users')
 
 @users_bp.route('/manage')
 @login_required
+@query_budget(2)
 def manage_users():
     """User management page"""
     # Only admins can access this page
@@ -61,8 +63,10 @@ def invite_user():
                 return render_template('users/invite.html')
             
             # Create organization for current user if they don't have one
-            if not current_user.organization_id:
-                create_organization_for_user(current_user)
+            # (current_user is a cached identity; modify the real row)
+            organization_id = current_user.organization_id
+            if not organization_id:
+                organization_id = create_organization_for_user(current_user.load())
                 db.session.commit()
             
             # Create new user
@@ -71,7 +75,7 @@ def invite_user():
                 last_name=last_name.strip(),
                 username=username.strip(),
                 email=email.strip(),
-                organization_id=current_user.organization_id,
+                organization_id=organization_id,
                 is_admin=is_admin
             )
             new_user.set_password(password)
@@ -104,37 +108,25 @@ def setup_organization():
         
         try:
             # Create organization for user and make them admin
-            organization_id = create_organization_for_user(current_user)
+            # (current_user is a cached identity; modify the real row)
+            user = current_user.load()
+            organization_id = create_organization_for_user(user)
             
             # Explicitly ensure admin status is set
-            current_user.is_admin = True
-            
-            # Update all existing data to belong to this organization
-            from models import Lead, Account, Contact, Opportunity
-            
-            # Update leads
-            Lead.query.filter_by(created_by=current_user.id).update({
-                'organization_id': organization_id
-            })
-            
-            # Update accounts
-            Account.query.filter_by(created_by=current_user.id).update({
-                'organization_id': organization_id
-            })
-            
-            # Update contacts
-            Contact.query.filter_by(created_by=current_user.id).update({
-                'organization_id': organization_id
-            })
-            
-            # Update opportunities
-            Opportunity.query.filter_by(created_by=current_user.id).update({
-                'organization_id': organization_id
-            })
+            user.is_admin = True
             
+            # Moving the existing records can take a while; run it as a job.
+            # The job commits with the organization, so the move cannot be lost.
+            from jobs import add_job, runner
+            job = add_job('setup_organization', user, {'organizationId': organization_id})
             db.session.commit()
+            try:
+                runner.submit(job.id)
+            except Exception as e:
+                # Still queued: the job sweep submits it later
+                current_app.logger.warning(f"Could not start job {job.id}: {e}")
             
-            flash('Organization setup complete! You are now the admin and can invite other users to share access to your data.', 'success')
+            flash('Organization setup complete! You are now the admin and can invite other users to share access to your data. Your existing records are being moved into the organization in the background.', 'success')
             return redirect(url_for('users.manage_users'))
             
         except Exception as e:
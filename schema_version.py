@@ -0,0 +1,57 @@
+"""Schema version stamp, so a process start can skip the schema checks.
+
+``app.init_database()`` used to run on every process start and on every
+``max_requests`` recycle. Each time it ran ``create_all()``, inspected every
+table, counted the users and printed them. Now a full run ends by stamping
+the version of the model schema into the one-row ``schema_version`` table.
+A start that finds the same version there reads that row and nothing else.
+
+The version is a fingerprint of the tables, columns and indexes declared in
+models.py. Changing the models makes the next start run the full check again.
+``FAST_START=0`` always runs it.
+"""
+import hashlib
+from datetime import datetime
+
+from sqlalchemy import delete, insert, inspect, select
+from sqlalchemy.exc import DBAPIError
+
+from database import db
+from models import SchemaVersion
+
+
+def schema_fingerprint(metadata=None):
+    """A short hash of every table, column and index in ``metadata``"""
+    metadata = metadata if metadata is not None else db.metadata
+    lines = []
+    for table in sorted(metadata.tables.values(), key=lambda table: table.name):
+        lines.append(f'table {table.name}')
+        for column in table.columns:
+            references = ','.join(sorted(key.target_fullname for key in column.foreign_keys))
+            lines.append(f'column {column.name} {column.type} nullable={column.nullable} '
+                         f'primary_key={column.primary_key} references={references}')
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            expressions = ','.join(str(expression) for expression in index.expressions)
+            options = ','.join(f'{name}={value}' for name, value in sorted(index.dialect_kwargs.items()))
+            lines.append(f'index {index.name} unique={index.unique} {expressions} {options}')
+    return hashlib.sha256('\n'.join(lines).encode('utf-8')).hexdigest()[:16]
+
+
+def stamped_version(connection):
+    """The stamped version, or None for a database that has never been stamped.
+    Errors other than a missing table propagate."""
+    try:
+        return connection.execute(select(SchemaVersion.version).where(SchemaVersion.id == 1)).scalar()
+    except DBAPIError:
+        # Only look at the catalog when the one-row read failed
+        connection.rollback()
+        if not inspect(connection).has_table(SchemaVersion.__tablename__):
+            return None
+        raise
+
+
+def stamp(connection, version=None):
+    """Record ``version`` (default: the current models) as checked; the caller commits"""
+    connection.execute(delete(SchemaVersion))
+    connection.execute(insert(SchemaVersion).values(
+        id=1, version=version or schema_fingerprint(), stamped_at=datetime.utcnow()))
@@ -0,0 +1,292 @@
+"""Cross-entity full-text search over leads, accounts, contacts and opportunities.
+
+PostgreSQL: every table has a GIN index on a ``to_tsvector('simple', ...)``
+expression over its searchable columns; queries repeat the exact expression so
+the planner uses the index, and results are ranked with ``ts_rank``.
+
+SQLite (development): every table has an FTS5 shadow table (``<table>_search``)
+kept in sync by triggers so ORM writes, Core bulk inserts and raw SQL all
+update it. Results are ranked with bm25. The FTS rows carry the record's
+``id`` (UNINDEXED) and results join on it, not on the source row's implicit
+rowid, which VACUUM may renumber because the ids are strings. The triggers
+find a record's FTS row through ``<table>_search_keys``, whose INTEGER
+PRIMARY KEY survives VACUUM.
+
+The indexes are created together with their tables (see the DDL events at the
+bottom); databases created before search existed need
+``migrate_add_search_index.py``.
+"""
+import re
+
+from sqlalchemy import event, select, union_all, literal, literal_column, bindparam, table, text, func
+
+from models import Lead, Account, Contact, Opportunity
+
+DEFAULT_PER_PAGE = 20
+MAX_PER_PAGE = 100
+
+# Per entity: title columns (shown as the result title), subtitle columns
+# (shown below it) and body columns (searched but not shown). Title matches
+# rank above subtitle matches, which rank above body matches.
+SEARCH_SPECS = {
+    'leads': {
+        'model': Lead,
+        'title': ('company_name',),
+        'subtitle': ('contact_person', 'email'),
+        'body': ('notes',),
+    },
+    'accounts': {
+        'model': Account,
+        'title': ('company_name',),
+        'subtitle': ('city', 'country'),
+        'body': ('description', 'notes'),
+    },
+    'contacts': {
+        'model': Contact,
+        'title': ('first_name', 'last_name'),
+        'subtitle': ('email',),
+        'body': ('title', 'notes'),
+    },
+    'opportunities': {
+        'model': Opportunity,
+        'title': ('name',),
+        'subtitle': ('sales_stage',),
+        'body': ('next_steps', 'requirements'),
+    },
+}
+
+# bm25() weights for the FTS5 title, subtitle and body columns
+FTS_WEIGHTS = (10.0, 5.0, 1.0)
+
+
+def _searchable(entity):
+    """Extra conditions a row must meet to appear in search results"""
+    if entity == 'leads':
+        # Converted leads live on as accounts, contacts and opportunities
+        return [Lead.is_converted == False]  # noqa: E712
+    return []
+
+
+def _joined(columns, prefix=''):
+    """SQL text joining nullable columns with spaces (valid on both dialects)"""
+    return " || ' ' || ".join(f"coalesce({prefix}{column}, '')" for column in columns)
+
+
+def _document(entity):
+    spec = SEARCH_SPECS[entity]
+    return f"to_tsvector('simple', {_joined(spec['title'] + spec['subtitle'] + spec['body'])})"
+
+
+def search_terms(q):
+    """Split user input into plain word tokens (no query syntax gets through)"""
+    return re.findall(r'[^\W_]+', (q or '').lower())
+
+
+# PostgreSQL ---------------------------------------------------------------
+
+def _pg_index_ddl(entity, concurrently=False):
+    tablename = SEARCH_SPECS[entity]['model'].__tablename__
+    keyword = 'CONCURRENTLY ' if concurrently else ''
+    return (f'CREATE INDEX {keyword}IF NOT EXISTS ix_{tablename}_search '
+            f'ON {tablename} USING gin ({_document(entity)})')
+
+
+def _pg_select(entity, tsquery, conditions):
+    spec = SEARCH_SPECS[entity]
+    model = spec['model']
+    document = literal_column(_document(entity))
+    return (
+        select(
+            literal(entity).label('type'),
+            model.id.label('id'),
+            literal_column(_joined(spec['title'])).label('title'),
+            literal_column(_joined(spec['subtitle'])).label('subtitle'),
+            func.ts_rank(document, tsquery).label('rank'),
+            model.updated_at.label('updated_at'),
+        )
+        .where(document.op('@@')(tsquery), *conditions)
+    )
+
+
+# SQLite -------------------------------------------------------------------
+
+def _fts_name(entity):
+    return f"{SEARCH_SPECS[entity]['model'].__tablename__}_search"
+
+
+def _fts_values(entity, prefix):
+    spec = SEARCH_SPECS[entity]
+    return ', '.join(_joined(spec[part], prefix) for part in ('title', 'subtitle', 'body'))
+
+
+def _fts_ddl(entity):
+    """Statements creating the FTS5 table, its key table and its sync triggers"""
+    tablename = SEARCH_SPECS[entity]['model'].__tablename__
+    fts = _fts_name(entity)
+    keys = f'{fts}_keys'
+    key_of = f'(SELECT key FROM {keys} WHERE id = {{}}.id)'
+    insert_row = (f'INSERT OR IGNORE INTO {keys}(id) VALUES (NEW.id); '
+                  f'INSERT INTO {fts}(rowid, title, subtitle, body, id) '
+                  f"SELECT {key_of.format('NEW')}, {_fts_values(entity, 'NEW.')}, NEW.id")
+    only_open = ' WHERE NEW.is_converted = 0' if entity == 'leads' else ''
+    delete_row = f"DELETE FROM {fts} WHERE rowid = {key_of.format('OLD')}"
+    return [
+        f'CREATE TABLE IF NOT EXISTS {keys} (key INTEGER PRIMARY KEY, id VARCHAR(36) NOT NULL UNIQUE)',
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(title, subtitle, body, id UNINDEXED)',
+        f'CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {tablename} '
+        f'BEGIN {insert_row}{only_open}; END',
+        f'CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {tablename} '
+        f'BEGIN {delete_row}; {insert_row}{only_open}; END',
+        f'CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {tablename} '
+        f'BEGIN {delete_row}; DELETE FROM {keys} WHERE id = OLD.id; END',
+    ]
+
+
+def _fts_rebuild(connection, entity):
+    tablename = SEARCH_SPECS[entity]['model'].__tablename__
+    fts = _fts_name(entity)
+    keys = f'{fts}_keys'
+    only_open = ' WHERE is_converted = 0' if entity == 'leads' else ''
+    connection.exec_driver_sql(f'DELETE FROM {fts}')
+    connection.exec_driver_sql(f'INSERT OR IGNORE INTO {keys}(id) SELECT id FROM {tablename}')
+    connection.exec_driver_sql(
+        f'INSERT INTO {fts}(rowid, title, subtitle, body, id) '
+        f"SELECT {keys}.key, {_fts_values(entity, f'{tablename}.')}, {tablename}.id "
+        f'FROM {tablename} JOIN {keys} ON {keys}.id = {tablename}.id{only_open}'
+    )
+
+
+def _sqlite_select(entity, match, conditions):
+    spec = SEARCH_SPECS[entity]
+    model = spec['model']
+    tablename = model.__tablename__
+    fts = _fts_name(entity)
+    weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+    return (
+        select(
+            literal(entity).label('type'),
+            model.id.label('id'),
+            literal_column(_joined(spec['title'], f'{tablename}.')).label('title'),
+            literal_column(_joined(spec['subtitle'], f'{tablename}.')).label('subtitle'),
+            # bm25 is lower-is-better; negate it so both dialects sort rank DESC
+            literal_column(f'-bm25({fts}, {weights})').label('rank'),
+            model.updated_at.label('updated_at'),
+        )
+        .select_from(model)
+        .join(table(fts), text(f'{fts}.id = {tablename}.id'))
+        .where(literal_column(fts).op('MATCH')(match), *conditions)
+    )
+
+
+# Index maintenance --------------------------------------------------------
+
+def create_search_index(connection, entity, rebuild=False, concurrently=False):
+    """Create the full-text index for one entity on ``connection``'s database"""
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        connection.exec_driver_sql(_pg_index_ddl(entity, concurrently))
+    elif dialect == 'sqlite':
+        if rebuild:
+            # Tables from before the id column are replaced, not altered
+            drop_search_index(connection, entity)
+        for statement in _fts_ddl(entity):
+            connection.exec_driver_sql(statement)
+        if rebuild:
+            _fts_rebuild(connection, entity)
+
+
+def drop_search_index(connection, entity):
+    """Drop the full-text index for one entity (and its sync triggers)"""
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        tablename = SEARCH_SPECS[entity]['model'].__tablename__
+        connection.exec_driver_sql(f'DROP INDEX IF EXISTS ix_{tablename}_search')
+    elif dialect == 'sqlite':
+        fts = _fts_name(entity)
+        for suffix in ('ai', 'au', 'ad'):
+            connection.exec_driver_sql(f'DROP TRIGGER IF EXISTS {fts}_{suffix}')
+        connection.exec_driver_sql(f'DROP TABLE IF EXISTS {fts}')
+        connection.exec_driver_sql(f'DROP TABLE IF EXISTS {fts}_keys')
+
+
+def _register_ddl_events():
+    for entity, spec in SEARCH_SPECS.items():
+        tbl = spec['model'].__table__
+
+        def after_create(target, connection, entity=entity, **kw):
+            create_search_index(connection, entity)
+
+        def before_drop(target, connection, entity=entity, **kw):
+            drop_search_index(connection, entity)
+
+        event.listen(tbl, 'after_create', after_create)
+        event.listen(tbl, 'before_drop', before_drop)
+
+
+_register_ddl_events()
+
+
+# Querying -----------------------------------------------------------------
+
+def search_statement(dialect_name, q, org_filter, entities=None):
+    """Build the ranked UNION ALL over the requested entities, or None if
+    ``q`` has no searchable terms"""
+    terms = search_terms(q)
+    if not terms:
+        return None
+    entities = [e for e in (entities or SEARCH_SPECS) if e in SEARCH_SPECS]
+
+    if dialect_name == 'postgresql':
+        tsquery = func.to_tsquery(literal_column("'simple'"),
+                                  bindparam('q', ' & '.join(f'{term}:*' for term in terms)))
+    elif dialect_name == 'sqlite':
+        match = bindparam('q', ' '.join(f'"{term}"*' for term in terms))
+    else:
+        raise RuntimeError(f'Full-text search is not supported on {dialect_name}')
+
+    selects = []
+    for entity in entities:
+        model = SEARCH_SPECS[entity]['model']
+        conditions = [getattr(model, name) == value for name, value in org_filter.items()]
+        conditions += _searchable(entity)
+        if dialect_name == 'postgresql':
+            selects.append(_pg_select(entity, tsquery, conditions))
+        else:
+            selects.append(_sqlite_select(entity, match, conditions))
+    if not selects:
+        return None
+
+    results = union_all(*selects).subquery('results')
+    return select(results).order_by(results.c.rank.desc(), results.c.updated_at.desc(), results.c.id)
+
+
+def parse_search_args(args):
+    """Return ``(q, entities, page, per_page)`` from request args"""
+    try:
+        page = max(int(args.get('page', 1)), 1)
+        per_page = min(max(int(args.get('per_page', DEFAULT_PER_PAGE)), 1), MAX_PER_PAGE)
+    except (TypeError, ValueError):
+        raise ValueError('page and per_page must be integers')
+    entities = None
+    if args.get('types'):
+        entities = [e.strip() for e in args['types'].split(',') if e.strip()]
+        unknown = [e for e in entities if e not in SEARCH_SPECS]
+        if unknown:
+            raise ValueError(f"Unknown search types: {', '.join(unknown)}")
+    return args.get('q', ''), entities, page, per_page
+
+
+def search(session, q, org_filter, entities=None, page=1, per_page=DEFAULT_PER_PAGE):
+    """Run one page of a search; returns ``(items, has_next)``"""
+    stmt = search_statement(session.get_bind().dialect.name, q, org_filter, entities)
+    if stmt is None:
+        return [], False
+    rows = session.execute(stmt.limit(per_page + 1).offset((page - 1) * per_page)).all()
+    items = [{
+        'type': row.type,
+        'id': row.id,
+        'title': row.title.strip(),
+        'subtitle': row.subtitle.strip(),
+        'rank': float(row.rank),
+    } for row in rows[:per_page]]
+    return items, len(rows) > per_page
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Give leads and opportunities that predate the stage history a starting row
+
+Records created before stage_changes existed (or bulk loaded around the ORM)
+have no history, so the funnel reports would not see them. Each gets one
+row for its current stage, and converted leads a second one for the
+conversion, both dated at the record's last update. Records that already
+have history are left alone, so the script can run on every deploy:
+
+    python seed_stage_history.py
+"""
+import sys
+import os
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app
+from models import db
+
+def seed():
+    """Seed the missing history rows"""
+    from stage_history import seed_missing
+
+    try:
+        db.create_all()
+        written = seed_missing()
+        db.session.commit()
+        print(f"✅ Seeded {written} stage history rows")
+    except Exception as e:
+        print(f"❌ Error seeding stage history: {str(e)}")
+        db.session.rollback()
+        return False
+
+    return True
+
+if __name__ == "__main__":
+    with app.app_context():
+        success = seed()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,157 @@
+"""Fast JSON for the API: row-tuple serialization and an orjson provider.
+
+The list endpoints select only the columns of each model's ``to_dict()``
+(``api_columns``) and turn the result tuples into the same camelCase dicts
+with ``serialize_rows``, instead of building ORM objects and calling
+``to_dict()`` on each one. ``init_app`` installs ``ORJSONProvider`` as
+``app.json`` when orjson is installed. It encodes responses (``jsonify``) and
+compact ``dumps`` calls such as the session cookie's with the same output as
+Flask's default provider: sorted keys, and dates and Decimals passed to
+Flask's default handler. The one exception is non-ASCII text, which is
+written as UTF-8 instead of ``\\u`` escapes.
+"""
+from flask.json.provider import DefaultJSONProvider
+
+from models import Lead, Account, Contact, Opportunity
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speed-up
+    orjson = None
+
+
+def _date(value):
+    return value.isoformat() if value else None
+
+
+def _amount(value):
+    return float(value) if value else None
+
+
+# Fields of each model's to_dict(), in order: (key, column, formatter)
+API_FIELDS = {
+    Lead: (
+        ('id', Lead.id, None),
+        ('companyName', Lead.company_name, None),
+        ('contactPerson', Lead.contact_person, None),
+        ('email', Lead.email, None),
+        ('phone', Lead.phone, None),
+        ('source', Lead.source, None),
+        ('stage', Lead.stage, None),
+        ('notes', Lead.notes, None),
+        ('isConverted', Lead.is_converted, None),
+        ('createdDate', Lead.created_date, _date),
+    ),
+    Account: (
+        ('id', Account.id, None),
+        ('companyName', Account.company_name, None),
+        ('addressLine1', Account.address_line1, None),
+        ('addressLine2', Account.address_line2, None),
+        ('city', Account.city, None),
+        ('provinceState', Account.province_state, None),
+        ('postalZipCode', Account.postal_zip_code, None),
+        ('country', Account.country, None),
+        ('description', Account.description, None),
+        ('notes', Account.notes, None),
+        ('accountPlanningFields', Account.account_planning_fields, None),
+        ('createDate', Account.create_date, _date),
+    ),
+    Contact: (
+        ('id', Contact.id, None),
+        ('firstName', Contact.first_name, None),
+        ('lastName', Contact.last_name, None),
+        ('email', Contact.email, None),
+        ('phone', Contact.phone, None),
+        ('title', Contact.title, None),
+        ('notes', Contact.notes, None),
+        ('accountId', Contact.account_id, None),
+        ('trainingReceived', Contact.training_received, None),
+        ('lastContact', Contact.last_contact, _date),
+        ('createDate', Contact.create_date, _date),
+    ),
+    Opportunity: (
+        ('id', Opportunity.id, None),
+        ('name', Opportunity.name, None),
+        ('salesStage', Opportunity.sales_stage, None),
+        ('forecast', Opportunity.forecast, None),
+        ('amount', Opportunity.amount, _amount),
+        ('companyId', Opportunity.company_id, None),
+        ('contactId', Opportunity.contact_id, None),
+        ('nextSteps', Opportunity.next_steps, None),
+        ('closeDate', Opportunity.close_date, _date),
+        ('contractDate', Opportunity.contract_date, _date),
+        ('requirements', Opportunity.requirements, None),
+        ('createdDate', Opportunity.created_date, _date),
+    ),
+}
+
+_KEYS = {model: tuple(key for key, _, _ in fields) for model, fields in API_FIELDS.items()}
+_FORMATTERS = {
+    model: tuple((key, index, formatter)
+                 for index, (key, _, formatter) in enumerate(fields) if formatter)
+    for model, fields in API_FIELDS.items()
+}
+
+
+def api_columns(model):
+    """Columns to select for ``serialize_rows``; ``updated_at`` is appended
+    last for the keyset cursor and is not serialized"""
+    return [column for _, column, _ in API_FIELDS[model]] + [model.updated_at]
+
+
+def serialize_rows(model, rows):
+    """Turn rows selected with ``api_columns`` into ``to_dict()``-shaped dicts"""
+    keys = _KEYS[model]
+    formatters = _FORMATTERS[model]
+    items = []
+    for row in rows:
+        # zip stops at the last key, dropping the trailing updated_at
+        item = dict(zip(keys, row))
+        for key, index, formatter in formatters:
+            item[key] = formatter(row[index])
+        items.append(item)
+    return items
+
+
+_COMPACT = (',', ':')
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    """``app.json`` backed by orjson wherever its output is identical"""
+
+    def _encode(self, obj, sort_keys, indent=False, newline=False):
+        # Dates, datetimes and Decimals fall through to Flask's default()
+        # (HTTP dates and str(decimal)), exactly as with the json module
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if newline:
+            option |= orjson.OPT_APPEND_NEWLINE
+        return orjson.dumps(obj, default=self.default, option=option)
+
+    def dumps(self, obj, **kwargs):
+        # orjson only writes compact JSON; the json module's default ", "
+        # separators and options such as cls or indent are left to it
+        if kwargs.get('separators') != _COMPACT or not {'separators', 'sort_keys'}.issuperset(kwargs):
+            return super().dumps(obj, **kwargs)
+        return self._encode(obj, kwargs.get('sort_keys', self.sort_keys)).decode()
+
+    def loads(self, s, **kwargs):
+        # e.g. the session serializer passes object_hook to untag values
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(
+            self._encode(obj, self.sort_keys, indent, newline=True), mimetype=self.mimetype
+        )
+
+
+def init_app(app):
+    if orjson is not None:
+        app.json = ORJSONProvider(app)
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Roll the current pipeline up into today's pipeline_snapshots rows
+
+Meant to run once a day from a scheduler (cron, an Azure WebJob), e.g.
+shortly before midnight UTC:
+
+    55 23 * * * cd /home/site/wwwroot && python snapshot_pipeline.py
+
+Each run replaces the rows of its date, so a retried run does not double
+count. A snapshot can only record the pipeline as it is now; --date only
+labels it (e.g. a run just after midnight recording the previous day):
+
+    python snapshot_pipeline.py --date 2025-06-30
+"""
+import sys
+import os
+import argparse
+from datetime import datetime
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app
+from models import db
+
+def snapshot(day=None):
+    """Write the snapshot rows of ``day`` (default today, UTC)"""
+    from reports import snapshot_pipeline
+
+    try:
+        written = snapshot_pipeline(db.session, day)
+        db.session.commit()
+        print(f"✅ Wrote {written} pipeline snapshot rows for {day or datetime.utcnow().date()}")
+    except Exception as e:
+        print(f"❌ Error writing pipeline snapshot: {str(e)}")
+        db.session.rollback()
+        return False
+
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Write the daily pipeline snapshot')
+    parser.add_argument('--date', type=lambda value: datetime.strptime(value, '%Y-%m-%d').date(),
+                        help='snapshot date (YYYY-MM-DD, default today in UTC)')
+    args = parser.parse_args()
+
+    with app.app_context():
+        success = snapshot(args.date)
+    sys.exit(0 if success else 1)
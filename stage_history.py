@@ -0,0 +1,110 @@
+"""Append-only history of lead and opportunity stage transitions.
+
+Every insert of a Lead or Opportunity, every change of ``Lead.stage`` or
+``Opportunity.sales_stage`` and every lead conversion adds a ``StageChange``
+row in the same flush, so the history commits or rolls back with the change
+itself. Funnel and velocity reports (analytics.py) aggregate these rows in
+SQL.
+
+Core inserts bypass the ORM events and must call ``record_changes``
+themselves (see conversion.py and importers.py). ``seed_missing`` gives
+records that predate the table, or were bulk loaded, one row for their
+current stage.
+"""
+from datetime import datetime
+
+from sqlalchemy import event, exists, inspect, insert, literal, null, select, union_all
+
+from database import db
+from models import Lead, Opportunity, StageChange
+
+# entity name and stage column of every model with a stage
+STAGED_MODELS = {
+    Lead: ('leads', 'stage'),
+    Opportunity: ('opportunities', 'sales_stage'),
+}
+CONVERTED = 'Converted'
+
+
+def change_row(entity, record_id, from_stage, to_stage, organization_id, created_by, changed_at=None):
+    """Column values of one StageChange"""
+    return {
+        'entity': entity, 'record_id': record_id,
+        'from_stage': from_stage, 'to_stage': to_stage,
+        'organization_id': organization_id, 'created_by': created_by,
+        'changed_at': changed_at or datetime.utcnow(),
+    }
+
+
+def record_changes(connection, rows):
+    """Insert change_row() values with one executemany statement"""
+    if rows:
+        connection.execute(insert(StageChange.__table__), rows)
+
+
+def seed_missing(connection=None):
+    """Give every lead and opportunity without history a row for its current
+    stage (and converted leads their conversion), dated at its last update.
+    Returns the number of rows written; the caller commits."""
+    connection = connection or db.session.connection()
+    written = 0
+    for model, (entity, stage_name) in STAGED_MODELS.items():
+        stage = getattr(model, stage_name)
+        has_history = exists().where(StageChange.entity == entity, StageChange.record_id == model.id)
+        source = select(literal(entity), model.id, null(), stage,
+                        model.organization_id, model.created_by, model.updated_at
+                        ).where(stage.is_not(None), ~has_history)
+        if model is Lead:
+            # One statement, so the NOT EXISTS sees neither half's rows
+            source = union_all(source, select(
+                literal(entity), Lead.id, Lead.stage, literal(CONVERTED),
+                Lead.organization_id, Lead.created_by, Lead.updated_at,
+            ).where(Lead.is_converted == True, ~has_history))  # noqa: E712
+        written += connection.execute(insert(StageChange).from_select(
+            ['entity', 'record_id', 'from_stage', 'to_stage',
+             'organization_id', 'created_by', 'changed_at'], source)).rowcount
+    return written
+
+
+def _old_value(state, name):
+    history = state.attrs[name].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(state.obj(), name)
+
+
+def _track_old_value(target, value, oldvalue, initiator):
+    return value
+
+
+def _after_insert(mapper, connection, target):
+    entity, stage_name = STAGED_MODELS[type(target)]
+    stage = getattr(target, stage_name)
+    if stage is not None:
+        record_changes(connection, [change_row(entity, target.id, None, stage,
+                                               target.organization_id, target.created_by)])
+
+
+def _after_update(mapper, connection, target):
+    entity, stage_name = STAGED_MODELS[type(target)]
+    state = inspect(target)
+    rows = []
+    stage, old_stage = getattr(target, stage_name), _old_value(state, stage_name)
+    if stage != old_stage and stage is not None:
+        rows.append(change_row(entity, target.id, old_stage, stage,
+                               target.organization_id, target.created_by))
+    if type(target) is Lead and target.is_converted and _old_value(state, 'is_converted') is False:
+        rows.append(change_row(entity, target.id, stage, CONVERTED,
+                               target.organization_id, target.created_by))
+    record_changes(connection, rows)
+
+
+for _model, (_entity, _stage_name) in STAGED_MODELS.items():
+    event.listen(_model, 'after_insert', _after_insert)
+    event.listen(_model, 'after_update', _after_update)
+    # active_history loads the previous value even when the attribute was
+    # expired (e.g. by a commit) before being set, so the history has it
+    for _name in (_stage_name, 'is_converted'):
+        if hasattr(_model, _name):
+            event.listen(getattr(_model, _name), 'set', _track_old_value,
+                         active_history=True, retval=True)
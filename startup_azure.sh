@@ -97,6 +97,23 @@ if [ -f "migrate_add_amount.py" ]; then
 else
     log "⚠️  Migration file not found, skipping..."
 fi
+if [ -f "migrate_forecast_probability.py" ]; then
+    python migrate_forecast_probability.py
+    check_success "Forecast probability migration"
+fi
+# Backfills NULL updated_at, which keyset pagination and the stage history seed rely on
+if [ -f "migrate_add_indexes.py" ]; then
+    python migrate_add_indexes.py
+    check_success "Index migration"
+fi
+if [ -f "migrate_add_search_index.py" ]; then
+    python migrate_add_search_index.py
+    check_success "Search index migration"
+fi
+if [ -f "seed_stage_history.py" ]; then
+    python seed_stage_history.py
+    check_success "Stage history seed"
+fi
 
 # Initialize database tables and data
 log "🏗️  Initializing database tables and data..."
@@ -0,0 +1,56 @@
+"""Where process start-up time goes.
+
+app.py times its imports and initialization in named phases. With
+``STARTUP_PROFILE=1``, it prints the phases, nested as they ran, with their
+share of the total once it has finished importing:
+
+    STARTUP_PROFILE=1 python -c "import app"
+
+``python -X importtime -c "import app"`` breaks the import phases down by
+module.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+# Imported first by app.py, so this is where the app's start-up begins
+STARTED = time.perf_counter()
+
+# (depth, name, seconds), in the order the phases started
+phases = []
+_depth = 0
+
+
+def enabled():
+    return os.getenv('STARTUP_PROFILE', '0') == '1'
+
+
+@contextmanager
+def phase(name):
+    """Time the ``with`` block as phase ``name``"""
+    global _depth
+    entry = [_depth, name, None]
+    phases.append(entry)
+    _depth += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        entry[2] = time.perf_counter() - start
+        _depth -= 1
+
+
+def report(out=print):
+    """Print every finished phase with its time and share of the total"""
+    total = time.perf_counter() - STARTED
+    out(f"⏱️  Startup profile: {total * 1000:.1f} ms since app.py started importing")
+    accounted = 0.0
+    for depth, name, seconds in phases:
+        if seconds is None:
+            continue
+        if depth == 0:
+            accounted += seconds
+        label = '  ' * depth + name
+        out(f"   {label:<40} {seconds * 1000:9.1f} ms {seconds / total:6.1%}")
+    other = total - accounted
+    out(f"   {'(other)':<40} {other * 1000:9.1f} ms {other / total:6.1%}")
@@ -0,0 +1,228 @@
+"""Incremental sync for the /api list endpoints (``?since=<token>``).
+
+A client starts with ``?since=`` (empty) and then passes back the
+``next_since`` token of every response. It gets the records whose
+``updated_at`` moved past the token, in ``(updated_at, id)`` order, and the
+ids of records that left its scope. A record leaves a scope when it is
+deleted, moved to another organization or owner, or (for leads) converted.
+With ``has_more`` set, the client asks again at once. Each batch is one range
+scan of the ``(scope, updated_at, id)`` index plus one of the tombstone
+index, so a sync costs time in proportion to the changes, not the tenant.
+
+Deletes and moves made through the ORM write a ``Tombstone`` row with the
+record's old owner columns. Bulk statements that move records to another
+organization must call ``tombstone_moved`` first. Changes newer than
+``SYNC_LAG_SECONDS`` are held back until the next poll, so a transaction
+that flushed before the read but commits after it is not skipped. A token
+is bound to the scope that received it. Once a token is older than
+``SYNC_TOMBSTONE_DAYS``, its tombstones may have been purged (see
+purge_tombstones.py). Either case raises ``ExpiredSyncToken``, and the
+client starts again from an empty token.
+"""
+import base64
+import hashlib
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, event, exists, false, inspect, insert, literal, or_, select, true
+
+from database import db
+from models import Lead, Account, Contact, Opportunity, Tombstone
+from serializers import api_columns, serialize_rows
+
+SYNCED_MODELS = {
+    Lead: 'leads',
+    Account: 'accounts',
+    Contact: 'contacts',
+    Opportunity: 'opportunities',
+}
+# Rows still in scope that the list no longer shows; reported as deleted
+REMOVED = {
+    Lead: Lead.is_converted,
+}
+DEFAULT_LAG_SECONDS = 5
+DEFAULT_RETENTION_DAYS = 30
+
+
+class InvalidSyncToken(ValueError):
+    """Raised when a client sends a since token we did not issue"""
+
+
+class ExpiredSyncToken(Exception):
+    """The token belongs to another scope or predates the tombstone retention"""
+
+
+def scope_key(org_filter):
+    """Short stable id of a get_organization_filter() scope"""
+    return hashlib.sha1(json.dumps(sorted(org_filter.items())).encode()).hexdigest()[:12]
+
+
+def _encode_position(position):
+    return None if position is None else [position[0].isoformat(), position[1]]
+
+
+def _decode_position(value):
+    if value is None:
+        return None
+    moment, key = value
+    return datetime.fromisoformat(moment), key
+
+
+def encode_token(scope, records, tombstones):
+    """Token for resuming after the ``(updated_at, id)`` and ``(deleted_at, id)`` positions"""
+    payload = json.dumps({'s': scope, 'r': _encode_position(records),
+                          'd': _encode_position(tombstones)}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_token(token, scope, oldest):
+    """Return ``(records, tombstones)`` positions; empty token means from the start"""
+    if not token:
+        return None, None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        records, tombstones = _decode_position(payload['r']), _decode_position(payload['d'])
+        token_scope = payload['s']
+    except (ValueError, TypeError, KeyError, UnicodeError) as e:
+        raise InvalidSyncToken(f'Invalid since token: {token}') from e
+    if token_scope != scope:
+        raise ExpiredSyncToken('since token was issued for another scope')
+    if any(position and position[0] < oldest for position in (records, tombstones)):
+        raise ExpiredSyncToken('since token is older than the tombstone retention')
+    return records, tombstones
+
+
+def _after(moment_column, key_column, position):
+    """Rows strictly after ``position``; a None key means after the whole instant"""
+    if position is None:
+        return true()
+    moment, key = position
+    if key is None:
+        return moment_column > moment
+    return or_(moment_column > moment, and_(moment_column == moment, key_column > key))
+
+
+def _scope_criteria(model, org_filter):
+    return [getattr(model, name) == value for name, value in org_filter.items()]
+
+
+def records_statement(model, org_filter, position, horizon, limit):
+    """Records of the scope changed after ``position``, up to ``horizon``"""
+    removed = REMOVED.get(model)
+    columns = api_columns(model) + ([removed] if removed is not None else [])
+    return (select(*columns)
+            .where(*_scope_criteria(model, org_filter), model.updated_at <= horizon,
+                   _after(model.updated_at, model.id, position))
+            .order_by(model.updated_at, model.id)
+            .limit(limit))
+
+
+def tombstones_statement(model, org_filter, position, horizon, limit):
+    """Tombstones of the scope after ``position`` whose record is not back in it"""
+    removed = REMOVED.get(model)
+    live = exists().where(model.id == Tombstone.record_id, *_scope_criteria(model, org_filter),
+                          removed == false() if removed is not None else true())
+    return (select(Tombstone.id, Tombstone.record_id, Tombstone.deleted_at)
+            .where(Tombstone.entity == SYNCED_MODELS[model],
+                   *_scope_criteria(Tombstone, org_filter), Tombstone.deleted_at <= horizon,
+                   _after(Tombstone.deleted_at, Tombstone.id, position), ~live)
+            .order_by(Tombstone.deleted_at, Tombstone.id)
+            .limit(limit))
+
+
+def changes(model, org_filter, token, limit, lag=DEFAULT_LAG_SECONDS,
+            retention_days=DEFAULT_RETENTION_DAYS, now=None):
+    """One batch of changes to ``model`` in the scope after ``token``.
+
+    Returns ``{items, deleted, next_since, has_more}``. Raises InvalidSyncToken
+    or ExpiredSyncToken.
+    """
+    now = now or datetime.utcnow()
+    horizon = now - timedelta(seconds=lag)
+    scope = scope_key(org_filter)
+    records_at, tombstones_at = decode_token(token, scope, now - timedelta(days=retention_days))
+    removed = REMOVED.get(model)
+
+    rows = db.session.execute(
+        records_statement(model, org_filter, records_at, horizon, limit + 1)).all()
+    more_records = len(rows) > limit
+    rows = rows[:limit]
+
+    tombstones = db.session.execute(
+        tombstones_statement(model, org_filter, tombstones_at, horizon, limit + 1)).all()
+    more_tombstones = len(tombstones) > limit
+    tombstones = tombstones[:limit]
+
+    kept = [row for row in rows if removed is None or not row[-1]]
+    deleted = [row.id for row in rows if removed is not None and row[-1]]
+    deleted.extend(tombstone.record_id for tombstone in tombstones)
+
+    # A fully read stream resumes after the horizon, not after its last row
+    if more_records:
+        records_at = (rows[-1].updated_at, rows[-1].id)
+    elif records_at is None or records_at[0] < horizon:
+        records_at = (horizon, None)
+    if more_tombstones:
+        tombstones_at = (tombstones[-1].deleted_at, tombstones[-1].id)
+    elif tombstones_at is None or tombstones_at[0] < horizon:
+        tombstones_at = (horizon, None)
+
+    return {
+        'items': serialize_rows(model, kept),
+        'deleted': deleted,
+        'next_since': encode_token(scope, records_at, tombstones_at),
+        'has_more': more_records or more_tombstones,
+    }
+
+
+def tombstone_moved(model, criteria, organization_id):
+    """Record tombstones for rows matching ``criteria`` that a bulk update is
+    about to move from another organization to ``organization_id``"""
+    source = select(
+        literal(SYNCED_MODELS[model]), model.id, model.organization_id, model.created_by,
+        literal(datetime.utcnow()),
+    ).where(*criteria, model.organization_id.is_not(None),
+            model.organization_id != organization_id)
+    db.session.execute(insert(Tombstone).from_select(
+        ['entity', 'record_id', 'organization_id', 'created_by', 'deleted_at'], source))
+
+
+def purge_tombstones(retention_days=DEFAULT_RETENTION_DAYS, now=None):
+    """Delete tombstones older than the retention; returns how many"""
+    cutoff = (now or datetime.utcnow()) - timedelta(days=retention_days)
+    deleted = Tombstone.query.filter(Tombstone.deleted_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+def _old_value(state, name):
+    history = state.attrs[name].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(state.obj(), name)
+
+
+def _write_tombstone(connection, target, organization_id, created_by):
+    connection.execute(insert(Tombstone).values(
+        entity=SYNCED_MODELS[type(target)], record_id=target.id,
+        organization_id=organization_id, created_by=created_by, deleted_at=datetime.utcnow(),
+    ))
+
+
+def _before_delete(mapper, connection, target):
+    state = inspect(target)
+    _write_tombstone(connection, target, _old_value(state, 'organization_id'),
+                     _old_value(state, 'created_by'))
+
+
+def _after_update(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[name].history.has_changes() for name in ('organization_id', 'created_by')):
+        _write_tombstone(connection, target, _old_value(state, 'organization_id'),
+                         _old_value(state, 'created_by'))
+
+
+for _model in SYNCED_MODELS:
+    event.listen(_model, 'after_update', _after_update)
+    event.listen(_model, 'before_delete', _before_delete)
@@ -2,6 +2,8 @@
 import unittest
 import tempfile
 import os
+import shutil
+import io
 from app import app
 from database import db
 from models import User, Lead, Account, Contact, Opportunity
@@ -14,9 +16,12 @@ class CRMTestCase(unittest.TestCase):
     def setUp(self):
         """Set up test fixtures"""
         self.db_fd, app.config['DATABASE_URL'] = tempfile.mkstemp()
+        app.config['JOB_SPOOL_DIR'] = tempfile.mkdtemp()
         app.config['TESTING'] = True
         app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + app.config['DATABASE_URL']
         app.config['WTF_CSRF_ENABLED'] = False
+        # Log N+1 suspects and fail any request over its @query_budget
+        app.config['SQL_DEBUG'] = True
         self.app = app.test_client()
         
         with app.app_context():
@@ -36,11 +41,14 @@ class CRMTestCase(unittest.TestCase):
 
     def tearDown(self):
         """Clean up after tests"""
+        from jobs import runner
+        runner.wait()  # background jobs still use the database
         with app.app_context():
             db.session.remove()
             db.drop_all()
         os.close(self.db_fd)
         os.unlink(app.config['DATABASE_URL'])
+        shutil.rmtree(app.config['JOB_SPOOL_DIR'])
 
     def login(self, username='testuser', password='testpass'):
         """Helper method to login"""
@@ -120,6 +128,1274 @@ class CRMTestCase(unittest.TestCase):
         assert len(data) > 0
         assert any(lead['companyName'] == 'Test Lead Company' for lead in data)
 
+    def test_get_leads_cursor_pagination(self):
+        """Test walking the leads API with limit/cursor"""
+        self.login()
+        
+        with app.app_context():
+            for i in range(5):
+                db.session.add(Lead(
+                    company_name=f'Paged Company {i}',
+                    contact_person='Page Person',
+                    email=f'page{i}@example.com',
+                    created_by=self.user_id
+                ))
+            db.session.commit()
+        
+        seen = []
+        cursor = None
+        while True:
+            url = '/api/leads?limit=2' + (f'&cursor={cursor}' if cursor else '')
+            rv = self.app.get(url)
+            assert rv.status_code == 200
+            data = json.loads(rv.data)
+            assert len(data['items']) <= 2
+            seen.extend(lead['id'] for lead in data['items'])
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+        
+        assert len(seen) == 5
+        assert len(set(seen)) == 5
+        
+        rv = self.app.get('/api/leads?cursor=not-a-cursor')
+        assert rv.status_code == 400
+
+    def test_leads_page_server_side_paging(self):
+        """Test search, stage filter and paging on the leads page"""
+        self.login()
+        
+        with app.app_context():
+            for i in range(30):
+                db.session.add(Lead(
+                    company_name=f'Listed Company {i:02d}',
+                    contact_person=f'Person {i:02d}',
+                    email=f'listed{i}@example.com',
+                    stage='SQL' if i % 3 == 0 else 'MQL',
+                    created_by=self.user_id
+                ))
+            db.session.commit()
+        
+        rv = self.app.get('/leads?sort=company&dir=asc')
+        assert rv.status_code == 200
+        assert b'Listed Company 00' in rv.data
+        assert b'Listed Company 29' not in rv.data
+        assert b'page=2' in rv.data
+        
+        rv = self.app.get('/leads?sort=company&dir=asc&page=2')
+        assert b'Listed Company 29' in rv.data
+        assert b'Listed Company 00' not in rv.data
+        
+        rv = self.app.get('/leads?q=listed+company+1&stage=SQL')
+        assert b'Listed Company 12' in rv.data
+        assert b'Listed Company 13' not in rv.data
+        assert b'Listed Company 03' not in rv.data
+        
+        for page in ('/accounts', '/contacts', '/opportunities', '/accounts?sort=bogus&page=x'):
+            assert self.app.get(page).status_code == 200
+
+    def test_index_advisor_finds_no_sequential_scans(self):
+        """Test that every known query shape is served by an index"""
+        from index_advisor import run_advisor
+        
+        with app.app_context():
+            results = run_advisor()
+        
+        assert results
+        flagged = [r['query'] for r in results if r['sequential_scans']]
+        assert flagged == []
+
+    def test_index_migration_recreates_changed_indexes(self):
+        """Test that the index migration replaces same-named indexes whose definition changed"""
+        import contextlib
+        from sqlalchemy import text
+        from migrate_add_indexes import migrate_add_indexes
+
+        def definition():
+            with db.engine.connect() as conn:
+                return conn.execute(text("SELECT sql FROM sqlite_master WHERE name = 'ix_leads_org_updated'")).scalar()
+
+        with app.app_context():
+            # The full index an earlier migration created under this name
+            with db.engine.begin() as conn:
+                conn.execute(text('DROP INDEX ix_leads_org_updated'))
+                conn.execute(text('CREATE INDEX ix_leads_org_updated ON leads (organization_id, updated_at, id)'))
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                assert migrate_add_indexes()
+            assert 'Recreated index ix_leads_org_updated' in output.getvalue()
+            assert 'WHERE organization_id IS NOT NULL' in definition()
+
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                assert migrate_add_indexes()
+            assert 'Recreat' not in output.getvalue()
+
+    def test_dashboard_counters_follow_writes(self):
+        """Test that the record counters track inserts, updates and deletes"""
+        from counters import get_counts, count_scope, recount_all, user_scope
+        
+        with app.app_context():
+            user = db.session.get(User, self.user_id)
+            assert get_counts(user) == {'leads': 0, 'accounts': 0, 'contacts': 0, 'opportunities': 0}
+            
+            leads = [Lead(company_name=f'Counted {i}', contact_person='Count Person',
+                          email=f'count{i}@example.com', created_by=self.user_id)
+                     for i in range(3)]
+            account = Account(company_name='Counted Account', created_by=self.user_id)
+            db.session.add_all(leads + [account])
+            db.session.commit()
+            assert get_counts(user)['leads'] == 3
+            assert get_counts(user)['accounts'] == 1
+            
+            leads[0].is_converted = True
+            db.session.delete(leads[1])
+            db.session.delete(account)
+            db.session.commit()
+            
+            counts = get_counts(user)
+            assert counts['leads'] == 1
+            assert counts['accounts'] == 0
+            assert counts == count_scope(user_scope(self.user_id))
+            
+            recount_all()
+            assert get_counts(user) == counts
+        
+        self.login()
+        rv = self.app.get('/')
+        assert rv.status_code == 200
+
+    def test_dashboard_counter_row_built_once(self):
+        """Test that a missing counter row is built with one lookup and survives a concurrent build"""
+        from unittest import mock
+        from sqlalchemy import event
+        import counters
+        from counters import get_counts, user_scope
+        from models import RecordCounter
+
+        with app.app_context():
+            user = db.session.get(User, self.user_id)
+            db.session.add(Lead(company_name='Raced', contact_person='Ray Sed',
+                                email='ray@example.com', created_by=self.user_id))
+            db.session.commit()
+            RecordCounter.query.delete()
+            db.session.commit()
+
+            statements = []
+            listener = lambda *args: statements.append(args[2])
+            event.listen(db.engine, 'before_cursor_execute', listener)
+            try:
+                assert get_counts(user)['leads'] == 1
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', listener)
+            assert sum('FROM record_counters' in s for s in statements) == 1
+
+            # Another request inserts the row between the lookup and the commit
+            RecordCounter.query.delete()
+            db.session.commit()
+            count_scope = counters.count_scope
+            def racing_count(scope):
+                with db.engine.begin() as conn:
+                    conn.execute(RecordCounter.__table__.insert().values(
+                        scope=scope, leads=7, accounts=0, contacts=0, opportunities=0))
+                return count_scope(scope)
+            with mock.patch.object(counters, 'count_scope', racing_count):
+                assert get_counts(user)['leads'] == 7
+            assert db.session.get(RecordCounter, user_scope(self.user_id)).leads == 7
+
+    def test_streaming_exports(self):
+        """Test CSV and NDJSON exports stream every scoped record"""
+        self.login()
+        
+        with app.app_context():
+            for i in range(5):
+                db.session.add(Lead(
+                    company_name=f'Export Company {i}',
+                    contact_person=f'Export Person {i}',
+                    email=f'export{i}@example.com',
+                    created_by=self.user_id
+                ))
+            db.session.commit()
+        
+        from exporters import iter_csv
+        with app.app_context():
+            chunks = list(iter_csv('leads', {'created_by': self.user_id}, batch_size=2))
+            reported = []
+            def edit_written_row(done):
+                reported.append(done)
+                if done == 2:
+                    Lead.query.order_by(Lead.id).first().phone = '555-0100'
+                    db.session.commit()
+            paged = list(iter_csv('leads', {'created_by': self.user_id}, batch_size=2,
+                                  paged=True, progress=edit_written_row))
+        assert len(chunks) == 4  # header + three batches
+        # One query per batch gives the same file, and a row edited after it
+        # was written is not written again
+        assert paged == chunks and reported == [2, 4, 5]
+        
+        rv = self.app.get('/leads/export')
+        assert rv.status_code == 200
+        assert rv.mimetype == 'text/csv'
+        lines = rv.data.decode().strip().splitlines()
+        assert lines[0] == 'Contact Person,Company,Email,Phone,Stage,Created Date'
+        assert len(lines) == 6
+        
+        rv = self.app.get('/export/leads.ndjson')
+        assert rv.status_code == 200
+        rows = [json.loads(line) for line in rv.data.decode().splitlines()]
+        assert len(rows) == 5
+        assert rows[0]['companyName'].startswith('Export Company')
+        
+        assert self.app.get('/export/opportunities.csv').status_code == 200
+        assert self.app.get('/export/users.csv').status_code == 404
+
+    def test_bulk_import_leads(self):
+        """Test CSV lead import with batching and a per-row error report"""
+        self.login()
+        
+        rows = ['Company Name,Contact Person,Email,Phone,Stage']
+        for i in range(7):
+            rows.append(f'Import Co {i},Importer {i},import{i}@example.com,555-000{i},SAL')
+        rows.append('Bad Co,Bad Person,not-an-email,,MQL')
+        rows.append('No Person Co,,nobody@example.com,,XYZ')
+        csv_data = '\n'.join(rows) + '\n'
+        
+        rv = self.app.post('/api/leads/import?batch_size=3',
+                           data={'file': (io.BytesIO(csv_data.encode()), 'leads.csv')},
+                           content_type='multipart/form-data')
+        assert rv.status_code == 200
+        report = json.loads(rv.data)
+        assert report['total'] == 9
+        assert report['inserted'] == 7
+        assert [error['row'] for error in report['errors']] == [9, 10]
+        assert len(report['errors'][1]['errors']) == 2
+        
+        with app.app_context():
+            assert Lead.query.filter_by(created_by=self.user_id, stage='SAL').count() == 7
+            from counters import get_counts
+            assert get_counts(db.session.get(User, self.user_id))['leads'] == 7
+        
+        rv = self.app.post('/api/leads/import', data='email\nx@example.com\n',
+                           content_type='text/csv')
+        assert rv.status_code == 400
+
+    def test_batch_convert_leads(self):
+        """Test converting several leads at once without double conversion"""
+        self.login()
+        
+        with app.app_context():
+            from counters import get_counts
+            user = db.session.get(User, self.user_id)
+            get_counts(user)
+            leads = [Lead(company_name=f'Batch Co {i}', contact_person=f'Batch Person{i}',
+                          email=f'batch{i}@example.com', stage='SQL', created_by=self.user_id)
+                     for i in range(3)]
+            db.session.add_all(leads)
+            db.session.commit()
+            lead_ids = [lead.id for lead in leads]
+        
+        rv = self.app.post('/api/leads/convert',
+                           data=json.dumps({'leadIds': lead_ids[:2] + ['missing-id'],
+                                            'options': {'forecast': '10%'}}),
+                           content_type='application/json')
+        assert rv.status_code == 200
+        data = json.loads(rv.data)
+        assert sorted(c['leadId'] for c in data['converted']) == sorted(lead_ids[:2])
+        assert data['converted'][0]['opportunity']['forecast'] == '10%'
+        assert data['converted'][0]['opportunity']['contactId'] == data['converted'][0]['contact']['id']
+        assert data['skipped'] == [{'leadId': 'missing-id', 'reason': 'not_found'}]
+        
+        # Converting again only claims the lead that is still open
+        rv = self.app.post('/api/leads/convert', data=json.dumps({'leadIds': lead_ids}),
+                           content_type='application/json')
+        data = json.loads(rv.data)
+        assert [c['leadId'] for c in data['converted']] == [lead_ids[2]]
+        assert {s['reason'] for s in data['skipped']} == {'already_converted'}
+        
+        rv = self.app.post(f'/api/leads/{lead_ids[0]}/convert')
+        assert rv.status_code == 400
+        
+        with app.app_context():
+            assert Account.query.filter(Account.company_name.like('Batch Co %')).count() == 3
+            counts = get_counts(db.session.get(User, self.user_id))
+            assert counts['leads'] == 0
+            assert counts['opportunities'] == 3
+        
+        rv = self.app.post('/api/leads/convert', data=json.dumps({'leadIds': []}),
+                           content_type='application/json')
+        assert rv.status_code == 400
+
+    def test_full_text_search(self):
+        """Test ranked cross-entity search scoped to the user"""
+        self.login()
+        
+        with app.app_context():
+            other = User(username='searchother', email='other@example.com',
+                         first_name='Other', last_name='User')
+            other.set_password('pw')
+            db.session.add(other)
+            db.session.flush()
+            account = Account(company_name='Zephyr Widgets', city='Oslo', created_by=self.user_id)
+            db.session.add(account)
+            db.session.flush()
+            db.session.add_all([
+                Contact(first_name='Greta', last_name='Zephyrson', email='greta@example.com',
+                        account_id=account.id, created_by=self.user_id),
+                Lead(company_name='Acme', contact_person='Zed Smith', email='zed@example.com',
+                     notes='met at the zephyr expo', created_by=self.user_id),
+                Lead(company_name='Zephyr Hidden', contact_person='Not Mine',
+                     email='hidden@example.com', created_by=other.id),
+            ])
+            db.session.commit()
+            account_id = account.id
+        
+        rv = self.app.get('/api/search?q=zeph')
+        assert rv.status_code == 200
+        data = json.loads(rv.data)
+        # Title matches rank above the lead that only mentions it in its notes
+        assert {item['type'] for item in data['items'][:2]} == {'accounts', 'contacts'}
+        assert data['items'][2]['type'] == 'leads'
+        assert {'id': account_id, 'title': 'Zephyr Widgets'}.items() <= \
+            next(item for item in data['items'] if item['type'] == 'accounts').items()
+        
+        rv = self.app.get('/api/search?q=zeph&types=contacts,leads&per_page=1')
+        data = json.loads(rv.data)
+        assert data['items'][0]['type'] == 'contacts' and data['has_next']
+        
+        # Index follows updates
+        with app.app_context():
+            db.session.get(Account, account_id).company_name = 'Renamed Widgets'
+            db.session.commit()
+        data = json.loads(self.app.get('/api/search?q=renamed').data)
+        assert [item['id'] for item in data['items']] == [account_id]
+        
+        assert json.loads(self.app.get('/api/search?q=%22*').data)['items'] == []
+        assert self.app.get('/api/search?q=x&types=bogus').status_code == 400
+        
+        # VACUUM may renumber the implicit rowids of tables with string keys;
+        # swap two of them behind the triggers' back
+        from search import create_search_index
+        with app.app_context():
+            for name in ('Bravo', 'Charlie'):
+                db.session.add(Account(company_name=f'{name} Vacuum', created_by=self.user_id))
+            db.session.commit()
+            with db.engine.begin() as conn:
+                conn.exec_driver_sql('DROP TRIGGER accounts_search_au')
+                bravo, charlie = [row[0] for row in conn.exec_driver_sql(
+                    "SELECT rowid FROM accounts WHERE company_name LIKE '% Vacuum' ORDER BY company_name")]
+                conn.exec_driver_sql(f'UPDATE accounts SET rowid = -1 WHERE rowid = {bravo}')
+                conn.exec_driver_sql(f'UPDATE accounts SET rowid = {bravo} WHERE rowid = {charlie}')
+                conn.exec_driver_sql(f'UPDATE accounts SET rowid = {charlie} WHERE rowid = -1')
+                create_search_index(conn, 'accounts')
+        data = json.loads(self.app.get('/api/search?q=bravo').data)
+        assert [item['title'] for item in data['items']] == ['Bravo Vacuum']
+        with app.app_context():
+            charlie = Account.query.filter_by(company_name='Charlie Vacuum').one()
+            charlie.company_name = 'Charlie Cleaned'
+            db.session.commit()
+            charlie_id = charlie.id
+        data = json.loads(self.app.get('/api/search?q=cleaned').data)
+        assert [(item['id'], item['title']) for item in data['items']] == [(charlie_id, 'Charlie Cleaned')]
+        data = json.loads(self.app.get('/api/search?q=vacuum').data)
+        assert [item['title'] for item in data['items']] == ['Bravo Vacuum']
+
+    def test_typeahead_lookups(self):
+        """Test bounded prefix lookups used by the account and contact pickers"""
+        self.login()
+        
+        with app.app_context():
+            accounts = [Account(company_name=f'Pick Co {i:02d}', created_by=self.user_id) for i in range(15)]
+            other = Account(company_name='Other Inc', created_by=self.user_id)
+            db.session.add_all(accounts + [other])
+            db.session.flush()
+            db.session.add_all([
+                Contact(first_name='Greta', last_name='Lindqvist', email='greta@example.com',
+                        account_id=accounts[0].id, created_by=self.user_id),
+                Contact(first_name='Lars', last_name='Greger', email='lars@example.com',
+                        account_id=other.id, created_by=self.user_id),
+            ])
+            db.session.commit()
+            first_account_id, other_id = accounts[0].id, other.id
+        
+        data = json.loads(self.app.get('/api/accounts/lookup?q=pick%20co').data)
+        assert len(data['items']) == 10
+        assert data['items'][0] == {'id': first_account_id, 'label': 'Pick Co 00'}
+        data = json.loads(self.app.get('/api/accounts/lookup?q=PICK%20CO%201&limit=3').data)
+        assert [item['label'] for item in data['items']] == ['Pick Co 10', 'Pick Co 11', 'Pick Co 12']
+        
+        # First or last name prefix, "first last", and restricted to one account
+        data = json.loads(self.app.get('/api/contacts/lookup?q=gre').data)
+        assert [item['label'] for item in data['items']] == ['Lars Greger', 'Greta Lindqvist']
+        data = json.loads(self.app.get('/api/contacts/lookup?q=greta%20lind').data)
+        assert [item['accountName'] for item in data['items']] == ['Pick Co 00']
+        data = json.loads(self.app.get(f'/api/contacts/lookup?q=gre&account_id={other_id}').data)
+        assert [item['label'] for item in data['items']] == ['Lars Greger']
+        
+        # Forms no longer embed every account
+        rv = self.app.get('/opportunities/add')
+        assert rv.status_code == 200
+        assert b'Pick Co' not in rv.data
+        assert b'/api/accounts/lookup' in rv.data
+
+    def test_identity_cache(self):
+        """Test that the user loader is cached and evicted on user changes"""
+        from sqlalchemy import event
+        self.login()
+        
+        user_queries = []
+        def count_user_queries(conn, cursor, statement, *args):
+            if 'FROM users' in statement:
+                user_queries.append(statement)
+        
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', count_user_queries)
+        try:
+            self.app.get('/')
+            del user_queries[:]
+            rv = self.app.get('/')
+            assert rv.status_code == 200
+            assert user_queries == []
+        finally:
+            event.remove(engine, 'before_cursor_execute', count_user_queries)
+        
+        # setup_organization changes the user; the next request must see it
+        rv = self.app.get('/users/manage')
+        assert rv.status_code == 302
+        rv = self.app.post('/users/setup', data={'organization_name': 'Cache Org'})
+        assert rv.status_code == 302
+        rv = self.app.get('/users/manage')
+        assert rv.status_code == 200
+        assert b'Administrator' in rv.data
+
+    def test_synthetic_data_generator(self):
+        """Test that generated tenants are reproducible and consistent"""
+        import datagen
+        from counters import count_scope, org_scope, recount_all
+        from models import RecordCounter
+        volumes = {'users': 2, 'accounts': 6, 'leads': 10}
+        
+        def snapshot():
+            return (sorted(a.id for a in Account.query.all()),
+                    sorted(l.email for l in Lead.query.all()))
+        
+        with app.app_context():
+            totals = datagen.generate(2, volumes, seed=7)
+            assert totals['users'] == 4
+            assert totals['accounts'] == 12
+            assert totals['leads'] == 20
+            first = snapshot()
+            
+            # Every foreign key points at a row of the same organization
+            for contact in Contact.query.all():
+                account = db.session.get(Account, contact.account_id)
+                assert account.organization_id == contact.organization_id
+            for opportunity in Opportunity.query.all():
+                contact = db.session.get(Contact, opportunity.contact_id)
+                assert contact.account_id == opportunity.company_id
+            
+            scope = org_scope(Account.query.first().organization_id)
+            assert db.session.get(RecordCounter, scope).to_dict() == count_scope(scope)
+            
+            # Same seed, fresh tables (with index deferral): same data
+            for model in (Opportunity, Contact, Lead, Account):
+                model.query.delete()
+            User.query.filter(User.username.like('s7o%')).delete(synchronize_session=False)
+            db.session.commit()
+            recount_all()
+            datagen.generate(2, volumes, seed=7, defer_indexes=True)
+            assert snapshot() == first
+
+    def test_sql_statement_header(self):
+        """Test the per-request SQL statement count used by the HTTP benchmark"""
+        self.login()
+        rv = self.app.get('/api/leads')
+        assert 'X-SQL-Statements' not in rv.headers
+        
+        app.config['SQL_STATS_HEADER'] = True
+        try:
+            self.app.get('/api/leads')
+            rv = self.app.get('/api/leads')
+            # The list version for the ETag, then the page itself
+            assert rv.headers['X-SQL-Statements'] == '2'
+            rv = self.app.get('/accounts')
+            assert int(rv.headers['X-SQL-Statements']) >= 1
+        finally:
+            app.config['SQL_STATS_HEADER'] = False
+
+    def test_conditional_get_and_compression(self):
+        """Test ETag/304 on the list endpoints and negotiated compression"""
+        import gzip
+        self.login()
+        with app.app_context():
+            account = Account(company_name='Etag Co', created_by=self.user_id)
+            db.session.add(account)
+            db.session.flush()
+            contact = Contact(first_name='Eve', last_name='Tag', email='eve@etag.example',
+                              account_id=account.id, created_by=self.user_id)
+            db.session.add(contact)
+            for i in range(40):
+                db.session.add(Lead(company_name=f'Etag Lead {i}', contact_person='Eve',
+                                    email=f'etag{i}@example.com', created_by=self.user_id))
+            db.session.commit()
+            account_id, contact_id = account.id, contact.id
+
+        for url in ('/api/leads', '/api/accounts', '/leads', '/contacts', '/opportunities'):
+            rv = self.app.get(url)
+            assert rv.status_code == 200, url
+            assert rv.headers['ETag'].startswith('W/"'), url
+            assert 'no-cache' in rv.headers['Cache-Control'], url
+            rv = self.app.get(url, headers={'If-None-Match': rv.headers['ETag']})
+            assert rv.status_code == 304, url
+            assert rv.data == b'', url
+
+        # The 304 is answered from the version query alone
+        rv = self.app.get('/api/leads')
+        assert 'Last-Modified' in rv.headers
+        etag = rv.headers['ETag']
+        app.config['SQL_STATS_HEADER'] = True
+        try:
+            rv = self.app.get('/api/leads', headers={'If-None-Match': etag})
+            assert rv.status_code == 304
+            assert rv.headers['X-SQL-Statements'] == '1'
+        finally:
+            app.config['SQL_STATS_HEADER'] = False
+        assert self.app.get('/api/leads?limit=5', headers={'If-None-Match': etag}).status_code == 200
+
+        # Edits, deletes and a related account's rename all change the version
+        contacts_etag = self.app.get('/contacts').headers['ETag']
+        rv = self.app.put(f'/api/accounts/{account_id}', data=json.dumps({'companyName': 'Renamed Co'}),
+                          content_type='application/json')
+        assert rv.status_code == 200
+        rv = self.app.get('/contacts', headers={'If-None-Match': contacts_etag})
+        assert rv.status_code == 200
+        assert b'Renamed Co' in rv.data
+        with app.app_context():
+            db.session.delete(db.session.get(Contact, contact_id))
+            db.session.commit()
+        assert self.app.get('/contacts', headers={'If-None-Match': rv.headers['ETag']}).status_code == 200
+        with app.app_context():
+            lead = Lead.query.filter_by(company_name='Etag Lead 0').one()
+            lead.notes = 'changed'
+            db.session.commit()
+        assert self.app.get('/api/leads', headers={'If-None-Match': etag}).status_code == 200
+
+        # Large bodies are gzipped for clients that accept it, small ones are not
+        plain = self.app.get('/api/leads')
+        assert 'Content-Encoding' not in plain.headers
+        rv = self.app.get('/api/leads', headers={'Accept-Encoding': 'gzip, deflate'})
+        assert rv.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in rv.headers['Vary']
+        assert int(rv.headers['Content-Length']) < len(plain.data)
+        assert gzip.decompress(rv.data) == plain.data
+        assert rv.headers['ETag'] == plain.headers['ETag']
+        rv = self.app.get('/api/leads?limit=1', headers={'Accept-Encoding': 'gzip'})
+        assert 'Content-Encoding' not in rv.headers
+        rv = self.app.get('/api/leads', headers={'Accept-Encoding': 'gzip;q=0'})
+        assert 'Content-Encoding' not in rv.headers
+
+    def test_delta_sync_with_tombstones(self):
+        """Test ?since= delta sync: changed records, tombstones and token handling"""
+        self.login()
+        app.config['SYNC_LAG_SECONDS'] = 0
+        try:
+            with app.app_context():
+                leads = [Lead(company_name=f'Sync Lead {i}', contact_person='Sy',
+                              email=f'sync{i}@example.com', created_by=self.user_id)
+                         for i in range(5)]
+                db.session.add_all(leads)
+                db.session.commit()
+                lead_ids = [lead.id for lead in leads]
+
+            # Bootstrap from an empty token, two records per batch
+            synced, token = {}, ''
+            while True:
+                data = self.app.get(f'/api/leads?since={token}&limit=2').get_json()
+                assert len(data['items']) <= 2
+                synced.update((item['id'], item) for item in data['items'])
+                token = data['next_since']
+                if not data['has_more']:
+                    break
+            assert set(synced) == set(lead_ids)
+
+            data = self.app.get(f'/api/leads?since={token}').get_json()
+            assert data['items'] == [] and data['deleted'] == [] and not data['has_more']
+
+            # An edit, a delete, a move to another owner and a conversion
+            with app.app_context():
+                db.session.get(Lead, lead_ids[0]).notes = 'edited'
+                db.session.delete(db.session.get(Lead, lead_ids[1]))
+                db.session.get(Lead, lead_ids[2]).created_by = self.user_id + 1000
+                db.session.commit()
+            rv = self.app.post(f'/api/leads/{lead_ids[3]}/convert')
+            assert rv.status_code in (200, 201)
+
+            data = self.app.get(f'/api/leads?since={token}').get_json()
+            assert [item['id'] for item in data['items']] == [lead_ids[0]]
+            assert data['items'][0]['notes'] == 'edited'
+            assert sorted(data['deleted']) == sorted(lead_ids[1:4])
+            token = data['next_since']
+
+            # Moving back into the scope cancels the tombstone
+            with app.app_context():
+                db.session.get(Lead, lead_ids[2]).created_by = self.user_id
+                db.session.commit()
+            data = self.app.get(f'/api/leads?since={token}').get_json()
+            assert [item['id'] for item in data['items']] == [lead_ids[2]]
+            assert data['deleted'] == []
+            # The account created by the conversion
+            accounts = self.app.get('/api/accounts?since=').get_json()
+            assert len(accounts['items']) == 1 and accounts['deleted'] == []
+
+            assert self.app.get('/api/leads?since=garbage').status_code == 400
+            # Tokens are bound to the scope that received them
+            with app.app_context():
+                other = User(username='syncother', email='so@example.com',
+                             first_name='S', last_name='O', organization_id='sync-org')
+                other.set_password('pw')
+                db.session.add(other)
+                db.session.commit()
+            self.logout()
+            self.login('syncother', 'pw')
+            rv = self.app.get(f'/api/leads?since={token}')
+            assert rv.status_code == 410
+            assert rv.get_json()['resync'] is True
+        finally:
+            app.config['SYNC_LAG_SECONDS'] = 5
+
+    def test_forecast_probability_and_pipeline_report(self):
+        """Test the numeric forecast column, its backfill and the pipeline report"""
+        from datetime import date
+        from decimal import Decimal
+        from models import parse_forecast
+        from migrate_forecast_probability import backfill
+        self.login()
+
+        assert parse_forecast('40%') == Decimal('40.00')
+        assert parse_forecast(' 12.5 % ') == Decimal('12.50')
+        assert parse_forecast('High') is None
+        assert parse_forecast('150%') is None
+
+        with app.app_context():
+            account = Account(company_name='Pipe Co', created_by=self.user_id)
+            db.session.add(account)
+            db.session.flush()
+            contact = Contact(first_name='Pia', last_name='Pipe', email='pia@pipe.example',
+                              account_id=account.id, created_by=self.user_id)
+            db.session.add(contact)
+            db.session.flush()
+            rows = [
+                ('Proposal', '50%', Decimal('1000.00'), date(2025, 3, 10)),
+                ('Proposal', '25%', Decimal('3000.00'), date(2025, 3, 20)),
+                ('Proposal', 'High', Decimal('500.00'), date(2025, 3, 25)),
+                ('Negotiation', '75%', None, date(2025, 4, 1)),
+                ('Negotiation', '75%', Decimal('2000.00'), None),
+                ('Closed Won', '100%', Decimal('9999.00'), date(2025, 3, 1)),
+            ]
+            for i, (stage, forecast, amount, close_date) in enumerate(rows):
+                db.session.add(Opportunity(name=f'Pipe {i}', sales_stage=stage, forecast=forecast,
+                                           amount=amount, close_date=close_date,
+                                           company_id=account.id, contact_id=contact.id,
+                                           created_by=self.user_id))
+            db.session.commit()
+            assert Opportunity.query.filter_by(name='Pipe 0').one().forecast_probability == Decimal('50.00')
+            assert Opportunity.query.filter_by(name='Pipe 2').one().forecast_probability is None
+
+            # The migration fills rows that predate the column without touching updated_at
+            table = Opportunity.__table__
+            before = dict(db.session.execute(db.select(table.c.id, table.c.updated_at)).all())
+            db.session.execute(table.update().values(forecast_probability=None,
+                                                     updated_at=table.c.updated_at))
+            db.session.commit()
+            backfill(batch_size=2)
+            after = db.session.execute(db.select(table.c.id, table.c.updated_at,
+                                                 table.c.forecast_probability)).all()
+            assert {row.id: row.updated_at for row in after} == before
+            assert sorted(str(row.forecast_probability) for row in after) == \
+                ['100.00', '25.00', '50.00', '75.00', '75.00', 'None']
+
+        rv = self.app.get('/api/reports/pipeline')
+        assert rv.status_code == 200
+        report = rv.get_json()
+        groups = {(g['salesStage'], g['closeMonth']): g for g in report['groups']}
+        assert set(groups) == {('Proposal', '2025-03'), ('Negotiation', '2025-04'), ('Negotiation', None)}
+        proposal = groups[('Proposal', '2025-03')]
+        assert proposal['count'] == 3
+        assert proposal['amount'] == 4500.0
+        assert proposal['weightedAmount'] == 1250.0  # 50% of 1000 + 25% of 3000, 'High' counts 0
+        assert proposal['owner'] == {'id': self.user_id, 'name': 'Test User'}
+        assert groups[('Negotiation', '2025-04')]['amount'] == 0.0
+        assert report['totals'] == {'count': 5, 'amount': 6500.0, 'weightedAmount': 2750.0}
+
+        report = self.app.get('/api/reports/pipeline?include_closed=1&from=2025-03&to=2025-03').get_json()
+        assert {g['salesStage'] for g in report['groups']} == {'Proposal', 'Closed Won'}
+        assert report['totals']['weightedAmount'] == 11249.0
+        assert self.app.get('/api/reports/pipeline?from=March').status_code == 400
+
+        # Conversion inserts opportunities with Core; the column default parses forecast
+        with app.app_context():
+            lead = Lead(company_name='Pipe Lead', contact_person='Lee Pipe',
+                        email='lee@pipe.example', created_by=self.user_id)
+            db.session.add(lead)
+            db.session.commit()
+            lead_id = lead.id
+        rv = self.app.post(f'/api/leads/{lead_id}/convert', data=json.dumps({'forecast': '30%'}),
+                           content_type='application/json')
+        assert rv.status_code in (200, 201)
+        with app.app_context():
+            converted = Opportunity.query.filter_by(name='Opportunity for Pipe Lead').one()
+            assert converted.forecast_probability == Decimal('30.00')
+
+    def test_background_jobs(self):
+        """Test export, import, conversion and organization setup as background jobs"""
+        from datetime import datetime, timedelta
+        from models import Job
+        from jobs import runner, job_handler
+        self.login()
+
+        def finished(rv):
+            assert rv.status_code == 202
+            job = rv.get_json()
+            assert rv.headers['Location'].endswith(f"/api/jobs/{job['id']}")
+            runner.wait(job['id'], timeout=30)
+            return self.app.get(f"/api/jobs/{job['id']}").get_json()
+
+        csv_data = ('Contact Person,Company,Email,Stage\n'
+                    'Jo Job,Job Co,jo@job.example,MQL\n'
+                    'Al Job,Job Two,al@job.example,SAL\n'
+                    'Bo Job,Job Three,bo@job.example,SQL\n')
+        job = finished(self.app.post('/api/jobs/import/leads?batch_size=2',
+                                     data={'file': (io.BytesIO(csv_data.encode()), 'leads.csv')},
+                                     content_type='multipart/form-data'))
+        assert job['status'] == 'succeeded', job
+        assert job['result']['inserted'] == 3
+        assert job['progress'] == {'done': 3, 'total': None}
+        # The upload was spooled to disk and removed when the job finished
+        with app.app_context():
+            assert db.session.get(Job, job['id']).input_path is None
+        assert os.listdir(app.config['JOB_SPOOL_DIR']) == []
+        job = finished(self.app.post('/api/jobs/import/leads', data='Contact Person,Company,Email\n',
+                                     content_type='text/csv'))
+        assert (job['status'], job['result']['total']) == ('succeeded', 0)
+
+        job = finished(self.app.post('/api/jobs/export/leads.csv'))
+        assert job['status'] == 'succeeded'
+        assert job['result'] == {'rows': 3}
+        assert job['progress'] == {'done': 3, 'total': 3}
+        expected = self.app.get('/export/leads.csv').data
+        assert job['artifact'] == {'name': 'leads_export.csv', 'mimetype': 'text/csv',
+                                   'size': len(expected)}
+        rv = self.app.get(f"/api/jobs/{job['id']}/artifact")
+        assert rv.status_code == 200
+        assert rv.headers['Content-Disposition'] == 'attachment; filename=leads_export.csv'
+        assert rv.data == expected
+        rv.close()
+        # Purging a job deletes its file
+        from jobs import purge_jobs
+        with app.app_context():
+            artifact_path = db.session.get(Job, job['id']).artifact_path
+            assert os.path.exists(artifact_path)
+            assert purge_jobs(0, now=datetime.utcnow() + timedelta(seconds=1)) == 3
+        assert not os.path.exists(artifact_path)
+        assert self.app.get(f"/api/jobs/{job['id']}/artifact").status_code == 404
+
+        with app.app_context():
+            lead_ids = [lead.id for lead in Lead.query.order_by(Lead.company_name)]
+        job = finished(self.app.post('/api/jobs/convert/leads', data=json.dumps(
+            {'leadIds': lead_ids[:2] + ['missing']}), content_type='application/json'))
+        assert [c['leadId'] for c in job['result']['converted']] == lead_ids[:2]
+        assert job['result']['skipped'] == [{'leadId': 'missing', 'reason': 'not_found'}]
+        assert job['progress'] == {'done': 3, 'total': 3}
+
+        @job_handler('test_failure')
+        def fail(context, user, params):
+            raise ValueError('no luck')
+        with app.app_context():
+            from jobs import enqueue
+            user = db.session.get(User, self.user_id)
+            failed_id = enqueue('test_failure', user).id
+        runner.wait(failed_id, timeout=30)
+        job = self.app.get(f'/api/jobs/{failed_id}').get_json()
+        assert (job['status'], job['error']) == ('failed', 'ValueError: no luck')
+
+        # A run the stale sweep took away can neither report nor finish
+        from sqlalchemy import update
+        long_ago = datetime.utcnow() - timedelta(hours=1)
+        reported = []
+        @job_handler('test_swept')
+        def swept(context, user, params):
+            with app.app_context():
+                db.session.execute(update(Job).where(Job.id == context.job_id).values(heartbeat_at=long_ago))
+                db.session.commit()
+                assert runner.sweep_stale() == 1
+            if params['report']:
+                context.progress(1)
+                reported.append(context.job_id)
+            return {'ok': True}
+        with app.app_context():
+            user = db.session.get(User, self.user_id)
+            swept_ids = [enqueue('test_swept', user, {'report': report}).id for report in (False, True)]
+        runner.wait(timeout=30)
+        for swept_id in swept_ids:
+            job = self.app.get(f'/api/jobs/{swept_id}').get_json()
+            assert (job['status'], job['error'], job['result']) == ('failed', 'Interrupted before it finished', None)
+        assert reported == []
+
+        # Polling sweeps stale jobs, at most every JOB_SWEEP_SECONDS
+        def stale_job():
+            with app.app_context():
+                stale = Job(kind='export', status='running', heartbeat_at=long_ago, created_by=self.user_id)
+                db.session.add(stale)
+                db.session.commit()
+                return stale.id
+        runner._last_sweep = None
+        first = stale_job()
+        assert self.app.get(f'/api/jobs/{first}').get_json()['status'] == 'failed'
+        second = stale_job()
+        assert self.app.get(f'/api/jobs/{second}').get_json()['status'] == 'running'
+        runner._last_sweep -= app.config['JOB_SWEEP_SECONDS']
+        assert self.app.get(f'/api/jobs/{second}').get_json()['status'] == 'failed'
+
+        # Organization setup answers at once and moves the records in a job,
+        # committed with the organization so one that fails to start still runs
+        from unittest import mock
+        with mock.patch.object(runner, 'submit', side_effect=RuntimeError('pool is down')):
+            rv = self.app.post('/users/setup', data={'organization_name': 'Job Org'})
+        assert rv.status_code == 302
+        with app.app_context():
+            job = Job.query.filter_by(kind='setup_organization').one()
+            assert job.status == 'queued'
+            assert job.organization_id == db.session.get(User, self.user_id).organization_id
+        runner.resume_pending()
+        runner.wait(timeout=30)
+        jobs = self.app.get('/api/jobs').get_json()['items']
+        assert jobs[0]['kind'] == 'setup_organization' and jobs[0]['status'] == 'succeeded'
+        assert jobs[0]['result']['moved']['leads'] == 3
+        assert len(self.app.get('/api/leads').get_json()) == 1
+
+        # A restarted worker requeues resumable jobs and fails the others
+        with app.app_context():
+            long_ago = datetime.utcnow() - timedelta(hours=1)
+            for kind in ('setup_organization', 'export'):
+                db.session.add(Job(kind=kind, status='running', heartbeat_at=long_ago,
+                                   created_by=self.user_id, params={'organizationId': 'x',
+                                                                    'entity': 'leads', 'format': 'csv'}))
+            db.session.commit()
+        runner.resume_pending()
+        runner.wait(timeout=30)
+        with app.app_context():
+            statuses = dict(db.session.query(Job.kind, Job.status).filter(
+                Job.params['organizationId'].as_string() == 'x'))
+        assert statuses == {'setup_organization': 'succeeded', 'export': 'failed'}
+
+        assert self.app.get('/api/jobs/unknown').status_code == 404
+        assert self.app.post('/api/jobs/export/users.csv').status_code == 404
+
+    def test_schema_version_fast_start(self):
+        """Test that a stamped database boots with one read and a changed schema does not"""
+        import contextlib
+        from sqlalchemy import event, update
+        from app import init_database
+        from models import SchemaVersion
+        from schema_version import schema_fingerprint
+        import startup_profile
+
+        with app.app_context():
+            statements = []
+            def count(*args):
+                statements.append(args[2])
+            event.listen(db.engine, 'before_cursor_execute', count)
+            try:
+                def boot():
+                    del statements[:]
+                    output = io.StringIO()
+                    with contextlib.redirect_stdout(output):
+                        init_database()
+                    return output.getvalue()
+
+                # Unstamped: the full check runs and stamps the database
+                SchemaVersion.query.delete()
+                db.session.commit()
+                assert 'running full checks' in boot()
+                version = db.session.get(SchemaVersion, 1).version
+                assert version == schema_fingerprint()
+                assert 'skipping table checks' in boot()
+                assert len(statements) == 1 and 'schema_version' in statements[0]
+
+                # A stamp from other models means the full check runs again
+                db.session.execute(update(SchemaVersion).values(version='0' * 16))
+                db.session.commit()
+                assert 'running full checks' in boot()
+                db.session.expire_all()
+                assert db.session.get(SchemaVersion, 1).version == version
+
+                app.config['FAST_START'] = False
+                try:
+                    assert 'running full checks' not in boot()
+                    assert any('sqlite_master' in s or 'PRAGMA' in s for s in statements)
+                finally:
+                    app.config['FAST_START'] = True
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', count)
+
+        lines = []
+        startup_profile.report(out=lines.append)
+        assert 'Startup profile' in lines[0]
+        assert any('create_app' in line for line in lines)
+        assert any(line.strip().startswith('schema version check') for line in lines)
+
+    def test_chunked_resumable_reparenting(self):
+        """Test moving a user's records into an organization in resumable batches"""
+        from models import StageChange, Tombstone
+        from counters import get_counts, count_scope, org_scope
+        from reparenting import reparent_records
+
+        with app.app_context():
+            for i in range(5):
+                db.session.add(Lead(company_name=f'Move {i}', contact_person='Mo Move',
+                                    email='mo@move.example', created_by=self.user_id,
+                                    is_converted=(i == 4)))
+            account = Account(company_name='Old Org Co', created_by=self.user_id, organization_id='old-org')
+            db.session.add(account)
+            db.session.commit()
+            db.session.add(Contact(first_name='Cy', last_name='Move', email='cy@move.example',
+                                   account_id=account.id, created_by=self.user_id))
+            db.session.commit()
+            before = dict(db.session.query(Lead.id, Lead.updated_at))
+            # Rows older than keyset pagination's updated_at backfill
+            db.session.execute(db.update(Lead).where(Lead.company_name.in_(['Move 0', 'Move 3']))
+                               .values(updated_at=None), execution_options={'synchronize_session': False})
+            db.session.commit()
+            user = db.session.get(User, self.user_id)
+            user.organization_id = 'new-org'
+            db.session.commit()
+            assert get_counts(user) == {'leads': 0, 'accounts': 0, 'contacts': 0, 'opportunities': 0}
+            old_counts = get_counts(type('Old', (), {'organization_id': 'old-org', 'id': 0})())
+            assert old_counts['accounts'] == 1
+
+            # A crash after the second committed batch keeps that batch
+            reports = []
+            def crash(done, total, checkpoint):
+                reports.append((done, total, checkpoint))
+                if len(reports) == 2:
+                    raise RuntimeError('worker died')
+            try:
+                reparent_records(self.user_id, 'new-org', batch_size=2, progress=crash)
+            except RuntimeError:
+                pass
+            assert [(done, total) for done, total, _ in reports] == [(2, 7), (4, 7)]
+            assert Lead.query.filter_by(organization_id='new-org').count() == 4
+
+            moved = reparent_records(self.user_id, 'new-org', batch_size=2, checkpoint=reports[-1][2],
+                                     progress=lambda *args: reports.append(args))
+            assert moved == {'leads': 1, 'accounts': 1, 'contacts': 1, 'opportunities': 0}
+            assert reports[-1][:2] == (7, 7)
+            # Nothing is left for a run that starts over
+            assert reparent_records(self.user_id, 'new-org', batch_size=2) == dict.fromkeys(moved, 0)
+
+            # Moved rows count as updated, so delta sync delivers them to the new organization
+            after = dict(db.session.query(Lead.id, Lead.updated_at))
+            assert all(after[id] > updated_at for id, updated_at in before.items())
+            assert get_counts(user) == count_scope(org_scope('new-org')) == \
+                {'leads': 4, 'accounts': 1, 'contacts': 1, 'opportunities': 0}
+            assert count_scope(org_scope('old-org'))['accounts'] == 0
+            assert db.session.get(type(account), account.id).organization_id == 'new-org'
+            assert Tombstone.query.filter_by(record_id=account.id, organization_id='old-org').count() == 1
+            assert StageChange.query.filter_by(entity='leads', organization_id='new-org').count() == \
+                StageChange.query.filter_by(entity='leads').count() > 0
+
+    def test_pipeline_snapshots_and_trend(self):
+        """Test the daily pipeline rollup and the trend read from it"""
+        from datetime import date
+        from decimal import Decimal
+        from models import PipelineSnapshot
+        from reports import snapshot_pipeline
+        self.login()
+
+        with app.app_context():
+            account = Account(company_name='Trend Co', created_by=self.user_id)
+            db.session.add(account)
+            db.session.flush()
+            contact = Contact(first_name='Tia', last_name='Trend', email='tia@trend.example',
+                              account_id=account.id, created_by=self.user_id)
+            db.session.add(contact)
+            db.session.flush()
+            for i, (stage, forecast, amount) in enumerate((('Proposal', '50%', '1000'),
+                                                           ('Proposal', '10%', '2000'),
+                                                           ('Closed Won', '100%', '500'))):
+                db.session.add(Opportunity(name=f'Trend {i}', sales_stage=stage, forecast=forecast,
+                                           amount=Decimal(amount), close_date=date(2025, 5, 1),
+                                           company_id=account.id, contact_id=contact.id,
+                                           created_by=self.user_id))
+            db.session.commit()
+
+            assert snapshot_pipeline(db.session, date(2025, 5, 30)) == 2
+            db.session.commit()
+            opportunity = Opportunity.query.filter_by(name='Trend 1').one()
+            opportunity.sales_stage = 'Closed Lost'
+            db.session.commit()
+            snapshot_pipeline(db.session, date(2025, 5, 31))
+            snapshot_pipeline(db.session, date(2025, 6, 1))
+            # A re-run replaces its day instead of adding to it
+            assert snapshot_pipeline(db.session, date(2025, 6, 1)) == 3
+            db.session.commit()
+            assert PipelineSnapshot.query.count() == 8
+            row = PipelineSnapshot.query.filter_by(snapshot_date=date(2025, 5, 30),
+                                                   sales_stage='Proposal').one()
+            assert (row.scope, row.close_month, row.count) == (f'user:{self.user_id}', '2025-05', 2)
+            assert row.weighted_amount == Decimal('700.00')
+
+        trend = self.app.get('/api/reports/pipeline/trend?from=2025-05-01&to=2025-06-30').get_json()
+        assert [(p['date'], p['count'], p['amount'], p['weightedAmount']) for p in trend['points']] == [
+            ('2025-05-30', 2, 3000.0, 700.0), ('2025-05-31', 1, 1000.0, 500.0),
+            ('2025-06-01', 1, 1000.0, 500.0)]
+        assert trend['points'][0]['stages'] == [
+            {'salesStage': 'Proposal', 'count': 2, 'amount': 3000.0, 'weightedAmount': 700.0}]
+
+        monthly = self.app.get('/api/reports/pipeline/trend?from=2025-05-01&to=2025-06-30'
+                               '&interval=month&include_closed=1').get_json()
+        assert [(p['date'], p['count']) for p in monthly['points']] == [('2025-05-31', 3), ('2025-06-01', 3)]
+        won = self.app.get('/api/reports/pipeline/trend?from=2025-05-01&to=2025-06-30'
+                           '&stage=Closed%20Won').get_json()
+        assert [p['amount'] for p in won['points']] == [500.0, 500.0, 500.0]
+
+        assert self.app.get('/api/reports/pipeline/trend?interval=week').status_code == 400
+        assert self.app.get('/api/reports/pipeline/trend?from=May').status_code == 400
+
+    def test_stage_history_and_funnel_reports(self):
+        """Test the stage history written with each change and the reports over it"""
+        from datetime import datetime, timedelta
+        from models import StageChange
+        from stage_history import seed_missing
+        self.login()
+
+        lead_ids = []
+        for name in ('Stage One', 'Stage Two'):
+            rv = self.app.post('/api/leads', data=json.dumps({
+                'companyName': name, 'contactPerson': 'Sam Stage',
+                'email': 'sam@stage.example', 'stage': 'MQL'}), content_type='application/json')
+            assert rv.status_code == 201
+            lead_ids.append(rv.get_json()['id'])
+        first, second = lead_ids
+        for stage in ('SAL', 'SAL', 'SQL'):
+            rv = self.app.put(f'/api/leads/{first}', data=json.dumps({'stage': stage}),
+                              content_type='application/json')
+            assert rv.status_code == 200
+        rv = self.app.post(f'/api/leads/{first}/convert', data=json.dumps({}),
+                           content_type='application/json')
+        assert rv.status_code in (200, 201)
+
+        with app.app_context():
+            history = StageChange.query.filter_by(record_id=first).order_by(StageChange.id).all()
+            # Setting the same stage again is not a transition
+            assert [(h.from_stage, h.to_stage) for h in history] == [
+                (None, 'MQL'), ('MQL', 'SAL'), ('SAL', 'SQL'), ('SQL', 'Converted')]
+            opportunity_id = Opportunity.query.one().id
+            assert StageChange.query.filter_by(entity='opportunities', record_id=opportunity_id,
+                                               to_stage='Prospecting').count() == 1
+            # Two, three and one days in MQL, SAL and SQL
+            start = datetime(2025, 1, 6)
+            for h, days in zip(history, (0, 2, 5, 6)):
+                h.changed_at = start + timedelta(days=days)
+            db.session.commit()
+
+        funnel = self.app.get('/api/reports/leads/funnel').get_json()
+        assert funnel['entered'] == 2
+        assert [(s['stage'], s['count']) for s in funnel['stages']] == [
+            ('MQL', 2), ('SAL', 1), ('SQL', 1), ('Converted', 1)]
+        assert funnel['stages'][1]['conversionRate'] == 0.5
+        assert funnel['stages'][3]['overallRate'] == 0.5
+        period = self.app.get('/api/reports/leads/funnel?from=2025-01-01&to=2025-01-31').get_json()
+        assert period['entered'] == 1
+
+        rates = self.app.get('/api/reports/leads/conversion-rates').get_json()
+        assert {(t['fromStage'], t['toStage']): (t['count'], t['rate']) for t in rates['transitions']} == {
+            ('MQL', 'SAL'): (1, 1.0), ('SAL', 'SQL'): (1, 1.0), ('SQL', 'Converted'): (1, 1.0)}
+
+        stays = {s['stage']: s for s in self.app.get('/api/reports/leads/time-in-stage').get_json()['stages']}
+        assert list(stays) == ['MQL', 'SAL', 'SQL', 'Converted']
+        assert (stays['MQL']['entered'], stays['MQL']['left'], stays['MQL']['current']) == (2, 1, 1)
+        assert stays['MQL']['averageDays'] == 2.0
+        assert stays['SAL']['averageDays'] == 3.0
+        assert stays['Converted']['averageDays'] is None
+
+        cohorts = self.app.get('/api/reports/leads/cohorts').get_json()['cohorts']
+        assert [(c['cohort'], c['size']) for c in cohorts] == [
+            ('2025-01', 1), (datetime.utcnow().strftime('%Y-%m'), 1)]
+        assert cohorts[0]['stages'][3] == {'stage': 'Converted', 'count': 1,
+                                           'conversionRate': 1.0, 'overallRate': 1.0}
+
+        rv = self.app.put(f'/api/opportunities/{opportunity_id}', data=json.dumps({'salesStage': 'Proposal'}),
+                          content_type='application/json')
+        assert rv.status_code == 200
+        funnel = self.app.get('/api/reports/opportunities/funnel').get_json()
+        # Skipping Qualification still counts as passing it
+        assert [s['count'] for s in funnel['stages']] == [1, 1, 1, 0, 0]
+
+        assert self.app.get('/api/reports/leads/funnel?from=yesterday').status_code == 400
+        assert self.app.get('/api/reports/accounts/funnel').status_code == 404
+
+        # Records written around the ORM get their current stage seeded once
+        with app.app_context():
+            db.session.execute(db.insert(Lead.__table__), [
+                {'id': 'seed-open', 'company_name': 'Seed', 'contact_person': 'S', 'email': 's@x',
+                 'stage': 'SAL', 'is_converted': False, 'created_by': self.user_id},
+                {'id': 'seed-done', 'company_name': 'Seed', 'contact_person': 'S', 'email': 's@x',
+                 'stage': 'SQL', 'is_converted': True, 'created_by': self.user_id},
+            ])
+            assert seed_missing() == 3
+            assert seed_missing() == 0
+            db.session.commit()
+            seeded = StageChange.query.filter(StageChange.record_id.like('seed-%'))
+            assert {(h.record_id, h.from_stage, h.to_stage) for h in seeded} == {
+                ('seed-done', None, 'SQL'), ('seed-done', 'SQL', 'Converted'), ('seed-open', None, 'SAL')}
+
+            # Stages set after a commit expired the records still record where they came from
+            lead = db.session.get(Lead, 'seed-open')
+            opportunity = db.session.get(Opportunity, opportunity_id)
+            db.session.commit()
+            lead.stage = 'SQL'
+            opportunity.sales_stage = 'Negotiation'
+            db.session.commit()
+            assert StageChange.query.filter_by(record_id='seed-open', from_stage='SAL', to_stage='SQL').count() == 1
+            assert StageChange.query.filter_by(record_id=opportunity_id, from_stage='Proposal',
+                                               to_stage='Negotiation').count() == 1
+
+    def test_metrics_endpoint(self):
+        """Test per-endpoint latency, SQL, template and pool metrics on /metrics"""
+        self.login()
+        rv = self.app.get('/accounts')
+        assert rv.status_code == 200
+        
+        rv = self.app.get('/metrics')
+        assert rv.status_code == 200
+        body = rv.data.decode()
+        assert 'crm_http_requests_total{endpoint="main.accounts",method="GET",status="200"}' in body
+        assert 'crm_http_request_duration_seconds_bucket{endpoint="main.accounts",le="+Inf"}' in body
+        for name in ('crm_sql_statements_per_request', 'crm_sql_duration_seconds',
+                     'crm_template_render_seconds', 'crm_db_pool_checkout_seconds'):
+            assert f'{name}_count{{endpoint="main.accounts"}}' in body, name
+        
+        # Without a token only the local host may scrape
+        remote = {'REMOTE_ADDR': '203.0.113.7'}
+        assert self.app.get('/metrics', environ_base=remote).status_code == 404
+        
+        app.config['METRICS_TOKEN'] = 'secret'
+        try:
+            assert self.app.get('/metrics').status_code == 401
+            rv = self.app.get('/metrics', headers={'Authorization': 'Bearer secret'})
+            assert rv.status_code == 200
+            rv = self.app.get('/metrics', headers={'Authorization': 'Bearer secret'}, environ_base=remote)
+            assert rv.status_code == 200
+        finally:
+            app.config['METRICS_TOKEN'] = None
+
+    def test_query_budgets_and_n_plus_one_detection(self):
+        """Test that repeated lazy loads are reported and budgets are enforced"""
+        from querystats import QueryBudgetExceeded
+        self.login()
+        with app.app_context():
+            account = Account(company_name='Budget Co', created_by=self.user_id)
+            db.session.add(account)
+            db.session.flush()
+            accounts = [Account(company_name=f'Budget {n}', created_by=self.user_id) for n in range(3)]
+            db.session.add_all(accounts)
+            db.session.flush()
+            for n, owner in enumerate(accounts):
+                db.session.add(Contact(first_name=f'C{n}', last_name='Budget', email=f'c{n}@budget.com',
+                                       account_id=owner.id, created_by=self.user_id))
+            db.session.commit()
+        
+        # The contacts page eager-loads contact.account: no N+1, within budget
+        with self.assertNoLogs(app.logger, 'WARNING'):
+            rv = self.app.get('/contacts')
+        assert rv.status_code == 200
+        assert b'Budget 2' in rv.data
+        
+        # Lazy loads in a loop are reported with the relationship and the line
+        from flask import g
+        from querystats import repeated_statements
+        with app.test_request_context('/'):
+            for contact in Contact.query.all():
+                contact.account.company_name
+            report = repeated_statements(g.sql_log, 3)
+        assert report[0]['lazy_load'] == 'Contact.account'
+        assert report[0]['origins'][0].startswith('test_app.py:')
+        
+        view = app.view_functions['api.get_leads']
+        budget = view.query_budget
+        view.query_budget = 0
+        try:
+            with self.assertRaises(QueryBudgetExceeded):
+                self.app.get('/api/leads')
+        finally:
+            view.query_budget = budget
+        assert self.app.get('/api/leads').status_code == 200
+
+    def test_micro_benchmarks_run(self):
+        """Test that every micro-benchmark case runs against the current code"""
+        import argparse
+        import benchmark_micro
+        args = argparse.Namespace(rows=60, repeat=1, only=None, top=1)
+        results = benchmark_micro.run(args)
+        assert 'to_dict/contacts' in results
+        assert 'render/opportunities.html' in results
+        for name, result in results.items():
+            assert result['ns_per_row'] > 0, name
+            assert result['rows'] >= 60, name
+
+    def test_api_row_serialization_matches_to_dict(self):
+        """Test that the API's row-tuple path returns exactly the to_dict() output"""
+        from datetime import date
+        from decimal import Decimal
+        from flask.json.provider import DefaultJSONProvider
+        from serializers import ORJSONProvider
+        self.login()
+
+        with app.app_context():
+            account = Account(company_name='Serial Co', city='Toronto',
+                              description='Ünïcode “quotes”', created_by=self.user_id)
+            db.session.add(account)
+            db.session.flush()
+            contact = Contact(first_name='Ann', last_name='Lee', email='ann@serial.example',
+                              account_id=account.id, last_contact=date(2024, 2, 29), training_received=True,
+                              created_by=self.user_id)
+            db.session.add(contact)
+            db.session.flush()
+            db.session.add_all([
+                Opportunity(name='Priced', company_id=account.id, contact_id=contact.id,
+                            amount=Decimal('1234.50'), close_date=date(2024, 12, 31),
+                            forecast='50%', created_by=self.user_id),
+                Opportunity(name='Unpriced', company_id=account.id, contact_id=contact.id,
+                            amount=None, created_by=self.user_id),
+                Lead(company_name='Serial Lead', contact_person='Sam', email='sam@serial.example',
+                     stage='SAL', notes=None, created_by=self.user_id),
+            ])
+            db.session.commit()
+            expected = {
+                'leads': [lead.to_dict() for lead in Lead.query.all()],
+                'accounts': [account.to_dict()],
+                'contacts': [contact.to_dict()],
+                'opportunities': [opportunity.to_dict() for opportunity in
+                                  Opportunity.query.order_by(Opportunity.updated_at, Opportunity.id)],
+            }
+
+        for entity, items in expected.items():
+            assert self.app.get(f'/api/{entity}').get_json() == items, entity
+            rv = self.app.get(f'/api/{entity}?limit=50')
+            assert rv.status_code == 200, entity
+            assert rv.get_json()['items'] == items, entity
+            # Same text the json module would produce for to_dict() output
+            assert rv.data == DefaultJSONProvider(app).response(
+                {'items': items, 'next_cursor': None}).data.replace(
+                b'\\u00dcn\\u00efcode \\u201cquotes\\u201d', 'Ünïcode “quotes”'.encode()), entity
+
+        assert isinstance(app.json, ORJSONProvider)
+        value = {'when': date(2024, 1, 2), 'amount': Decimal('1.10'), 'b': 1, 'a': [None, True]}
+        with app.app_context():
+            assert app.json.dumps(value) == DefaultJSONProvider(app).dumps(value)
+            assert (app.json.dumps(value, separators=(',', ':'))
+                    == DefaultJSONProvider(app).dumps(value, separators=(',', ':')))
+            assert app.json.loads(app.json.dumps(value)) == json.loads(DefaultJSONProvider(app).dumps(value))
+
     def test_update_lead(self):
         """Test updating a lead"""
         self.login()
@@ -0,0 +1,96 @@
+"""Bounded prefix lookups behind the account and contact pickers on the forms.
+
+Every lookup is a range scan on a ``lower(<name>)`` index within the tenant
+and reads at most ``limit`` rows, so opening a form or typing into a picker
+costs the same for a tenant with ten accounts or a million.
+"""
+from sqlalchemy import and_, func, select
+
+from database import db
+from listing import escape_like
+from models import Account, Contact
+
+DEFAULT_LOOKUP_LIMIT = 10
+MAX_LOOKUP_LIMIT = 50
+
+
+def parse_lookup_args(args):
+    """Return ``(q, limit)`` from request args"""
+    try:
+        limit = min(max(int(args.get('limit', DEFAULT_LOOKUP_LIMIT)), 1), MAX_LOOKUP_LIMIT)
+    except (TypeError, ValueError):
+        limit = DEFAULT_LOOKUP_LIMIT
+    return (args.get('q') or '').strip(), limit
+
+
+def _prefix(expression, prefix):
+    """Case-insensitive prefix match on a ``lower()`` expression.
+
+    The bounds make it an index range on both dialects (ILIKE alone is not);
+    the LIKE keeps the result exact under any collation.
+    """
+    prefix = prefix.lower()
+    return and_(expression >= prefix, expression < prefix + '\uffff',
+                expression.like(escape_like(prefix) + '%', escape='\\'))
+
+
+def _scope(model, org_filter):
+    return [getattr(model, name) == value for name, value in org_filter.items()]
+
+
+def account_lookup_statement(org_filter, q='', limit=DEFAULT_LOOKUP_LIMIT):
+    """SELECT for accounts whose name starts with ``q`` (or the first ones by name)"""
+    name = func.lower(Account.company_name)
+    stmt = select(Account.id, Account.company_name).where(*_scope(Account, org_filter))
+    if q:
+        stmt = stmt.where(_prefix(name, q))
+    return stmt.order_by(name, Account.id).limit(limit)
+
+
+def contact_lookup_statements(org_filter, q='', account_id=None, limit=DEFAULT_LOOKUP_LIMIT):
+    """SELECTs for contacts whose first or last name starts with ``q``;
+    "first last" input matches both names"""
+    first, last = func.lower(Contact.first_name), func.lower(Contact.last_name)
+    base = (
+        select(Contact.id, Contact.first_name, Contact.last_name, Contact.email,
+               Contact.account_id, Account.company_name)
+        .outerjoin(Account, Account.id == Contact.account_id)
+        .where(*_scope(Contact, org_filter))
+    )
+    if account_id:
+        base = base.where(Contact.account_id == account_id)
+
+    # One bounded index range per name column, merged by the caller, rather
+    # than an OR that would have to sort every match before the limit
+    terms = q.split()
+    if not terms:
+        statements = [base.order_by(last, Contact.id)]
+    elif len(terms) == 1:
+        statements = [base.where(_prefix(last, q)).order_by(last, Contact.id),
+                      base.where(_prefix(first, q)).order_by(first, Contact.id)]
+    else:
+        statements = [base.where(_prefix(first, terms[0]), _prefix(last, ' '.join(terms[1:])))
+                      .order_by(first, Contact.id)]
+    return [stmt.limit(limit) for stmt in statements]
+
+
+def lookup_accounts(org_filter, q='', limit=DEFAULT_LOOKUP_LIMIT):
+    """Return up to ``limit`` ``{id, label}`` account matches"""
+    rows = db.session.execute(account_lookup_statement(org_filter, q, limit))
+    return [{'id': row.id, 'label': row.company_name} for row in rows]
+
+
+def lookup_contacts(org_filter, q='', account_id=None, limit=DEFAULT_LOOKUP_LIMIT):
+    """Return up to ``limit`` contact matches, optionally within one account"""
+    rows = {}
+    for stmt in contact_lookup_statements(org_filter, q, account_id, limit):
+        for row in db.session.execute(stmt):
+            rows[row.id] = row
+    ordered = sorted(rows.values(), key=lambda r: (r.last_name.lower(), r.first_name.lower(), r.id))
+    return [{
+        'id': row.id,
+        'label': f'{row.first_name} {row.last_name}',
+        'email': row.email,
+        'accountId': row.account_id,
+        'accountName': row.company_name,
+    } for row in ordered[:limit]]
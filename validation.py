@@ -97,6 +97,19 @@ def validate_opportunity_data(data):
     if missing:
         errors.append(f"Missing required fields: {', '.join(missing)}")
     
+    errors.extend(_validate_opportunity_fields(data))
+    return errors
+
+
+def validate_conversion_options(data):
+    """Validate the opportunity overrides accepted by lead conversion"""
+    return _validate_opportunity_fields(data)
+
+
+def _validate_opportunity_fields(data):
+    """Validate the optional opportunity fields shared by create and convert"""
+    errors = []
+    
     # Validate sales stage
     valid_stages = ['Prospecting', 'Qualification', 'Proposal', 'Negotiation', 'Closed Won', 'Closed Lost']
     if 'salesStage' in data and data['salesStage'] and data['salesStage'] not in valid_stages: